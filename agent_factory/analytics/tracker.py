@@ -1,17 +1,71 @@
 """
 Analytics Tracker
 Tracks agent interactions, latency, token usage, and channel activity.
-Stores locally (JSON) with optional ELK/Elasticsearch shipping.
+Stores locally (append-only JSONL) with optional ELK/Elasticsearch shipping.
 """
 import os
-import json
 import time
-from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
-from collections import defaultdict
+import atexit
+import hashlib
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Union
+from datetime import datetime, timezone
+from collections import deque, Counter
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: single process only
+    fcntl = None
 
-ANALYTICS_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "data", "analytics.json")
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC)
+
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - depends on installed extras
+    try:
+        import ujson as _json
+    except ImportError:
+        import json as _json
+
+    def _dumps(obj: Any) -> bytes:
+        return _json.dumps(obj).encode("utf-8")
+
+    _loads = _json.loads
+
+
+ANALYTICS_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "data", "analytics.jsonl")
+LOG_LOCK_FILE = ANALYTICS_FILE + ".lock"  # flock: appends shared, compaction exclusive
+LEGACY_ANALYTICS_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "data", "analytics.json")
+
+MAX_EVENTS = 10000          # events kept on disk / in memory
+COMPACT_EVERY = 10000       # appends between log compactions
+PENDING_MAX = 10000         # ring-buffer capacity for not-yet-flushed events
+FLUSH_BATCH = 500           # max events written per flush iteration
+FLUSH_INTERVAL_S = 0.1      # background flush period (max disk / ELK lag)
+AGG_WINDOW_HOURS = 168      # hourly aggregate buckets kept (one week)
+
+ELK_INDEX = "agent-factory-events"
+ELK_BULK_SIZE = 1000        # events per _bulk request
+_ELK_BULK_ACTION = _dumps({"index": {"_index": ELK_INDEX}}) + b"\n"
+_elk_client = None
+
+
+def _get_elk_client():
+    """Shared keep-alive HTTP client for Elasticsearch shipping."""
+    global _elk_client
+    if _elk_client is None:
+        import httpx
+        try:
+            _elk_client = httpx.Client(timeout=2, http2=True)
+        except ImportError:  # h2 not installed
+            _elk_client = httpx.Client(timeout=2)
+    return _elk_client
 
 
 def _ensure_data_dir():
@@ -19,54 +73,278 @@ def _ensure_data_dir():
 
 
 def _load_events() -> List[Dict[str, Any]]:
+    """Read the JSONL event log (one event per line)."""
     _ensure_data_dir()
-    if os.path.exists(ANALYTICS_FILE):
+    if not os.path.exists(ANALYTICS_FILE):
+        return _migrate_legacy_events()
+    events = []
+    try:
+        with open(ANALYTICS_FILE, "rb") as f:
+            data = f.read()
+    except Exception:
+        return []
+    for line in data.split(b"\n"):
+        if not line:
+            continue
         try:
-            with open(ANALYTICS_FILE, "r") as f:
-                return json.load(f)
+            events.append(_loads(line))
         except Exception:
-            return []
-    return []
+            continue  # skip a torn/partial line
+    return events[-MAX_EVENTS:]
+
+
+def _migrate_legacy_events() -> List[Dict[str, Any]]:
+    """One-off import of the old single-array analytics.json store."""
+    if not os.path.exists(LEGACY_ANALYTICS_FILE):
+        return []
+    try:
+        with open(LEGACY_ANALYTICS_FILE, "rb") as f:
+            events = _loads(f.read())[-MAX_EVENTS:]
+    except Exception:
+        return []
+    _rewrite_events(events)
+    return events
 
 
-def _save_events(events: List[Dict[str, Any]]):
+def _open_log() -> int:
+    """
+    Open the event log for appending. With O_APPEND every write lands at the
+    current end of file, so several worker processes can share the log
+    without interleaving partial lines. Compaction replaces the file, so
+    writers must go through _log_lock and _reopen_if_replaced.
+    """
     _ensure_data_dir()
-    # Keep last 10,000 events
-    events = events[-10000:]
-    with open(ANALYTICS_FILE, "w") as f:
-        json.dump(events, f, default=str)
+    return os.open(ANALYTICS_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+
+@contextmanager
+def _log_lock(exclusive: bool):
+    """
+    Cross-process lock on the event log (no-op without fcntl). Appenders
+    share it; compaction holds it alone, so no append can land in the old
+    file between the compactor's read and its replace.
+    """
+    if fcntl is None:
+        yield
+        return
+    _ensure_data_dir()
+    fd = os.open(LOG_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def _reopen_if_replaced(fd: int) -> int:
+    """fd, or a fresh one if another process compacted (replaced) the log."""
+    try:
+        st = os.stat(ANALYTICS_FILE)
+    except FileNotFoundError:
+        st = None
+    cur = os.fstat(fd)
+    if st is not None and (st.st_ino, st.st_dev) == (cur.st_ino, cur.st_dev):
+        return fd
+    os.close(fd)
+    return _open_log()
+
+
+def _append_events(fd: int, events: List[Dict[str, Any]], buf: bytearray):
+    """
+    Append a batch of events as JSONL lines in a single write, staging them
+    in the caller's reusable buffer. The buffer is overwritten in place and
+    never shrunk, so steady-state flushes allocate no batch-sized temporaries.
+    """
+    end = 0
+    for e in events:
+        line = _dumps(e)
+        buf[end:end + len(line)] = line
+        end += len(line)
+        buf[end:end + 1] = b"\n"
+        end += 1
+    with memoryview(buf) as view:
+        data = view[:end]
+        while data:
+            data = data[os.write(fd, data):]
+
+
+def _rewrite_events(events: List[Dict[str, Any]]):
+    """Compact the log down to the last MAX_EVENTS events."""
+    _ensure_data_dir()
+    tmp_path = f"{ANALYTICS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(_dumps(e) + b"\n" for e in events[-MAX_EVENTS:]))
+    os.replace(tmp_path, ANALYTICS_FILE)
+
+
+def _new_bucket() -> Dict[str, Any]:
+    return {
+        "chat": 0,
+        "total_tokens": 0,
+        "latency_sum": 0.0,
+        "errors": 0,
+        "channels": Counter(),
+        "providers": Counter(),
+        "calls": 0,
+        "call_duration_s": 0,
+        "sms": 0,
+        "image_gen": 0,
+    }
+
+
+_BUCKET_SUMS = ("chat", "total_tokens", "latency_sum", "errors",
+                "calls", "call_duration_s", "sms", "image_gen")
+
+
+def _accumulate(bucket: Dict[str, Any], event: Dict[str, Any]):
+    etype = event.get("type")
+    if etype == "chat":
+        bucket["chat"] += 1
+        bucket["total_tokens"] += event.get("total_tokens", 0)
+        bucket["latency_sum"] += event.get("latency_ms", 0)
+        if event.get("error"):
+            bucket["errors"] += 1
+        bucket["channels"][event.get("channel", "chat")] += 1
+        bucket["providers"][event.get("provider", "unknown")] += 1
+    elif etype == "call":
+        bucket["calls"] += 1
+        bucket["call_duration_s"] += event.get("duration_seconds", 0)
+    elif etype == "sms":
+        bucket["sms"] += 1
+    elif etype == "image_generation":
+        bucket["image_gen"] += 1
+
+
+def _merge_bucket(total: Dict[str, Any], bucket: Dict[str, Any]):
+    for k in _BUCKET_SUMS:
+        total[k] += bucket[k]
+    total["channels"].update(bucket["channels"])
+    total["providers"].update(bucket["providers"])
+
+
+def _format_summary(total: Dict[str, Any], agent_id: Optional[str], hours: int) -> Dict[str, Any]:
+    return {
+        "period_hours": hours,
+        "agent_id": agent_id or "all",
+        "chat": {
+            "total_interactions": total["chat"],
+            "total_tokens": total["total_tokens"],
+            "avg_latency_ms": round(total["latency_sum"] / total["chat"], 1) if total["chat"] else 0,
+            "error_count": total["errors"],
+            "by_channel": dict(total["channels"]),
+            "by_provider": dict(total["providers"]),
+        },
+        "calls": {
+            "total": total["calls"],
+            "total_duration_s": total["call_duration_s"],
+        },
+        "sms": {"total": total["sms"]},
+        "image_gen": {"total": total["image_gen"]},
+    }
+
+
+def _event_ts_ms(event: Dict[str, Any]) -> int:
+    """Epoch-ms of an event, derived from its (naive UTC) ISO timestamp if needed."""
+    if "ts" in event:
+        return event["ts"]
+    try:
+        ts = datetime.fromisoformat(event["timestamp"]).replace(tzinfo=timezone.utc)
+    except (KeyError, TypeError, ValueError):
+        return 0
+    return int(ts.timestamp() * 1000)
+
+
+_ts_key = itemgetter("ts")
+_iso_second = (-1, "")  # (epoch second, formatted "YYYY-MM-DDTHH:MM:SS")
+
+
+def _iso_utc(ts_ms: int) -> str:
+    """Naive-UTC ISO timestamp for epoch-ms, formatting each second only once."""
+    global _iso_second
+    sec, ms = divmod(ts_ms, 1000)
+    cached = _iso_second
+    if cached[0] != sec:
+        cached = _iso_second = (sec, datetime.fromtimestamp(sec, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"))
+    return f"{cached[1]}.{ms:03d}000"
 
 
 class AnalyticsTracker:
     """
     Records and queries platform analytics.
     Optional: ships events to Elasticsearch (ELK stack) if configured.
+
+    record() only updates memory and enqueues the event; a daemon thread
+    drains the pending ring buffer to disk (and ELK) in batches.
     """
 
     def __init__(self):
         self._events: List[Dict[str, Any]] = _load_events()
         self._elk_url = os.getenv("ELASTICSEARCH_URL")
+        self._appends_since_compact = 0
+
+        # Running per-hour aggregates: slot = hour % AGG_WINDOW_HOURS, each
+        # {"hour": epoch_hour, "agents": {agent_id: bucket}, "all": rollup bucket}
+        self._agg: List[Dict[str, Any]] = [
+            {"hour": -1, "agents": {}, "all": _new_bucket()} for _ in range(AGG_WINDOW_HOURS)
+        ]
+        for e in self._events:
+            e["ts"] = _event_ts_ms(e)
+            if e["ts"]:
+                self._aggregate(e, e["ts"] // 3_600_000)
+
+        # Secondary indices (references into self._events, time-ordered)
+        self._by_agent: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_type: Dict[str, List[Dict[str, Any]]] = {}
+        self._reindex()
+
+        # Pending writes: oldest events are dropped if the flusher falls behind
+        self._pending: deque = deque(maxlen=PENDING_MAX)
+        self._elk_backlog: deque = deque(maxlen=PENDING_MAX)
+        self._flush_lock = threading.Lock()
+        self._fd = _open_log()
+        self._flush_buf = bytearray(1 << 20)
+        self._wake = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="analytics-flusher", daemon=True
+        )
+        self._flusher.start()
+        atexit.register(self.flush)
 
     # ------------------------------------------------------------------ #
     #  Event recording                                                     #
     # ------------------------------------------------------------------ #
 
     def record(self, event_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        event = {
-            "id": f"{int(time.time()*1000)}-{len(self._events)}",
+        event_id, timestamp, ts_ms = self._stamp()
+        return self._store({
+            "id": event_id,
             "type": event_type,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": timestamp,
+            "ts": ts_ms,
             **data,
-        }
-        self._events.append(event)
-        _save_events(self._events)
+        })
+
+    def _stamp(self):
+        """(id, ISO timestamp, epoch-ms) header fields for a new event."""
+        ts_ms = time.time_ns() // 1_000_000
+        return f"{ts_ms}-{len(self._events)}", _iso_utc(ts_ms), ts_ms
 
-        # Optionally ship to ELK
-        if self._elk_url:
-            self._ship_to_elk(event)
+    def _store(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        self._events.append(event)
+        self._aggregate(event, event["ts"] // 3_600_000)
+        self._index(event)
+        if len(self._events) > MAX_EVENTS + FLUSH_BATCH:
+            del self._events[:-MAX_EVENTS]
+            self._reindex()
 
+        self._pending.append(event)
+        if len(self._pending) == FLUSH_BATCH:  # wake once per batch, not per event
+            self._wake.set()
         return event
 
+    # The typed recorders build the final event dict in one literal rather
+    # than going through record()'s intermediate data dict.
+
     def record_chat(
         self,
         agent_id: str,
@@ -78,8 +356,14 @@ class AnalyticsTracker:
         provider: str = "",
         model: str = "",
         error: Optional[str] = None,
+        generation_stall_ms: float = 0,
     ):
-        return self.record("chat", {
+        event_id, timestamp, ts_ms = self._stamp()
+        return self._store({
+            "id": event_id,
+            "type": "chat",
+            "timestamp": timestamp,
+            "ts": ts_ms,
             "agent_id": agent_id,
             "session_id": session_id,
             "channel": channel,
@@ -90,10 +374,16 @@ class AnalyticsTracker:
             "provider": provider,
             "model": model,
             "error": error,
+            "generation_stall_ms": generation_stall_ms,
         })
 
     def record_call(self, agent_id: str, call_sid: str, direction: str, duration_s: int = 0):
-        return self.record("call", {
+        event_id, timestamp, ts_ms = self._stamp()
+        return self._store({
+            "id": event_id,
+            "type": "call",
+            "timestamp": timestamp,
+            "ts": ts_ms,
             "agent_id": agent_id,
             "call_sid": call_sid,
             "direction": direction,
@@ -101,20 +391,112 @@ class AnalyticsTracker:
         })
 
     def record_sms(self, agent_id: str, message_sid: str, direction: str):
-        return self.record("sms", {
+        event_id, timestamp, ts_ms = self._stamp()
+        return self._store({
+            "id": event_id,
+            "type": "sms",
+            "timestamp": timestamp,
+            "ts": ts_ms,
             "agent_id": agent_id,
             "message_sid": message_sid,
             "direction": direction,
         })
 
-    def record_image_gen(self, agent_id: str, prompt: str, model: str, count: int = 1):
-        return self.record("image_generation", {
+    def record_image_gen(self, agent_id: str, prompt: Union[str, bytes], model: str, count: int = 1):
+        """
+        Record an image generation. Only a 200-char preview of the prompt is
+        stored, plus a short hash of the full prompt for grouping repeats.
+        Raw request bytes are accepted to avoid decoding the whole prompt.
+        """
+        if isinstance(prompt, (bytes, bytearray, memoryview)):
+            raw = memoryview(prompt)
+            preview = bytes(raw[:800]).decode("utf-8", "ignore")[:200]
+        else:
+            raw = prompt.encode("utf-8")
+            preview = prompt[:200]
+        event_id, timestamp, ts_ms = self._stamp()
+        return self._store({
+            "id": event_id,
+            "type": "image_generation",
+            "timestamp": timestamp,
+            "ts": ts_ms,
             "agent_id": agent_id,
-            "prompt": prompt[:200],
+            "prompt": preview,
+            "prompt_hash": hashlib.blake2b(raw, digest_size=8).hexdigest(),
             "model": model,
             "image_count": count,
         })
 
+    def _index(self, event: Dict[str, Any]):
+        agent_key = event.get("agent_id")
+        if agent_key:
+            self._by_agent.setdefault(agent_key, []).append(event)
+        self._by_type.setdefault(event.get("type"), []).append(event)
+
+    def _reindex(self):
+        self._by_agent = {}
+        self._by_type = {}
+        for e in self._events:
+            self._index(e)
+
+    def _aggregate(self, event: Dict[str, Any], hour: int):
+        """Fold an event into its hourly bucket (evicting a stale slot)."""
+        slot = self._agg[hour % AGG_WINDOW_HOURS]
+        if slot["hour"] != hour:
+            if slot["hour"] > hour:
+                return  # older than the aggregate window
+            slot["hour"] = hour
+            slot["agents"] = {}
+            slot["all"] = _new_bucket()
+        agent_key = event.get("agent_id") or ""
+        bucket = slot["agents"].get(agent_key)
+        if bucket is None:
+            bucket = slot["agents"][agent_key] = _new_bucket()
+        _accumulate(bucket, event)
+        _accumulate(slot["all"], event)
+
+    # ------------------------------------------------------------------ #
+    #  Background flushing                                                 #
+    # ------------------------------------------------------------------ #
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL_S)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[Analytics] flush failed: {e}")
+
+    def flush(self):
+        """Write all pending events to disk and ship them to ELK if configured."""
+        with self._flush_lock:
+            if self._pending:
+                with _log_lock(exclusive=False):
+                    self._fd = _reopen_if_replaced(self._fd)
+                    while self._pending:
+                        batch = []
+                        while self._pending and len(batch) < FLUSH_BATCH:
+                            batch.append(self._pending.popleft())
+                        _append_events(self._fd, batch, self._flush_buf)
+                        self._appends_since_compact += len(batch)
+
+                        if self._elk_url:
+                            self._elk_backlog.extend(batch)
+
+            # Optionally ship to ELK
+            if self._elk_backlog:
+                self._ship_to_elk()
+
+            if self._appends_since_compact >= COMPACT_EVERY:
+                with _log_lock(exclusive=True):
+                    _rewrite_events(_load_events())
+                    # The compacted log is a new file; reopen our append handle
+                    # (other processes notice the new inode on their next flush)
+                    os.close(self._fd)
+                    self._fd = _open_log()
+                self._appends_since_compact = 0
+
     # ------------------------------------------------------------------ #
     #  Queries                                                             #
     # ------------------------------------------------------------------ #
@@ -126,68 +508,80 @@ class AnalyticsTracker:
         hours: int = 24,
         limit: int = 100,
     ) -> List[Dict[str, Any]]:
-        cutoff = (datetime.utcnow() - timedelta(hours=hours)).isoformat()
-        filtered = [
-            e for e in self._events
-            if e.get("timestamp", "") >= cutoff
-            and (not agent_id or e.get("agent_id") == agent_id)
-            and (not event_type or e.get("type") == event_type)
-        ]
-        return filtered[-limit:]
+        cutoff_ms = time.time_ns() // 1_000_000 - hours * 3_600_000
+
+        # Start from the smallest candidate set the filters allow; only the
+        # filter that set doesn't already guarantee is checked per event
+        candidates, field, value = self._events, None, None
+        if agent_id:
+            candidates = self._by_agent.get(agent_id, [])
+        if event_type:
+            by_type = self._by_type.get(event_type, [])
+            if len(by_type) < len(candidates):
+                candidates = by_type
+                if agent_id:
+                    field, value = "agent_id", agent_id
+            elif agent_id:
+                field, value = "type", event_type
+            else:
+                candidates = by_type
+
+        # Lists are append-ordered by time: binary search the window start
+        start = bisect_left(candidates, cutoff_ms, key=_ts_key)
+        if field is None:
+            return candidates[max(start, len(candidates) - limit):]
+        return [e for e in candidates[start:] if e.get(field) == value][-limit:]
 
     def summary(self, agent_id: Optional[str] = None, hours: int = 24) -> Dict[str, Any]:
-        events = self.get_events(agent_id=agent_id, hours=hours, limit=10000)
+        """
+        Aggregate stats for the last `hours`. Served from the hourly
+        buckets (hour-granular window start); longer windows fall back
+        to scanning the event list.
+        """
+        if not 0 < hours <= AGG_WINDOW_HOURS:
+            return self._summary_scan(agent_id, hours)
 
-        chat_events = [e for e in events if e["type"] == "chat"]
-        call_events = [e for e in events if e["type"] == "call"]
-        sms_events = [e for e in events if e["type"] == "sms"]
-        img_events = [e for e in events if e["type"] == "image_generation"]
+        now_s = time.time_ns() // 1_000_000_000
+        now_hour = now_s // 3600
+        first_hour = (now_s - hours * 3600) // 3600
+        total = _new_bucket()
+        for hour in range(first_hour, now_hour + 1):
+            slot = self._agg[hour % AGG_WINDOW_HOURS]
+            if slot["hour"] != hour:
+                continue
+            bucket = slot["agents"].get(agent_id) if agent_id else slot["all"]
+            if bucket is not None:
+                _merge_bucket(total, bucket)
 
-        total_tokens = sum(e.get("total_tokens", 0) for e in chat_events)
-        avg_latency = (
-            sum(e.get("latency_ms", 0) for e in chat_events) / len(chat_events)
-            if chat_events else 0
-        )
-        errors = [e for e in chat_events if e.get("error")]
-
-        # Channel breakdown
-        channels: Dict[str, int] = defaultdict(int)
-        for e in chat_events:
-            channels[e.get("channel", "chat")] += 1
-
-        # Provider breakdown
-        providers: Dict[str, int] = defaultdict(int)
-        for e in chat_events:
-            providers[e.get("provider", "unknown")] += 1
-
-        return {
-            "period_hours": hours,
-            "agent_id": agent_id or "all",
-            "chat": {
-                "total_interactions": len(chat_events),
-                "total_tokens": total_tokens,
-                "avg_latency_ms": round(avg_latency, 1),
-                "error_count": len(errors),
-                "by_channel": dict(channels),
-                "by_provider": dict(providers),
-            },
-            "calls": {
-                "total": len(call_events),
-                "total_duration_s": sum(e.get("duration_seconds", 0) for e in call_events),
-            },
-            "sms": {"total": len(sms_events)},
-            "image_gen": {"total": len(img_events)},
-        }
+        return _format_summary(total, agent_id, hours)
+
+    def _summary_scan(self, agent_id: Optional[str] = None, hours: int = 24) -> Dict[str, Any]:
+        """Single pass over the raw events (windows beyond the bucket ring)."""
+        total = _new_bucket()
+        for e in self.get_events(agent_id=agent_id, hours=hours, limit=10000):
+            _accumulate(total, e)
+        return _format_summary(total, agent_id, hours)
 
     # ------------------------------------------------------------------ #
     #  ELK shipping                                                        #
     # ------------------------------------------------------------------ #
 
-    def _ship_to_elk(self, event: Dict[str, Any]):
-        """Ship event to Elasticsearch index."""
-        try:
-            import httpx
-            url = f"{self._elk_url}/agent-factory-events/_doc"
-            httpx.post(url, json=event, timeout=2)
-        except Exception:
-            pass  # ELK shipping is best-effort
+    def _ship_to_elk(self):
+        """Ship backlogged events to Elasticsearch via the _bulk API."""
+        url = f"{self._elk_url}/_bulk"
+        while self._elk_backlog:
+            batch = []
+            while self._elk_backlog and len(batch) < ELK_BULK_SIZE:
+                batch.append(self._elk_backlog.popleft())
+            body = b"".join(_ELK_BULK_ACTION + _dumps(e) + b"\n" for e in batch)
+            try:
+                resp = _get_elk_client().post(
+                    url, content=body, headers={"Content-Type": "application/x-ndjson"}
+                )
+                retry = resp.status_code in (429, 503)
+            except Exception:
+                retry = True  # ELK shipping is best-effort
+            if retry:
+                # Back off until the next flush; keep original ordering
+                self._elk_backlog.extendleft(reversed(batch))
+                return
@@ -3,15 +3,23 @@ Agent Factory — creates and runs configured agents.
 Bridges registry configs to live LLM sessions with RAG, soul, and tool support.
 """
 import os
-from typing import Dict, Any, Optional, List
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, List, Iterator, Iterable, Callable
 from datetime import datetime
 
 from agent_factory.registry import AgentRegistry
-from agent_factory.soul import parse_soul, build_system_prompt_from_soul
+from agent_factory.soul import parse_soul_cached, build_system_prompt_from_soul, invalidate as invalidate_soul
 from agent_factory.rag import RAGManager
 from agent_factory.integrations.llm_switch import LLMRouter
 
 
+MAX_SESSIONS = 10_000  # least-recently-used sessions are evicted past this
+MAX_HISTORY = 100      # messages kept per session (last 50 pairs)
+MAX_RAG_CONTEXTS = 2048  # memoized (namespace, message) -> RAG context strings
+
+
 class AgentFactory:
     """
     Orchestrates agent creation, configuration, and live chat sessions.
@@ -21,23 +29,31 @@ class AgentFactory:
         self.registry = AgentRegistry()
         self.rag = RAGManager()
         self.router = LLMRouter()
-        # Active sessions: agent_id -> list of messages
-        self._sessions: Dict[str, List[Dict[str, str]]] = {}
+        # Active sessions (LRU order): "agent_id:session_id" -> bounded message history
+        self._sessions: "OrderedDict[str, deque]" = OrderedDict()
+        # LRU of built RAG contexts, keyed by (namespace, blake2b(message))
+        self._rag_contexts: "OrderedDict[tuple, str]" = OrderedDict()
+        # namespace -> bumped on every ingest, so a context built from the
+        # old documents is never stored after the invalidate
+        self._rag_generations: Dict[str, int] = {}
+        # Guards both LRUs (sessions, RAG contexts): calls run on different threads
+        self._lock = threading.Lock()
 
     # ------------------------------------------------------------------ #
     #  Agent CRUD (delegate to registry)                                   #
     # ------------------------------------------------------------------ #
 
     def create_agent(self, config: Dict[str, Any]) -> Dict[str, Any]:
-        agent = self.registry.create_agent(config)
+        with self.registry.batch():  # create + prompt update -> one registry write
+            agent = self.registry.create_agent(config)
 
-        # If soul content provided, parse and update system prompt
-        soul_content = config.get("soul")
-        if soul_content:
-            soul = parse_soul(soul_content)
-            enhanced_prompt = build_system_prompt_from_soul(soul, config.get("system_prompt", ""))
-            self.registry.update_agent(agent["id"], {"system_prompt": enhanced_prompt})
-            agent["system_prompt"] = enhanced_prompt
+            # If soul content provided, parse and update system prompt
+            soul_content = config.get("soul")
+            if soul_content:
+                soul = parse_soul_cached(soul_content)
+                enhanced_prompt = build_system_prompt_from_soul(soul, config.get("system_prompt", ""))
+                self.registry.update_agent(agent["id"], {"system_prompt": enhanced_prompt})
+                agent["system_prompt"] = enhanced_prompt
 
         # If RAG docs provided at creation, ingest them
         rag_docs = config.get("rag_documents", [])
@@ -49,21 +65,32 @@ class AgentFactory:
     def get_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
         return self.registry.get_agent(agent_id)
 
+    def get_public_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        return self.registry.get_public_agent(agent_id)
+
     def list_agents(self) -> List[Dict[str, Any]]:
         return self.registry.list_agents()
 
+    def inbound_agent_id(self, to_number: str) -> Optional[str]:
+        return self.registry.route_inbound(to_number)
+
     def update_agent(self, agent_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        # Re-apply soul if updated
-        if "soul" in updates and updates["soul"]:
-            soul = parse_soul(updates["soul"])
-            existing = self.registry.get_agent(agent_id) or {}
-            enhanced = build_system_prompt_from_soul(soul, existing.get("system_prompt", ""))
-            updates["system_prompt"] = enhanced
-        return self.registry.update_agent(agent_id, updates)
+        def _apply(agent: Dict[str, Any]) -> Dict[str, Any]:
+            # Re-apply soul if updated
+            if "soul" in updates and updates["soul"]:
+                if agent.get("soul") != updates["soul"]:
+                    invalidate_soul(agent.get("soul"))
+                soul = parse_soul_cached(updates["soul"])
+                updates["system_prompt"] = build_system_prompt_from_soul(soul, agent.get("system_prompt", ""))
+            return updates
+        return self.registry.mutate(agent_id, _apply)
 
     def delete_agent(self, agent_id: str) -> bool:
-        # Clean up sessions
-        self._sessions.pop(agent_id, None)
+        # Clean up sessions (keyed "agent_id:session_id")
+        prefix = f"{agent_id}:"
+        with self._lock:
+            for key in [k for k in self._sessions if k.startswith(prefix)]:
+                del self._sessions[key]
         return self.registry.delete_agent(agent_id)
 
     # ------------------------------------------------------------------ #
@@ -86,14 +113,9 @@ class AgentFactory:
             return {"error": f"Agent {agent_id} not found"}
 
         key = f"{agent_id}:{session_id or 'default'}"
-        history = self._sessions.setdefault(key, [])
+        history = self._get_session(key)
 
-        # Build system prompt (with optional RAG context)
-        system_prompt = agent.get("system_prompt", "You are a helpful assistant.")
-        if agent.get("rag_enabled"):
-            context = self.rag.build_context(agent["rag_namespace"], message)
-            if context:
-                system_prompt = f"{system_prompt}\n\n{context}"
+        system_prompt = self._system_prompt(agent, message)
 
         # Add user message
         history.append({"role": "user", "content": message})
@@ -103,17 +125,13 @@ class AgentFactory:
             provider=agent.get("llm_provider", "anthropic"),
             model=agent.get("llm_model", "claude-sonnet-4-20250514"),
             system_prompt=system_prompt,
-            messages=history,
+            messages=list(history),
             max_tokens=agent.get("max_tokens", 2048),
         )
 
-        # Store assistant response
+        # Store assistant response (deque drops the oldest past MAX_HISTORY)
         history.append({"role": "assistant", "content": response_text})
 
-        # Trim history (keep last 50 pairs)
-        if len(history) > 100:
-            self._sessions[key] = history[-100:]
-
         return {
             "agent_id": agent_id,
             "agent_name": agent.get("name", "Agent"),
@@ -126,24 +144,112 @@ class AgentFactory:
             "llm_model": agent.get("llm_model"),
         }
 
+    def chat_stream(
+        self,
+        agent_id: str,
+        message: str,
+        session_id: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Like chat(), but yields the response text in pieces as the LLM
+        produces it. The full reply is added to the session history at the end.
+        """
+        agent = self.registry.get_agent(agent_id)
+        if not agent:
+            raise KeyError(agent_id)
+
+        history = self._get_session(f"{agent_id}:{session_id or 'default'}")
+        system_prompt = self._system_prompt(agent, message)
+        history.append({"role": "user", "content": message})
+
+        parts = []
+        for delta in self.router.stream(
+            provider=agent.get("llm_provider", "anthropic"),
+            model=agent.get("llm_model", "claude-sonnet-4-20250514"),
+            system_prompt=system_prompt,
+            messages=list(history),
+            max_tokens=agent.get("max_tokens", 2048),
+        ):
+            parts.append(delta)
+            yield delta
+        history.append({"role": "assistant", "content": "".join(parts)})
+
+    def _system_prompt(self, agent: Dict[str, Any], message: str) -> str:
+        """The agent's system prompt, with RAG context for `message` if enabled."""
+        system_prompt = agent.get("system_prompt", "You are a helpful assistant.")
+        if agent.get("rag_enabled"):
+            context = self._rag_context(agent["rag_namespace"], message)
+            if context:
+                system_prompt = f"{system_prompt}\n\n{context}"
+        return system_prompt
+
+    def _get_session(self, key: str) -> deque:
+        """Return (creating if needed) a session's history, marking it recently used."""
+        with self._lock:
+            history = self._sessions.get(key)
+            if history is None:
+                history = self._sessions[key] = deque(maxlen=MAX_HISTORY)
+                if len(self._sessions) > MAX_SESSIONS:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(key)
+            return history
+
     def reset_session(self, agent_id: str, session_id: str = "default"):
         key = f"{agent_id}:{session_id}"
-        self._sessions.pop(key, None)
+        with self._lock:
+            self._sessions.pop(key, None)
 
     # ------------------------------------------------------------------ #
     #  RAG management                                                      #
     # ------------------------------------------------------------------ #
 
+    def _rag_context(self, namespace: str, message: str) -> str:
+        """RAG context for a message, memoized until the namespace changes."""
+        key = (namespace, hashlib.blake2b(message.encode(), digest_size=16).digest())
+        with self._lock:
+            context = self._rag_contexts.get(key)
+            if context is not None:
+                self._rag_contexts.move_to_end(key)
+                return context
+            generation = self._rag_generations.get(namespace, 0)
+
+        # Built outside the lock: it may embed the query over the network
+        context = self.rag.build_context(namespace, message)
+        with self._lock:
+            if self._rag_generations.get(namespace, 0) == generation:
+                self._rag_contexts[key] = context
+                if len(self._rag_contexts) > MAX_RAG_CONTEXTS:
+                    self._rag_contexts.popitem(last=False)
+        return context
+
+    def _invalidate_rag_contexts(self, namespace: str):
+        with self._lock:
+            self._rag_generations[namespace] = self._rag_generations.get(namespace, 0) + 1
+            for key in [k for k in self._rag_contexts if k[0] == namespace]:
+                del self._rag_contexts[key]
+
     def ingest_documents(self, agent_id: str, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
-        agent = self.registry.get_agent(agent_id)
-        if not agent:
+        return self._ingest(agent_id, lambda namespace: self.rag.ingest_documents(namespace, documents))
+
+    def ingest_text_stream(self, agent_id: str, pieces: Iterable[str], source: str = "upload") -> Dict[str, Any]:
+        """Ingest one document whose text arrives in pieces (e.g. read from an upload)."""
+        return self._ingest(agent_id, lambda namespace: self.rag.ingest_stream(namespace, pieces, source))
+
+    def _ingest(self, agent_id: str, ingest: Callable[[str], List[str]]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+
+        def _apply(agent: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            namespace = agent.get("rag_namespace", agent_id)
+            ids = ingest(namespace)
+            self._invalidate_rag_contexts(namespace)
+            result.update(ingested_chunks=len(ids), namespace=namespace)
+            # Auto-enable RAG if not already
+            return None if agent.get("rag_enabled") else {"rag_enabled": True}
+
+        if self.registry.mutate(agent_id, _apply) is None:
             return {"error": "Agent not found"}
-        namespace = agent.get("rag_namespace", agent_id)
-        ids = self.rag.ingest_documents(namespace, documents)
-        # Auto-enable RAG if not already
-        if not agent.get("rag_enabled"):
-            self.registry.update_agent(agent_id, {"rag_enabled": True})
-        return {"ingested_chunks": len(ids), "namespace": namespace}
+        return result
 
     def rag_stats(self, agent_id: str) -> Dict[str, Any]:
         agent = self.registry.get_agent(agent_id)
@@ -167,17 +273,19 @@ class AgentFactory:
         if not validation["valid"]:
             return {"error": "Soul validation failed", "warnings": validation["warnings"]}
 
-        agent = self.registry.get_agent(agent_id)
-        if not agent:
-            return {"error": "Agent not found"}
-
         soul = validation["parsed"]
-        enhanced_prompt = build_system_prompt_from_soul(soul, agent.get("system_prompt", ""))
-        self.registry.update_agent(agent_id, {
-            "soul": soul_content,
-            "system_prompt": enhanced_prompt,
-            "name": soul.get("name") or agent.get("name"),
-        })
+
+        def _apply(agent: Dict[str, Any]) -> Dict[str, Any]:
+            if agent.get("soul") != soul_content:
+                invalidate_soul(agent.get("soul"))  # the old soul's prompts are dead weight now
+            return {
+                "soul": soul_content,
+                "system_prompt": build_system_prompt_from_soul(soul, agent.get("system_prompt", "")),
+                "name": soul.get("name") or agent.get("name"),
+            }
+
+        if self.registry.mutate(agent_id, _apply) is None:
+            return {"error": "Agent not found"}
         return {"status": "ok", "parsed": soul, "warnings": validation["warnings"]}
 
     # ------------------------------------------------------------------ #
@@ -0,0 +1,111 @@
+"""
+Response cache for LLM calls.
+Prompts with the same words in the same order (ignoring case and
+punctuation) are answered from memory instead of a new API call. A
+bag-of-words similarity match is available but off by default: it ignores
+word order and negation, so it is only safe where a caller has checked that.
+"""
+import re
+import math
+import time
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+SIM_THRESHOLD: Optional[float] = None  # cosine similarity for a fuzzy hit; None = exact only
+CACHE_TTL_S = 3600     # entries older than this are ignored
+MAX_ENTRIES = 1024     # per namespace, least recently used evicted first
+MAX_NAMESPACES = 256   # namespaces kept, least recently used dropped first
+
+_TOKEN_RE = re.compile(r"\w+")
+
+Vector = Dict[str, float]
+
+
+def _embed(text: str) -> Tuple[str, Vector]:
+    """Normalized key + unit-length term-frequency vector for `text`."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    counts = Counter(tokens)
+    norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+    return " ".join(tokens), {t: c / norm for t, c in counts.items()}
+
+
+def _cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(t, 0.0) for t, w in a.items())
+
+
+class SemanticCache:
+    """Thread-safe, namespaced LRU of (prompt vector → response) with a TTL."""
+
+    def __init__(
+        self,
+        threshold: Optional[float] = SIM_THRESHOLD,
+        ttl_s: float = CACHE_TTL_S,
+        max_entries: int = MAX_ENTRIES,
+        max_namespaces: int = MAX_NAMESPACES,
+    ):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_namespaces = max_namespaces
+        self._spaces: "OrderedDict[str, OrderedDict[str, Tuple[Vector, float, Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live_space(self, namespace: str, now: float):
+        """Namespace with expired entries dropped; None (and removed) if empty. Lock held."""
+        space = self._spaces.get(namespace)
+        if space is None:
+            return None
+        for k in [k for k, entry in space.items() if entry[1] < now]:
+            del space[k]
+        if not space:
+            del self._spaces[namespace]
+            return None
+        self._spaces.move_to_end(namespace)
+        return space
+
+    def get(self, namespace: str, text: str) -> Optional[Dict[str, Any]]:
+        key, vec = _embed(text)
+        now = time.monotonic()
+        with self._lock:
+            space = self._live_space(namespace, now)
+            if space is None:
+                return None
+            # Exact (normalized) match first, then nearest neighbour by cosine
+            hit = space.get(key)
+            if hit is None:
+                if self.threshold is None:
+                    return None
+                hit, key, best = None, None, self.threshold
+                for k, entry in space.items():
+                    sim = _cosine(vec, entry[0])
+                    if sim >= best:
+                        hit, key, best = entry, k, sim
+                if hit is None:
+                    return None
+            space.move_to_end(key)
+            return hit[2]
+
+    def put(self, namespace: str, text: str, response: Dict[str, Any]):
+        key, vec = _embed(text)
+        now = time.monotonic()
+        with self._lock:
+            space = self._live_space(namespace, now)
+            if space is None:
+                space = self._spaces[namespace] = OrderedDict()
+                while len(self._spaces) > self.max_namespaces:
+                    self._spaces.popitem(last=False)
+            space[key] = (vec, now + self.ttl_s, response)
+            space.move_to_end(key)
+            while len(space) > self.max_entries:
+                space.popitem(last=False)
+
+    def clear(self, namespace: Optional[str] = None):
+        with self._lock:
+            if namespace is None:
+                self._spaces.clear()
+            else:
+                self._spaces.pop(namespace, None)
@@ -4,10 +4,14 @@ Real-time voice and video streaming for agent interactions.
 Supports: room creation, token generation, participant management.
 """
 import os
+import asyncio
+import threading
+from functools import lru_cache
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 
 
+@lru_cache(maxsize=None)
 def _livekit_available() -> bool:
     try:
         import livekit  # noqa
@@ -16,6 +20,11 @@ def _livekit_available() -> bool:
         return False
 
 
+def _lkapi():
+    from livekit import api as lkapi
+    return lkapi
+
+
 class LiveKitManager:
     """
     Manages LiveKit rooms and access tokens for voice/video agents.
@@ -26,22 +35,66 @@ class LiveKitManager:
         self.url = os.getenv("LIVEKIT_URL", "wss://your-livekit-server.com")
         self.api_key = os.getenv("LIVEKIT_API_KEY", "")
         self.api_secret = os.getenv("LIVEKIT_API_SECRET", "")
+        # Dedicated event loop thread + API client, created on first use.
+        # The client's HTTP session is bound to that loop, so every LiveKit
+        # coroutine is scheduled there.
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._api = None
+        # Pay the SDK import cost at startup rather than on the first request.
+        # livekit-rtc alone has no livekit.api; requests then report the error.
+        if self._configured() and _livekit_available():
+            try:
+                _lkapi()
+            except ImportError:
+                pass
 
     def _configured(self) -> bool:
         return bool(self.api_key and self.api_secret)
 
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="livekit-loop", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def _get_api(self):
+        """Shared LiveKitAPI client (only call from the LiveKit loop)."""
+        if self._api is None:
+            self._api = _lkapi().LiveKitAPI(url=self.url, api_key=self.api_key, api_secret=self.api_secret)
+        return self._api
+
+    async def _create_room(self, room_name: str, empty_timeout: int) -> Dict[str, Any]:
+        lkapi = _lkapi()
+        room = await self._get_api().room.create_room(
+            lkapi.CreateRoomRequest(name=room_name, empty_timeout=empty_timeout)
+        )
+        return {"room_name": room.name, "sid": room.sid, "url": self.url}
+
     def create_room(self, room_name: str, empty_timeout: int = 300) -> Dict[str, Any]:
         """Create a LiveKit room."""
         if not self._configured():
             return {"error": "LiveKit not configured (LIVEKIT_API_KEY / LIVEKIT_API_SECRET missing)"}
         try:
-            from livekit import api as lkapi
-            client = lkapi.LiveKitAPI(url=self.url, api_key=self.api_key, api_secret=self.api_secret)
-            import asyncio
-            room = asyncio.run(client.room.create_room(
-                lkapi.CreateRoomRequest(name=room_name, empty_timeout=empty_timeout)
-            ))
-            return {"room_name": room.name, "sid": room.sid, "url": self.url}
+            future = asyncio.run_coroutine_threadsafe(
+                self._create_room(room_name, empty_timeout), self._get_loop()
+            )
+            return future.result()
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def acreate_room(self, room_name: str, empty_timeout: int = 300) -> Dict[str, Any]:
+        """Async create_room — awaits the LiveKit loop without blocking the caller's loop."""
+        if not self._configured():
+            return {"error": "LiveKit not configured (LIVEKIT_API_KEY / LIVEKIT_API_SECRET missing)"}
+        try:
+            future = asyncio.run_coroutine_threadsafe(
+                self._create_room(room_name, empty_timeout), self._get_loop()
+            )
+            return await asyncio.wrap_future(future)
         except Exception as e:
             return {"error": str(e)}
 
@@ -58,7 +111,7 @@ class LiveKitManager:
         if not self._configured():
             return {"error": "LiveKit not configured"}
         try:
-            from livekit import api as lkapi
+            lkapi = _lkapi()
             token = (
                 lkapi.AccessToken(self.api_key, self.api_secret)
                 .with_identity(identity or participant_name)
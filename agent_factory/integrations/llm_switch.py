@@ -3,7 +3,10 @@ LLM Router — unified interface for switching between LLM providers.
 Supports: Anthropic Claude, xAI Grok, OpenAI GPT, Moonshot Kimi.
 """
 import os
-from typing import List, Dict, Any, Optional
+import importlib
+import threading
+from functools import partial
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 
 
 PROVIDERS = {
@@ -15,6 +18,7 @@ PROVIDERS = {
         ],
         "default": "claude-sonnet-4-20250514",
         "env_key": "ANTHROPIC_API_KEY",
+        "sdk": "anthropic",
         "description": "Anthropic Claude — state-of-the-art reasoning and instruction following",
     },
     "xai": {
@@ -26,6 +30,7 @@ PROVIDERS = {
         ],
         "default": "grok-2",
         "env_key": "XAI_API_KEY",
+        "sdk": "openai",
         "description": "xAI Grok — real-time web knowledge, multimodal reasoning",
     },
     "openai": {
@@ -37,6 +42,7 @@ PROVIDERS = {
         ],
         "default": "gpt-4o",
         "env_key": "OPENAI_API_KEY",
+        "sdk": "openai",
         "description": "OpenAI GPT — versatile, widely integrated LLMs",
     },
     "kimi": {
@@ -48,14 +54,80 @@ PROVIDERS = {
         ],
         "default": "kimi-k2",
         "env_key": "KIMI_API_KEY",
+        "sdk": "openai",
         "description": "Moonshot Kimi — cost-effective long-context model",
     },
 }
 
+# OpenAI-compatible endpoints (None: the SDK default)
+_BASE_URLS = {"xai": "https://api.x.ai/v1", "kimi": "https://api.moonshot.cn/v1"}
+
 
 class LLMRouter:
     """Routes LLM completions to the appropriate provider."""
 
+    def __init__(self):
+        # SDK clients keyed by (provider, base_url, api_key) so connection
+        # pools / TLS sessions are reused across completions
+        self._clients: Dict[Tuple[str, Optional[str], str], Any] = {}
+        self._clients_lock = threading.Lock()
+        # provider -> fn(model, system_prompt, messages, max_tokens, temperature)
+        self._dispatch = {
+            "anthropic": self._anthropic,
+            "xai": self._xai,
+            "openai": partial(self._openai_compat, "openai"),
+            "kimi": partial(self._openai_compat, "kimi"),
+        }
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-read provider API keys from the environment and pre-import the
+        SDKs of configured providers, so the import cost is paid at startup
+        rather than on the first chat request.
+        """
+        self._configured: Dict[str, bool] = {
+            name: bool(os.environ.get(cfg["env_key"])) for name, cfg in PROVIDERS.items()
+        }
+        self._sdk: Dict[str, Any] = {}
+        for name, configured in self._configured.items():
+            if configured:
+                try:
+                    self._load_sdk(name)
+                except ImportError:
+                    pass  # reported when the provider is actually used
+
+    def _load_sdk(self, provider: str):
+        sdk = self._sdk.get(provider)
+        if sdk is None:
+            sdk = self._sdk[provider] = importlib.import_module(PROVIDERS[provider]["sdk"])
+        return sdk
+
+    def _get_client(self, provider: str, key: str, base_url: Optional[str] = None):
+        cache_key = (provider, base_url, key)
+        client = self._clients.get(cache_key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(cache_key)
+                if client is None:
+                    sdk = self._load_sdk(provider)
+                    if provider == "anthropic":
+                        client = sdk.Anthropic(api_key=key)
+                    else:
+                        client = sdk.OpenAI(api_key=key, base_url=base_url)
+                    self._clients[cache_key] = client
+        return client
+
+    def close(self):
+        """Close all cached SDK clients."""
+        with self._clients_lock:
+            for client in self._clients.values():
+                try:
+                    client.close()
+                except Exception:
+                    pass
+            self._clients.clear()
+
     def complete(
         self,
         provider: str,
@@ -66,16 +138,28 @@ class LLMRouter:
         temperature: float = 0.7,
     ) -> str:
         """Run a completion and return the response text."""
-        provider = provider.lower()
+        fn = self._dispatch.get(provider) or self._dispatch.get(provider.lower())
+        if fn is None:
+            return f"[Error] Unsupported provider: {provider.lower()}"
+        return fn(model, system_prompt, messages, max_tokens, temperature)
 
-        if provider == "anthropic":
-            return self._anthropic(model, system_prompt, messages, max_tokens, temperature)
-        elif provider == "xai":
-            return self._xai(model, system_prompt, messages, max_tokens, temperature)
-        elif provider in ("openai", "kimi"):
-            return self._openai_compat(provider, model, system_prompt, messages, max_tokens, temperature)
+    def stream(
+        self,
+        provider: str,
+        model: str,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+    ) -> Iterator[str]:
+        """Run a completion, yielding response text deltas as they arrive."""
+        provider = provider.lower()
+        if provider not in PROVIDERS:
+            yield f"[Error] Unsupported provider: {provider}"
+        elif provider == "anthropic":
+            yield from self._anthropic_stream(model, system_prompt, messages, max_tokens, temperature)
         else:
-            return f"[Error] Unsupported provider: {provider}"
+            yield from self._openai_compat_stream(provider, model, system_prompt, messages, max_tokens, temperature)
 
     # ------------------------------------------------------------------ #
     #  Anthropic                                                           #
@@ -83,11 +167,10 @@ class LLMRouter:
 
     def _anthropic(self, model, system_prompt, messages, max_tokens, temperature):
         try:
-            from anthropic import Anthropic
             key = os.getenv("ANTHROPIC_API_KEY")
             if not key:
                 return "[Error] ANTHROPIC_API_KEY not set"
-            client = Anthropic(api_key=key)
+            client = self._get_client("anthropic", key)
             resp = client.messages.create(
                 model=model,
                 max_tokens=max_tokens,
@@ -98,20 +181,33 @@ class LLMRouter:
         except Exception as e:
             return f"[Anthropic Error] {e}"
 
+    def _anthropic_stream(self, model, system_prompt, messages, max_tokens, temperature):
+        key = os.getenv("ANTHROPIC_API_KEY")
+        if not key:
+            yield "[Error] ANTHROPIC_API_KEY not set"
+            return
+        try:
+            client = self._get_client("anthropic", key)
+            with client.messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                system=system_prompt,
+                messages=messages,
+            ) as stream:
+                yield from stream.text_stream
+        except Exception as e:
+            yield f"[Anthropic Error] {e}"
+
     # ------------------------------------------------------------------ #
     #  xAI Grok (OpenAI-compatible endpoint)                              #
     # ------------------------------------------------------------------ #
 
     def _xai(self, model, system_prompt, messages, max_tokens, temperature):
         try:
-            import openai
             key = os.getenv("XAI_API_KEY")
             if not key:
                 return "[Error] XAI_API_KEY not set"
-            client = openai.OpenAI(
-                api_key=key,
-                base_url="https://api.x.ai/v1",
-            )
+            client = self._get_client("xai", key, base_url=_BASE_URLS["xai"])
             msgs = [{"role": "system", "content": system_prompt}] + messages
             resp = client.chat.completions.create(
                 model=model,
@@ -129,17 +225,12 @@ class LLMRouter:
 
     def _openai_compat(self, provider, model, system_prompt, messages, max_tokens, temperature):
         try:
-            import openai
             cfg = PROVIDERS[provider]
             key = os.getenv(cfg["env_key"])
             if not key:
                 return f"[Error] {cfg['env_key']} not set"
 
-            base_url = None
-            if provider == "kimi":
-                base_url = "https://api.moonshot.cn/v1"
-
-            client = openai.OpenAI(api_key=key, base_url=base_url)
+            client = self._get_client(provider, key, base_url=_BASE_URLS.get(provider))
             msgs = [{"role": "system", "content": system_prompt}] + messages
             resp = client.chat.completions.create(
                 model=model,
@@ -151,6 +242,29 @@ class LLMRouter:
         except Exception as e:
             return f"[{provider} Error] {e}"
 
+    def _openai_compat_stream(self, provider, model, system_prompt, messages, max_tokens, temperature):
+        env_key = PROVIDERS[provider]["env_key"]
+        key = os.getenv(env_key)
+        if not key:
+            yield f"[Error] {env_key} not set"
+            return
+        label = "xAI" if provider == "xai" else provider
+        try:
+            client = self._get_client(provider, key, base_url=_BASE_URLS.get(provider))
+            resp = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "system", "content": system_prompt}] + messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+            )
+            for chunk in resp:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        except Exception as e:
+            yield f"[{label} Error] {e}"
+
     # ------------------------------------------------------------------ #
     #  Helpers                                                             #
     # ------------------------------------------------------------------ #
@@ -165,6 +279,6 @@ class LLMRouter:
                 "models": cfg["models"],
                 "default_model": cfg["default"],
                 "description": cfg["description"],
-                "configured": bool(os.getenv(cfg["env_key"])),
+                "configured": self._configured[name],
             }
         return result
@@ -4,23 +4,80 @@ Handles: SMS messaging, voice calls, call recording, transcription,
          call scheduling, and Media Streams for real-time audio.
 """
 import os
+import html
+import json
+import asyncio
+import threading
+from functools import lru_cache
 from typing import Dict, Any, Optional, List
-from datetime import datetime
+from datetime import datetime, timezone
+
+try:
+    from twilio.rest import Client
+except ImportError:
+    Client = None
+
+
+_client = None
+_client_lock = threading.Lock()
 
 
 def _get_client():
-    try:
-        from twilio.rest import Client
-        sid = os.getenv("TWILIO_ACCOUNT_SID")
-        token = os.getenv("TWILIO_AUTH_TOKEN")
-        if not sid or not token:
-            raise ValueError("TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN required")
-        return Client(sid, token)
-    except ImportError:
-        raise RuntimeError("twilio package required: pip install twilio")
+    """Shared Twilio REST client, so its HTTP session / connection pool is reused."""
+    global _client
+    if _client is None:
+        if Client is None:
+            raise RuntimeError("twilio package required: pip install twilio")
+        with _client_lock:
+            if _client is None:
+                sid = os.getenv("TWILIO_ACCOUNT_SID")
+                token = os.getenv("TWILIO_AUTH_TOKEN")
+                if not sid or not token:
+                    raise ValueError("TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN required")
+                _client = Client(sid, token)
+    return _client
+
+
+# Sub-resource collections of the shared client, resolved once
+@lru_cache(maxsize=1)
+def _calls():
+    return _get_client().calls
+
+
+@lru_cache(maxsize=1)
+def _messages():
+    return _get_client().messages
+
+
+@lru_cache(maxsize=1)
+def _recordings():
+    return _get_client().recordings
+
+
+@lru_cache(maxsize=1)
+def _transcriptions():
+    return _get_client().transcriptions
+
 
+_RESOURCE_CACHES = (_calls, _messages, _recordings, _transcriptions)
 
-TWILIO_PHONE = lambda: os.getenv("TWILIO_PHONE_NUMBER", "")
+TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER", "")
+
+
+def reset_client():
+    """
+    Drop the cached client and re-read TWILIO_PHONE_NUMBER
+    (e.g. after rotating credentials, or in tests).
+    """
+    global _client, TWILIO_PHONE_NUMBER
+    with _client_lock:
+        _client = None
+        for cached in _RESOURCE_CACHES:
+            cached.cache_clear()
+        TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER", "")
+
+TWILIO_API_BASE = "https://api.twilio.com/2010-04-01"
+NOTIFY_MAX_BINDINGS = 10000  # per Notify request (keeps the body under ~1 MB)
 
 
 class TwilioSMS:
@@ -28,10 +85,9 @@ class TwilioSMS:
 
     def send(self, to: str, body: str, from_: Optional[str] = None) -> Dict[str, Any]:
         try:
-            client = _get_client()
-            msg = client.messages.create(
+            msg = _messages().create(
                 body=body,
-                from_=from_ or TWILIO_PHONE(),
+                from_=from_ or TWILIO_PHONE_NUMBER,
                 to=to,
             )
             return {
@@ -44,10 +100,105 @@ class TwilioSMS:
         except Exception as e:
             return {"error": str(e)}
 
-    def list_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
+    async def send_many(
+        self,
+        to_list: List[str],
+        body: str,
+        from_: Optional[str] = None,
+        concurrency: int = 50,
+    ) -> List[Dict[str, Any]]:
+        """
+        Send the same SMS to many recipients concurrently over one
+        httpx.AsyncClient, calling Twilio's Messages REST endpoint directly.
+        At most `concurrency` requests are in flight (Twilio caps an account
+        at 100). Returns one result per recipient, in order; a failed send
+        yields an {"error": ...} entry instead of aborting the batch.
+        """
+        try:
+            import httpx
+        except ImportError:
+            return [{"error": "httpx package required: pip install httpx", "to": to} for to in to_list]
+        sid = os.getenv("TWILIO_ACCOUNT_SID")
+        token = os.getenv("TWILIO_AUTH_TOKEN")
+        if not sid or not token:
+            return [{"error": "TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN required", "to": to} for to in to_list]
+
+        url = f"{TWILIO_API_BASE}/Accounts/{sid}/Messages.json"
+        sender = from_ or TWILIO_PHONE_NUMBER
+        sem = asyncio.Semaphore(concurrency)
+        sent_at = datetime.now(timezone.utc).isoformat(timespec="seconds")  # once per batch
+        client_kwargs = dict(
+            auth=(sid, token),
+            timeout=15,
+            limits=httpx.Limits(max_connections=concurrency),
+        )
+        try:
+            client = httpx.AsyncClient(http2=True, **client_kwargs)
+        except ImportError:  # h2 not installed
+            client = httpx.AsyncClient(**client_kwargs)
+
+        async def _send_one(to: str) -> Dict[str, Any]:
+            async with sem:
+                resp = await client.post(url, data={"To": to, "From": sender, "Body": body})
+            data = resp.json()
+            if resp.status_code >= 400:
+                return {"error": data.get("message", f"HTTP {resp.status_code}"), "to": to}
+            return {
+                "status": "sent",
+                "sid": data.get("sid"),
+                "to": to,
+                "from": data.get("from"),
+                "timestamp": sent_at,
+            }
+
+        async with client:
+            results = await asyncio.gather(*(_send_one(to) for to in to_list), return_exceptions=True)
+        return [
+            r if isinstance(r, dict) else {"error": str(r), "to": to}
+            for r, to in zip(results, to_list)
+        ]
+
+    def send_bulk(
+        self,
+        recipients: List[str],
+        body: str,
+        notify_service_sid: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Broadcast one SMS to many numbers via Twilio Notify, one request per
+        10k recipients instead of one per recipient. Chunks Notify rejects
+        are retried as individual messages.create calls.
+        """
+        service_sid = notify_service_sid or os.getenv("TWILIO_NOTIFY_SERVICE_SID", "")
+        if not service_sid:
+            return {"error": "notify_service_sid or TWILIO_NOTIFY_SERVICE_SID required"}
         try:
             client = _get_client()
-            messages = client.messages.list(limit=limit)
+        except Exception as e:
+            return {"error": str(e)}
+
+        notifications, fallback = [], []
+        for i in range(0, len(recipients), NOTIFY_MAX_BINDINGS):
+            chunk = recipients[i:i + NOTIFY_MAX_BINDINGS]
+            bindings = [json.dumps({"binding_type": "sms", "address": num}) for num in chunk]
+            try:
+                n = client.notify.services(service_sid).notifications.create(to_binding=bindings, body=body)
+                notifications.append(n.sid)
+            except Exception as e:
+                print(f"[Twilio] Notify chunk rejected ({e}); sending individually")
+                fallback.extend(self.send(num, body) for num in chunk)
+
+        return {
+            "status": "queued",
+            "recipients": len(recipients),
+            "notification_sids": notifications,
+            "fallback_results": fallback,
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+
+    def list_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
+        try:
+            messages = _messages().list(limit=limit)
             return [
                 {
                     "sid": m.sid,
@@ -78,10 +229,9 @@ class TwilioVoice:
     ) -> Dict[str, Any]:
         """Initiate an outbound call."""
         try:
-            client = _get_client()
-            call = client.calls.create(
+            call = _calls().create(
                 to=to,
-                from_=from_ or TWILIO_PHONE(),
+                from_=from_ or TWILIO_PHONE_NUMBER,
                 url=twiml_url,
                 record=record,
             )
@@ -98,16 +248,14 @@ class TwilioVoice:
 
     def hangup(self, call_sid: str) -> Dict[str, Any]:
         try:
-            client = _get_client()
-            call = client.calls(call_sid).update(status="completed")
+            call = _calls()(call_sid).update(status="completed")
             return {"status": "ended", "call_sid": call_sid}
         except Exception as e:
             return {"error": str(e)}
 
     def list_calls(self, limit: int = 20) -> List[Dict[str, Any]]:
         try:
-            client = _get_client()
-            calls = client.calls.list(limit=limit)
+            calls = _calls().list(limit=limit)
             return [
                 {
                     "sid": c.sid,
@@ -124,8 +272,7 @@ class TwilioVoice:
 
     def get_recordings(self, call_sid: str) -> List[Dict[str, Any]]:
         try:
-            client = _get_client()
-            recordings = client.recordings.list(call_sid=call_sid)
+            recordings = _recordings().list(call_sid=call_sid)
             return [
                 {
                     "sid": r.sid,
@@ -144,8 +291,7 @@ class TwilioVoice:
         Twilio calls callback_url when transcription is ready.
         """
         try:
-            client = _get_client()
-            transcription = client.transcriptions.create(
+            transcription = _transcriptions().create(
                 recording_url=recording_url,
                 transcribe_callback=callback_url,
             )
@@ -157,6 +303,21 @@ class TwilioVoice:
             return {"error": str(e)}
 
 
+# TwiML templates, formatted with XML-escaped values
+_STREAM_TWIML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    "<Response><Say>{say}</Say><Connect><Stream url=\"{ws}\">"
+    '<Parameter name="source" value="twilio_media_stream"/>'
+    "</Stream></Connect></Response>"
+)
+_GATHER_TWIML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<Response><Gather input="{input}" timeout="{timeout}" action="{action}" method="POST">'
+    "<Say>{say}</Say></Gather>"
+    "<Say>We did not receive your input. Goodbye.</Say><Hangup/></Response>"
+)
+
+
 class TwilioMediaStream:
     """
     Twilio Media Streams — real-time audio streaming for voice AI.
@@ -172,15 +333,10 @@ class TwilioMediaStream:
         Return TwiML that streams call audio to a websocket endpoint.
         The websocket receives raw audio and can stream AI responses back.
         """
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>{say_text}</Say>
-    <Connect>
-        <Stream url="{websocket_url}">
-            <Parameter name="source" value="twilio_media_stream"/>
-        </Stream>
-    </Connect>
-</Response>"""
+        return _STREAM_TWIML.format_map({
+            "say": html.escape(say_text),
+            "ws": html.escape(websocket_url),
+        })
 
     def generate_gather_twiml(
         self,
@@ -190,14 +346,12 @@ class TwilioMediaStream:
         timeout: int = 5,
     ) -> str:
         """TwiML for gathering speech/DTMF input and posting to action_url."""
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Gather input="{input_types}" timeout="{timeout}" action="{action_url}" method="POST">
-        <Say>{say_text}</Say>
-    </Gather>
-    <Say>We did not receive your input. Goodbye.</Say>
-    <Hangup/>
-</Response>"""
+        return _GATHER_TWIML.format_map({
+            "input": html.escape(input_types),
+            "timeout": int(timeout),
+            "action": html.escape(action_url),
+            "say": html.escape(say_text),
+        })
 
 
 class TwilioScheduler:
@@ -214,10 +368,9 @@ class TwilioScheduler:
         from_: Optional[str] = None,
     ) -> Dict[str, Any]:
         try:
-            client = _get_client()
-            msg = client.messages.create(
+            msg = _messages().create(
                 body=body,
-                from_=from_ or TWILIO_PHONE(),
+                from_=from_ or TWILIO_PHONE_NUMBER,
                 to=to,
                 schedule_type="fixed",
                 send_at=send_at,
@@ -4,21 +4,72 @@ Supports: chat, image generation (Grok Imagine), real-time search,
           vision (image understanding), and future video/audio hooks.
 """
 import os
-from typing import Dict, Any, Optional, List
+import atexit
+import base64
+import hashlib
+import asyncio
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Tuple
+
+from agent_factory.integrations._semcache import SemanticCache
+
+try:
+    import openai
+except ImportError:  # optional dependency
+    openai = None
 
 
 XAI_BASE_URL = "https://api.x.ai/v1"
+XAI_TIMEOUT_S = 60.0
+XAI_MAX_RETRIES = 2
+
+
+_clients: List[Any] = []  # every client built, so they can be closed at exit
+
+
+@lru_cache(maxsize=4)
+def _build_client(key: str, timeout: float, max_retries: int):
+    # One client per key/settings: its httpx pool keeps TLS connections to
+    # api.x.ai alive across Grok calls instead of reconnecting every time.
+    client = openai.OpenAI(api_key=key, base_url=XAI_BASE_URL, timeout=timeout, max_retries=max_retries)
+    _clients.append(client)
+    return client
+
+
+@lru_cache(maxsize=4)
+def _build_async_client(key: str, timeout: float, max_retries: int):
+    return openai.AsyncOpenAI(api_key=key, base_url=XAI_BASE_URL, timeout=timeout, max_retries=max_retries)
 
 
-def _get_client():
-    try:
-        import openai
-        key = os.getenv("XAI_API_KEY")
-        if not key:
-            raise ValueError("XAI_API_KEY not set")
-        return openai.OpenAI(api_key=key, base_url=XAI_BASE_URL)
-    except ImportError:
+def _api_key() -> str:
+    if openai is None:
         raise RuntimeError("openai package required for xAI integration")
+    key = os.getenv("XAI_API_KEY")
+    if not key:
+        raise ValueError("XAI_API_KEY not set")
+    return key
+
+
+def _get_client(timeout: float = XAI_TIMEOUT_S, max_retries: int = XAI_MAX_RETRIES):
+    return _build_client(_api_key(), timeout, max_retries)
+
+
+def _get_async_client(timeout: float = XAI_TIMEOUT_S, max_retries: int = XAI_MAX_RETRIES):
+    return _build_async_client(_api_key(), timeout, max_retries)
+
+
+# Shared across GrokChat instances so repeat questions hit regardless of caller
+_response_cache = SemanticCache()
+
+
+@atexit.register
+def _close_clients():
+    _build_client.cache_clear()
+    while _clients:
+        try:
+            _clients.pop().close()
+        except Exception:
+            pass
 
 
 class GrokChat:
@@ -27,15 +78,14 @@ class GrokChat:
     def __init__(self, model: str = "grok-2"):
         self.model = model
 
-    def complete(
+    def _request(
         self,
         messages: List[Dict[str, str]],
-        system_prompt: str = "",
-        max_tokens: int = 2048,
-        temperature: float = 0.7,
-        enable_search: bool = False,
+        system_prompt: str,
+        max_tokens: int,
+        temperature: float,
+        enable_search: bool,
     ) -> Dict[str, Any]:
-        client = _get_client()
         full_messages = []
         if system_prompt:
             full_messages.append({"role": "system", "content": system_prompt})
@@ -51,22 +101,112 @@ class GrokChat:
         # Enable real-time web search grounding if requested
         if enable_search:
             kwargs["tools"] = [{"type": "web_search"}]
+        return kwargs
+
+    def _cache_key(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: str,
+        max_tokens: int,
+        temperature: float,
+        enable_search: bool,
+        cache_namespace: str,
+    ) -> Tuple[str, str]:
+        # The system prompt and every earlier turn go into the namespace
+        # (hashed), so only the last user turn is matched, and only against
+        # conversations with an identical history.
+        context = hashlib.blake2b(digest_size=16)
+        context.update(system_prompt.encode())
+        for m in messages[:-1]:
+            context.update(f"\0{m.get('role', '')}\0{m.get('content', '')}".encode())
+        namespace = (
+            f"{cache_namespace}|{self.model}|{max_tokens}|{temperature}|{int(enable_search)}|{context.hexdigest()}"
+        )
+        return namespace, messages[-1].get("content", "") if messages else ""
+
+    def _result(self, resp, enable_search: bool) -> Dict[str, Any]:
+        return {
+            "text": resp.choices[0].message.content,
+            "model": self.model,
+            "usage": {
+                "prompt_tokens": resp.usage.prompt_tokens,
+                "completion_tokens": resp.usage.completion_tokens,
+            } if resp.usage else {},
+            "search_used": enable_search,
+        }
 
+    def complete(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: str = "",
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+        enable_search: bool = False,
+        do_not_cache: bool = True,
+        cache_namespace: str = "",
+    ) -> Dict[str, Any]:
+        client = _get_client()
+        if not do_not_cache:
+            cache_key = self._cache_key(
+                messages, system_prompt, max_tokens, temperature, enable_search, cache_namespace
+            )
+            cached = _response_cache.get(*cache_key)
+            if cached is not None:
+                return {**cached, "cached": True}
+        kwargs = self._request(messages, system_prompt, max_tokens, temperature, enable_search)
         try:
             resp = client.chat.completions.create(**kwargs)
-            text = resp.choices[0].message.content
-            return {
-                "text": text,
-                "model": self.model,
-                "usage": {
-                    "prompt_tokens": resp.usage.prompt_tokens,
-                    "completion_tokens": resp.usage.completion_tokens,
-                } if resp.usage else {},
-                "search_used": enable_search,
-            }
+            result = self._result(resp, enable_search)
+            if not do_not_cache:
+                _response_cache.put(*cache_key, result)
+            return result
+        except Exception as e:
+            return {"error": str(e), "model": self.model}
+
+    async def acomplete(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: str = "",
+        max_tokens: int = 2048,
+        temperature: float = 0.7,
+        enable_search: bool = False,
+        do_not_cache: bool = True,
+        cache_namespace: str = "",
+    ) -> Dict[str, Any]:
+        """Async variant of complete() on a shared AsyncOpenAI client."""
+        client = _get_async_client()
+        if not do_not_cache:
+            cache_key = self._cache_key(
+                messages, system_prompt, max_tokens, temperature, enable_search, cache_namespace
+            )
+            cached = _response_cache.get(*cache_key)
+            if cached is not None:
+                return {**cached, "cached": True}
+        kwargs = self._request(messages, system_prompt, max_tokens, temperature, enable_search)
+        try:
+            resp = await client.chat.completions.create(**kwargs)
+            result = self._result(resp, enable_search)
+            if not do_not_cache:
+                _response_cache.put(*cache_key, result)
+            return result
         except Exception as e:
             return {"error": str(e), "model": self.model}
 
+    async def complete_many(
+        self,
+        batch: List[List[Dict[str, str]]],
+        concurrency: int = 8,
+        **kwargs,
+    ) -> List[Dict[str, Any]]:
+        """Run several independent completions concurrently (results in input order)."""
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+            async with sem:
+                return await self.acomplete(messages, **kwargs)
+
+        return await asyncio.gather(*map(one, batch))
+
 
 class GrokVision:
     """Grok vision — send images + text for multimodal understanding."""
@@ -80,6 +220,7 @@ class GrokVision:
         image_url: Optional[str] = None,
         image_base64: Optional[str] = None,
         media_type: str = "image/jpeg",
+        image_bytes: Optional[bytes] = None,
     ) -> Dict[str, Any]:
         client = _get_client()
 
@@ -87,10 +228,13 @@ class GrokVision:
 
         if image_url:
             content.append({"type": "image_url", "image_url": {"url": image_url}})
-        elif image_base64:
+        elif image_bytes or image_base64:
+            if image_bytes:
+                # Encode straight from the buffer; no intermediate bytes copy
+                image_base64 = base64.b64encode(memoryview(image_bytes)).decode("ascii")
             content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:{media_type};base64,{image_base64}"},
+                "image_url": {"url": "".join(("data:", media_type, ";base64,", image_base64))},
             })
 
         try:
@@ -149,11 +293,13 @@ class GrokSearch:
     def __init__(self, model: str = "grok-2"):
         self.chat = GrokChat(model=model)
 
-    def search(self, query: str) -> Dict[str, Any]:
+    def search(self, query: str, use_cache: bool = False) -> Dict[str, Any]:
+        # Uncached by default: search answers go stale quickly
         return self.chat.complete(
             messages=[{"role": "user", "content": query}],
             system_prompt="You are a real-time search assistant. Search the web and X for the most current information.",
             enable_search=True,
+            do_not_cache=not use_cache,
         )
 
 
@@ -5,30 +5,172 @@ Enables website embedding, outbound webhooks, and plugin extensibility.
 import os
 import json
 import hmac
-import hashlib
 import time
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+import atexit
+import random
+import sqlite3
+import hashlib
+import string
+import threading
+from types import MappingProxyType
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Union
+from datetime import datetime, timezone
 
+try:
+    import orjson
 
-PLUGINS_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "data", "plugins.json")
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str)
 
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - depends on installed extras
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=str, separators=(",", ":")).encode("utf-8")
+
+    _loads = json.loads
+
+
+PLUGINS_DB = os.path.join(os.path.dirname(__file__), "..", "..", "data", "plugins.db")
+PLUGINS_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "data", "plugins.json")  # legacy
+PERSIST_INTERVAL_S = 1.0  # max delay before delivery-log changes hit disk
+DELIVERY_WORKERS = 16     # concurrent outbound deliveries per fire()
+DELIVERY_TIMEOUT_S = 15   # upper bound on waiting for one delivery
+DELIVERY_LOG_MAX = 50     # delivery-log entries kept per webhook
+DELIVERY_RETRIES = 2      # extra attempts after a 5xx/429 response
+RETRY_BASE_S = 0.25       # backoff base; sleep is uniform(0, base * 2**attempt)
+BREAKER_THRESHOLD = 5     # consecutive failures before a URL is skipped
+BREAKER_MAX_OPEN_S = 60   # cap on how long an open circuit skips a URL
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhooks (
+    id TEXT PRIMARY KEY,
+    agent_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    events_json TEXT NOT NULL,
+    secret TEXT NOT NULL,
+    name TEXT,
+    created_at TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    delivery_log_json TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS idx_webhooks_agent ON webhooks(agent_id);
+"""
+_COLUMNS = "id, agent_id, url, events_json, secret, name, created_at, active, delivery_log_json"
+
+
+def _connect() -> sqlite3.Connection:
+    """Open the plugins DB in WAL mode (crash-safe, readers don't block the writer)."""
+    os.makedirs(os.path.dirname(PLUGINS_DB), exist_ok=True)
+    conn = sqlite3.connect(PLUGINS_DB, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _to_row(wh: Dict[str, Any]) -> tuple:
+    return (
+        wh["id"],
+        wh["agent_id"],
+        wh["url"],
+        _dumps(wh.get("events", [])).decode(),
+        wh["secret"],
+        wh.get("name", ""),
+        wh.get("created_at"),
+        1 if wh.get("active", True) else 0,
+        _dumps(list(wh.get("delivery_log", ()))).decode(),
+    )
 
-def _load_plugins() -> Dict[str, Any]:
-    os.makedirs(os.path.dirname(PLUGINS_FILE), exist_ok=True)
-    if os.path.exists(PLUGINS_FILE):
-        try:
-            with open(PLUGINS_FILE, "r") as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
 
+def _from_row(row: tuple) -> Dict[str, Any]:
+    wh_id, agent_id, url, events_json, secret, name, created_at, active, log_json = row
+    return {
+        "id": wh_id,
+        "agent_id": agent_id,
+        "url": url,
+        "events": _loads(events_json),
+        "secret": secret,
+        "name": name,
+        "created_at": created_at,
+        "active": bool(active),
+        "delivery_log": deque(_loads(log_json), maxlen=DELIVERY_LOG_MAX),
+    }
 
-def _save_plugins(data: Dict[str, Any]):
-    os.makedirs(os.path.dirname(PLUGINS_FILE), exist_ok=True)
-    with open(PLUGINS_FILE, "w") as f:
-        json.dump(data, f, indent=2, default=str)
+
+def _load_plugins(conn: sqlite3.Connection) -> Dict[str, Any]:
+    plugins = {
+        f"wh:{row[0]}": _from_row(row)
+        for row in conn.execute(f"SELECT {_COLUMNS} FROM webhooks")
+    }
+    return plugins or _import_legacy_plugins(conn)
+
+
+def _import_legacy_plugins(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """One-off import of webhooks from the old plugins.json store."""
+    if not os.path.exists(PLUGINS_FILE):
+        return {}
+    try:
+        with open(PLUGINS_FILE, "r") as f:
+            data = json.load(f)
+        plugins = {k: v for k, v in data.items() if k.startswith("wh:")}
+        for wh in plugins.values():
+            wh["delivery_log"] = deque(wh.get("delivery_log", ()), maxlen=DELIVERY_LOG_MAX)
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO webhooks ({_COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?)",
+                [_to_row(wh) for wh in plugins.values()],
+            )
+        # Imported once: an empty table later means "all deleted", not "not migrated"
+        os.replace(PLUGINS_FILE, PLUGINS_FILE + ".migrated")
+    except Exception as e:
+        print(f"[Webhooks] legacy import failed: {e}")
+        return {}
+    return plugins
+
+
+# Embed widget: minified once at import; per call only placeholders are filled.
+_POS_CSS = MappingProxyType({
+    "bottom-right": "bottom:24px;right:24px;",
+    "bottom-left": "bottom:24px;left:24px;",
+    "top-right": "top:24px;right:24px;",
+    "top-left": "top:24px;left:24px;",
+})
+_FRAME_CSS = MappingProxyType({
+    "bottom-right": "bottom:92px;right:24px;",
+    "bottom-left": "bottom:92px;left:24px;",
+    "top-right": "top:92px;right:24px;",
+    "top-left": "top:92px;left:24px;",
+})
+_WIDGET_TPL = string.Template(
+    '<!-- Agent Factory Widget — paste before </body> -->\n'
+    '<script>(function(){'
+    'var s=document.createElement("style");'
+    's.textContent="#af-widget-btn{position:fixed;${pos_css}z-index:9999;width:56px;height:56px;'
+    'border-radius:50%;background:#7c3aed;border:none;cursor:pointer;box-shadow:0 4px 14px rgba(0,0,0,.3);'
+    'font-size:24px;color:#fff}#af-widget-frame{position:fixed;${frame_css}z-index:9998;width:370px;'
+    'height:520px;border:none;border-radius:16px;box-shadow:0 8px 30px rgba(0,0,0,.35);display:none}";'
+    'document.head.appendChild(s);'
+    'var b=document.createElement("button");b.id="af-widget-btn";b.title="${title}";'
+    'b.innerHTML="&#x1F4AC;";document.body.appendChild(b);'
+    'var f=document.createElement("iframe");f.id="af-widget-frame";'
+    'f.src="${api_url}/widget/${agent_id}?theme=${theme}";f.allow="microphone";'
+    'document.body.appendChild(f);'
+    'var o=false;b.addEventListener("click",function(){o=!o;'
+    'f.style.display=o?"block":"none";b.innerHTML=o?"&#x2715;":"&#x1F4AC;"})'
+    '})();</script>'
+)
+
+
+# Signing should run on OpenSSL's SHA-256, not CPython's built-in fallback
+if not hashlib.sha256.__name__.startswith("openssl_"):
+    print("[Webhooks] SHA-256 is not OpenSSL-backed; webhook signing will be slower")
+
+
+def _js_str(value: str) -> str:
+    """Escape a value for a double-quoted JS string inside a <script> block."""
+    return json.dumps(str(value))[1:-1].replace("<", "\\u003c")
 
 
 class WebhookManager:
@@ -38,10 +180,89 @@ class WebhookManager:
     """
 
     def __init__(self):
-        self._plugins: Dict[str, Any] = _load_plugins()
+        self._db = _connect()
+        self._plugins: Dict[str, Any] = _load_plugins(self._db)
+        self._lock = threading.RLock()
+        # Secondary indices of "wh:" keys: agent_id -> keys, (agent_id, event) -> keys
+        self._by_agent: Dict[str, List[str]] = {}
+        self._by_event: Dict[Tuple[str, str], List[str]] = {}
+        for key, wh in self._plugins.items():
+            if key.startswith("wh:"):
+                self._index(key, wh)
+        # Delivery logs change on every fire(); the webhook ids are marked
+        # dirty and their rows updated by a background thread.
+        self._dirty: set = set()
+        threading.Thread(target=self._flush_loop, name="webhook-persist", daemon=True).start()
+        atexit.register(self._flush_now)
+        # Shared keep-alive HTTP client for deliveries (created on first use)
+        self._http = None
+        self._hmac_cache: Dict[str, Any] = {}  # secret -> keyed HMAC-SHA256 state
+        # Per-URL circuit breaker: url -> [consecutive_failures, open_until_ts]
+        self._breaker: Dict[str, List[float]] = {}
+        self._pool = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix="webhook")
+        atexit.register(self.close)
 
-    def _persist(self):
-        _save_plugins(self._plugins)
+    def _get_http(self):
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    import httpx
+                    # retries= re-attempts failed connects (refused/reset) only
+                    kwargs = dict(
+                        retries=2,
+                        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                    )
+                    try:
+                        transport = httpx.HTTPTransport(http2=True, **kwargs)
+                    except ImportError:  # h2 not installed
+                        transport = httpx.HTTPTransport(**kwargs)
+                    self._http = httpx.Client(transport=transport, timeout=10)
+        return self._http
+
+    def close(self):
+        """Close the delivery HTTP client."""
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(PERSIST_INTERVAL_S)
+            try:
+                self._flush_now()
+            except Exception as e:
+                print(f"[Webhooks] persist failed: {e}")
+
+    def _flush_now(self):
+        """Write the delivery logs of dirty webhooks (one small UPDATE each)."""
+        if not self._dirty:
+            return
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [
+                (_dumps(list(self._plugins[f"wh:{wh_id}"]["delivery_log"])).decode(), wh_id)
+                for wh_id in dirty if f"wh:{wh_id}" in self._plugins
+            ]
+            with self._db:
+                self._db.executemany("UPDATE webhooks SET delivery_log_json = ? WHERE id = ?", rows)
+
+    def _index(self, key: str, wh: Dict[str, Any]):
+        agent_id = wh.get("agent_id")
+        self._by_agent.setdefault(agent_id, []).append(key)
+        for event in set(wh.get("events", [])):
+            self._by_event.setdefault((agent_id, event), []).append(key)
+
+    def _unindex(self, key: str, wh: Dict[str, Any]):
+        agent_id = wh.get("agent_id")
+        for index_key, index in [(agent_id, self._by_agent)] + [
+            ((agent_id, event), self._by_event) for event in set(wh.get("events", []))
+        ]:
+            keys = index.get(index_key)
+            if keys and key in keys:
+                keys.remove(key)
+                if not keys:
+                    del index[index_key]
 
     # ------------------------------------------------------------------ #
     #  Webhook CRUD                                                        #
@@ -67,26 +288,34 @@ class WebhookManager:
             "name": name or f"webhook-{wh_id}",
             "created_at": datetime.utcnow().isoformat(),
             "active": True,
-            "delivery_log": [],
+            "delivery_log": deque(maxlen=DELIVERY_LOG_MAX),
         }
         key = f"wh:{wh_id}"
-        self._plugins[key] = webhook
-        self._persist()
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    f"INSERT INTO webhooks ({_COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?)", _to_row(webhook)
+                )
+            self._plugins[key] = webhook
+            self._index(key, webhook)
         return webhook
 
     def list_webhooks(self, agent_id: str) -> List[Dict[str, Any]]:
-        return [
-            v for k, v in self._plugins.items()
-            if k.startswith("wh:") and v.get("agent_id") == agent_id
-        ]
+        with self._lock:
+            return [self._plugins[k] for k in self._by_agent.get(agent_id, ())]
 
     def delete_webhook(self, webhook_id: str) -> bool:
         key = f"wh:{webhook_id}"
-        if key in self._plugins:
-            del self._plugins[key]
-            self._persist()
-            return True
-        return False
+        with self._lock:
+            if key not in self._plugins:
+                return False
+            with self._db:
+                self._db.execute("DELETE FROM webhooks WHERE id = ?", (webhook_id,))
+            wh = self._plugins.pop(key)
+            self._unindex(key, wh)
+            self._hmac_cache.pop(wh.get("secret"), None)
+            self._dirty.discard(webhook_id)
+        return True
 
     # ------------------------------------------------------------------ #
     #  Webhook firing                                                      #
@@ -99,63 +328,109 @@ class WebhookManager:
         payload: Dict[str, Any],
     ) -> List[Dict[str, Any]]:
         """Fire all matching webhooks for an agent event. Returns delivery results."""
-        results = []
-        for key, wh in self._plugins.items():
-            if not key.startswith("wh:"):
-                continue
-            if wh.get("agent_id") != agent_id:
-                continue
-            if not wh.get("active"):
-                continue
-            if event_type not in wh.get("events", []):
-                continue
-
-            result = self._deliver(wh, event_type, payload)
-            results.append(result)
-
-            # Log delivery
-            log_entry = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "event": event_type,
-                "status": result.get("status"),
-                "http_code": result.get("http_code"),
-            }
-            wh.setdefault("delivery_log", []).append(log_entry)
-            wh["delivery_log"] = wh["delivery_log"][-50:]  # keep last 50
-            self._persist()
+        with self._lock:
+            matches = [
+                wh for wh in (self._plugins[k] for k in self._by_event.get((agent_id, event_type), ()))
+                if wh.get("active")
+            ]
+        if not matches:
+            return []
+        # One timestamp per event: shared by every body and log entry, so a
+        # redelivered event is signed identically.
+        now_iso = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+        # Deliver concurrently: total latency ~ slowest endpoint, not the sum
+        if len(matches) == 1:
+            results = [self._deliver(matches[0], event_type, payload, now_iso)]
+        else:
+            futures = [self._pool.submit(self._deliver, wh, event_type, payload, now_iso) for wh in matches]
+            results = []
+            for wh, future in zip(matches, futures):
+                try:
+                    results.append(future.result(timeout=DELIVERY_TIMEOUT_S))
+                except Exception as e:
+                    results.append({"status": "failed", "error": str(e) or "timeout", "url": wh["url"]})
+
+        # Log deliveries
+        with self._lock:
+            for wh, result in zip(matches, results):
+                log_entry = {
+                    "timestamp": now_iso,
+                    "event": event_type,
+                    "status": result.get("status"),
+                    "http_code": result.get("http_code"),
+                }
+                wh["delivery_log"].append(log_entry)  # bounded deque evicts the oldest
+                self._dirty.add(wh["id"])
 
         return results
 
-    def _deliver(self, webhook: Dict[str, Any], event_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """HTTP POST the payload to the webhook URL."""
+    def _deliver(
+        self,
+        webhook: Dict[str, Any],
+        event_type: str,
+        payload: Dict[str, Any],
+        timestamp: str,
+    ) -> Dict[str, Any]:
+        """
+        HTTP POST the payload to the webhook URL. 5xx/429 responses are
+        retried with jittered backoff; a URL that keeps failing is skipped
+        (circuit open) for a while so it can't stall every fire().
+        """
+        url = webhook["url"]
+        with self._lock:
+            state = self._breaker.get(url)
+            if state and time.time() < state[1]:
+                return {"status": "circuit_open", "url": url}
         try:
-            import httpx
-            body = json.dumps({
+            body = _dumps({
                 "event": event_type,
                 "agent_id": webhook["agent_id"],
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": timestamp,
                 "data": payload,
             })
             sig = self._sign(body, webhook["secret"])
-            resp = httpx.post(
-                webhook["url"],
-                content=body,
-                headers={
-                    "Content-Type": "application/json",
-                    "X-AgentFactory-Signature": sig,
-                    "X-AgentFactory-Event": event_type,
-                },
-                timeout=10,
-            )
-            return {"status": "delivered", "http_code": resp.status_code, "url": webhook["url"]}
+            headers = {
+                "Content-Type": "application/json",
+                "X-AgentFactory-Signature": sig,
+                "X-AgentFactory-Event": event_type,
+            }
+            http = self._get_http()
+            for attempt in range(DELIVERY_RETRIES + 1):
+                resp = http.post(url, content=body, headers=headers)
+                if resp.status_code < 500 and resp.status_code != 429:
+                    break
+                if attempt < DELIVERY_RETRIES:
+                    time.sleep(random.uniform(0, RETRY_BASE_S * 2 ** attempt))
         except Exception as e:
-            return {"status": "failed", "error": str(e), "url": webhook["url"]}
+            self._record_outcome(url, ok=False)
+            return {"status": "failed", "error": str(e), "url": url}
+        self._record_outcome(url, ok=resp.status_code < 500 and resp.status_code != 429)
+        return {"status": "delivered", "http_code": resp.status_code, "url": url}
+
+    def _record_outcome(self, url: str, ok: bool):
+        with self._lock:
+            if ok:
+                self._breaker.pop(url, None)
+                return
+            state = self._breaker.setdefault(url, [0, 0.0])
+            state[0] += 1
+            if state[0] >= BREAKER_THRESHOLD:
+                state[1] = time.time() + min(BREAKER_MAX_OPEN_S, 2 ** state[0])
 
-    def _sign(self, body: str, secret: str) -> str:
+    def _sign(self, body: Union[str, bytes], secret: str) -> str:
         """HMAC-SHA256 signature for webhook payload verification."""
-        return hmac.new(secret.encode(), body.encode(), hashlib.sha256).hexdigest()  # noqa: E501 (hmac.new is correct for Python stdlib)
+        keyed = self._hmac_cache.get(secret)
+        if keyed is None:
+            # Key padding + inner/outer SHA-256 init happen once per secret;
+            # each signature starts from a copy of that keyed state.
+            # The "sha256" name routes to OpenSSL's HMAC (SHA-NI/ARMv8 crypto where available).
+            keyed = self._hmac_cache[secret] = hmac.new(secret.encode(), digestmod="sha256")
+        mac = keyed.copy()
+        mac.update(body.encode() if isinstance(body, str) else body)
+        return mac.hexdigest()
 
-    def verify_signature(self, body: str, secret: str, signature: str) -> bool:
+    def verify_signature(self, body: Union[str, bytes], secret: str, signature: str) -> bool:
         expected = self._sign(body, secret)
         return hmac.compare_digest(expected, signature)
 
@@ -175,62 +450,11 @@ class WebhookManager:
         Generate a JavaScript snippet for embedding the agent chat widget
         on any website. Drop this <script> tag into any HTML page.
         """
-        return f"""<!-- Agent Factory Widget — paste before </body> -->
-<script>
-(function() {{
-  var AGENT_ID = "{agent_id}";
-  var API_URL  = "{api_base_url}";
-  var THEME    = "{theme}";
-  var POSITION = "{position}";
-  var TITLE    = "{title}";
-
-  var style = document.createElement("style");
-  style.textContent = [
-    "#af-widget-btn{{position:fixed;{self._pos_css(position)}z-index:9999;",
-    "width:56px;height:56px;border-radius:50%;background:#7c3aed;",
-    "border:none;cursor:pointer;box-shadow:0 4px 14px rgba(0,0,0,.3);",
-    "font-size:24px;color:#fff;}}",
-    "#af-widget-frame{{position:fixed;{self._frame_css(position)}z-index:9998;",
-    "width:370px;height:520px;border:none;border-radius:16px;",
-    "box-shadow:0 8px 30px rgba(0,0,0,.35);display:none;}}",
-  ].join("");
-  document.head.appendChild(style);
-
-  var btn   = document.createElement("button");
-  btn.id    = "af-widget-btn";
-  btn.title = TITLE;
-  btn.innerHTML = "&#x1F4AC;";
-  document.body.appendChild(btn);
-
-  var frame  = document.createElement("iframe");
-  frame.id   = "af-widget-frame";
-  frame.src  = API_URL + "/widget/" + AGENT_ID + "?theme=" + THEME;
-  frame.allow = "microphone";
-  document.body.appendChild(frame);
-
-  var open = false;
-  btn.addEventListener("click", function() {{
-    open = !open;
-    frame.style.display = open ? "block" : "none";
-    btn.innerHTML = open ? "&#x2715;" : "&#x1F4AC;";
-  }});
-}})();
-</script>"""
-
-    def _pos_css(self, position: str) -> str:
-        positions = {
-            "bottom-right": "bottom:24px;right:24px;",
-            "bottom-left": "bottom:24px;left:24px;",
-            "top-right": "top:24px;right:24px;",
-            "top-left": "top:24px;left:24px;",
-        }
-        return positions.get(position, "bottom:24px;right:24px;")
-
-    def _frame_css(self, position: str) -> str:
-        positions = {
-            "bottom-right": "bottom:92px;right:24px;",
-            "bottom-left": "bottom:92px;left:24px;",
-            "top-right": "top:92px;right:24px;",
-            "top-left": "top:92px;left:24px;",
-        }
-        return positions.get(position, "bottom:92px;right:24px;")
+        return _WIDGET_TPL.substitute(
+            agent_id=_js_str(agent_id),
+            api_url=_js_str(api_base_url),
+            theme=_js_str(theme),
+            title=_js_str(title),
+            pos_css=_POS_CSS.get(position, _POS_CSS["bottom-right"]),
+            frame_css=_FRAME_CSS.get(position, _FRAME_CSS["bottom-right"]),
+        )
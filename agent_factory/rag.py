@@ -1,115 +1,714 @@
 """
 RAG (Retrieval-Augmented Generation) Manager
 Manages vector embeddings, document ingestion, and similarity search.
-Uses Pinecone when available, falls back to in-memory store.
+Uses Pinecone when available, falls back to an in-memory store
+(dense embeddings when numpy + OpenAI are available, keywords otherwise).
 """
 import os
+import re
 import json
+import math
+import time
+import random
+import atexit
+import sqlite3
 import hashlib
-from typing import List, Dict, Any, Optional
+import threading
+from array import array
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:  # optional: enables the dense in-memory store
+    np = None
+
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - depends on installed extras
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    _loads = json.loads
+
+
+RAG_STORE_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "rag")
+PERSIST_INTERVAL_S = 2.0         # max delay before in-memory store changes hit disk
+# Full chunk text for Pinecone vectors (kept out of Pinecone metadata)
+PINECONE_TEXT_DB = os.path.join(RAG_STORE_DIR, "pinecone_text.db")
+
+
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIM = 1536
+EMBED_BATCH = 96                 # inputs per embeddings request
+EMBED_BATCH_TOKENS = 250_000     # tokens per embeddings request (API cap is 300k)
+INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "4"))  # concurrent embeddings requests
+EMBED_RETRIES = 3                # attempts per embeddings batch on rate limiting
+INGEST_CHUNK_BATCH = 1000        # chunks per upsert_batch when ingesting a stream
+UPSERT_BATCH = 100               # vectors per Pinecone upsert request
+PINECONE_POOL_THREADS = 30       # max concurrent upsert requests (async_req)
+UPSERT_RETRIES = 3               # sequential retries for a failed upsert batch
+# Chunk ids are blake2b-128; set RAG_LEGACY_MD5_IDS=1 to keep the old md5 ids
+# (e.g. so re-ingesting into an existing Pinecone index overwrites, not duplicates)
+LEGACY_MD5_IDS = os.getenv("RAG_LEGACY_MD5_IDS", "").lower() in ("1", "true", "yes")
+
+_NON_SPACE = re.compile(r"\S")
+_SAFE_NAME = re.compile(r"[\w.-]+")
+
+# (doc_id, text, metadata) tuples accepted by upsert_batch
+Item = Tuple[str, str, Dict[str, Any]]
+
+
+def chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of at most `size` items."""
+    it = iter(iterable)
+    batch = list(islice(it, size))
+    while batch:
+        yield batch
+        batch = list(islice(it, size))
+
+
+def _ns_file(directory: str, namespace: str) -> str:
+    """Path stem for a namespace's files (hashed if not filename-safe)."""
+    name = namespace if _SAFE_NAME.fullmatch(namespace) else hashlib.blake2b(
+        namespace.encode(), digest_size=16).hexdigest()
+    return os.path.join(directory, name)
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _normalize(vectors: List[List[float]]) -> List[List[float]]:
+    """Scale vectors to unit length, so cosine similarity is a plain dot product."""
+    if np is not None:
+        mat = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (mat / norms).tolist()
+    out = []
+    for vec in vectors:
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        out.append([x / norm for x in vec])
+    return out
+
+
+_WS = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+SIMHASH_MAX_DISTANCE = 3  # max differing bits for a fuzzy embedding-cache hit
+
+# (exact key, normalized-text key, simhash64) for one text
+_Fingerprint = Tuple[Tuple[str, bytes], Tuple[str, bytes], int]
+
+
+def _simhash64(text: str) -> int:
+    """64-bit SimHash over word tokens: near-duplicate texts differ in few bits."""
+    weights = [0] * 64
+    for token, count in Counter(_WORD.findall(text)).items():
+        h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += count if h >> bit & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def _bands(simhash: int) -> List[tuple]:
+    return [(EMBED_MODEL, i, simhash >> (16 * i) & 0xFFFF) for i in range(4)]
+
+
+def _fingerprint(text: str) -> _Fingerprint:
+    norm = _WS.sub(" ", text.strip().lower())
+    return (
+        (EMBED_MODEL, hashlib.sha1(text.encode()).digest()),
+        (EMBED_MODEL, hashlib.sha1(norm.encode()).digest()),
+        _simhash64(norm),
+    )
+
+
+def _open_text_store(path: str) -> sqlite3.Connection:
+    """Open the chunk-text DB in WAL mode (readers don't block the writer)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS docs ("
+        "namespace TEXT NOT NULL, id TEXT NOT NULL, text TEXT NOT NULL, "
+        "PRIMARY KEY (namespace, id))"
+    )
+    return conn
+
+
+@lru_cache(maxsize=4)
+def _openai_client(api_key: Optional[str]):
+    # One client per key, imported on first use: its httpx pool keeps
+    # connections alive across embeddings batches and ingest threads.
+    import openai
+    return openai.OpenAI(api_key=api_key)
+
+
+@lru_cache(maxsize=4)
+def _pinecone_client(api_key: str):
+    from pinecone import Pinecone
+    return Pinecone(api_key=api_key)
+
+
+_encoder = None
+
+
+def _token_counts(texts: List[str]) -> List[int]:
+    """Token count per text (cl100k_base via tiktoken, else ~1.3 tokens/word)."""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return [len(tokens) for tokens in _encoder.encode_ordinary_batch(texts)]
+    return [int(len(text.split()) * 1.3) + 1 for text in texts]
+
+
+def _embedding_batches(texts: List[str]) -> Iterator[List[str]]:
+    """Group texts so each embeddings request stays under both caps."""
+    batch: List[str] = []
+    size = 0
+    for text, tokens in zip(texts, _token_counts(texts)):
+        if batch and (len(batch) >= EMBED_BATCH or size + tokens > EMBED_BATCH_TOKENS):
+            yield batch
+            batch, size = [], 0
+        batch.append(text)
+        size += tokens
+    if batch:
+        yield batch
+
 
 class InMemoryVectorStore:
-    """Simple in-memory vector store for development / no-Pinecone fallback."""
+    """
+    Simple in-memory vector store for development / no-Pinecone fallback.
+    Namespaces are snapshotted to `persist_dir` in the background and
+    reloaded on start, so ingested documents survive a restart.
+    """
 
-    def __init__(self):
-        self._docs: Dict[str, List[Dict[str, Any]]] = {}
+    def __init__(self, persist_dir: Optional[str] = RAG_STORE_DIR):
+        # namespace -> doc_id -> doc (insertion-ordered)
+        self._docs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # Inverted index over integer doc slots: namespace -> token -> array of
+        # slots. Dropped docs leave a dead slot (None) until the next compaction.
+        self._index: Dict[str, Dict[str, array]] = {}
+        self._slots: Dict[str, List[Optional[str]]] = {}
+        self._slot_of: Dict[str, Dict[str, int]] = {}
+        self._dead: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._dirty: set = set()  # namespaces changed since the last flush
+        self._persist_dir = persist_dir
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+            self._load()
+            threading.Thread(target=self._flush_loop, name="rag-persist", daemon=True).start()
+            atexit.register(self.flush)
 
     def upsert(self, namespace: str, doc_id: str, text: str, metadata: Dict = None):
-        if namespace not in self._docs:
-            self._docs[namespace] = []
-        # Remove old version if exists
-        self._docs[namespace] = [d for d in self._docs[namespace] if d["id"] != doc_id]
-        self._docs[namespace].append({
-            "id": doc_id,
-            "text": text,
-            "metadata": metadata or {},
-            "inserted_at": datetime.utcnow().isoformat(),
-        })
+        with self._lock:
+            # Remove old version if exists
+            if doc_id in self._docs.get(namespace, {}):
+                self._drop(namespace, doc_id)
+            self._add(namespace, {
+                "id": doc_id,
+                "text": text,
+                "metadata": metadata or {},
+                "inserted_at": datetime.utcnow().isoformat(),
+            })
+            self._dirty.add(namespace)
+
+    def _add(self, namespace: str, doc: Dict[str, Any]):
+        doc_id = doc["id"]
+        self._docs.setdefault(namespace, {})[doc_id] = doc
+        slots = self._slots.setdefault(namespace, [])
+        slot = self._slot_of.setdefault(namespace, {})[doc_id] = len(slots)
+        slots.append(doc_id)
+        index = self._index.setdefault(namespace, {})
+        for token in set(doc["text"].lower().split()):
+            postings = index.get(token)
+            if postings is None:
+                postings = index[token] = array("I")
+            postings.append(slot)
+
+    def upsert_batch(self, namespace: str, items: List[Item]):
+        for doc_id, text, metadata in items:
+            self.upsert(namespace, doc_id, text, metadata)
 
     def query(self, namespace: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """Naive keyword-based retrieval (no real embeddings in fallback mode)."""
-        docs = self._docs.get(namespace, [])
-        if not docs:
-            return []
-
-        # Score by simple term overlap
-        query_terms = set(query.lower().split())
-        scored = []
-        for doc in docs:
-            doc_terms = set(doc["text"].lower().split())
-            overlap = len(query_terms & doc_terms)
-            scored.append((overlap, doc))
-
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [doc for _, doc in scored[:top_k] if scored[0][0] > 0]
+        with self._lock:
+            index = self._index.get(namespace)
+            if not index:
+                return []
+            # Score by term overlap; only docs sharing a term are ever touched
+            postings = [index[t] for t in set(query.lower().split()) if t in index]
+            if not postings:
+                return []
+            # _reindex swaps in new containers, so these references stay consistent
+            slots = self._slots[namespace]
+            docs = self._docs[namespace]
+            want = top_k + len(slots) - len(docs)  # room for dead slots
+            n_slots = len(slots)
+            if np is not None:
+                hits = np.concatenate([np.array(p, dtype=np.uint32) for p in postings])
+            else:
+                hits = Counter()
+                for p in postings:
+                    hits.update(p)
+
+        if np is None:
+            ranked = [slot for slot, _ in hits.most_common(want)]
+        else:
+            # One C-level histogram instead of a dict increment per hit
+            scores = np.bincount(hits, minlength=n_slots)
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > want:
+                candidates = candidates[np.argpartition(-scores[candidates], want - 1)[:want]]
+            ranked = candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+        results = []
+        for slot in ranked:
+            doc = docs.get(slots[slot])  # None: dead slot or dropped since the scan
+            if doc is not None:
+                results.append(doc)
+                if len(results) == top_k:
+                    break
+        return results
 
     def delete(self, namespace: str, doc_id: str) -> bool:
-        if namespace not in self._docs:
-            return False
-        before = len(self._docs[namespace])
-        self._docs[namespace] = [d for d in self._docs[namespace] if d["id"] != doc_id]
-        return len(self._docs[namespace]) < before
+        with self._lock:
+            if doc_id not in self._docs.get(namespace, {}):
+                return False
+            self._drop(namespace, doc_id)
+        return True
+
+    def _drop(self, namespace: str, doc_id: str):
+        self._dirty.add(namespace)
+        del self._docs[namespace][doc_id]
+        self._slots[namespace][self._slot_of[namespace].pop(doc_id)] = None
+        dead = self._dead[namespace] = self._dead.get(namespace, 0) + 1
+        if dead > 64 and dead > len(self._slots[namespace]) // 2:
+            self._reindex(namespace)
+
+    def _reindex(self, namespace: str):
+        """Rebuild a namespace's postings without dead slots."""
+        docs = list(self._docs[namespace].values())
+        for table in (self._docs, self._index, self._slots, self._slot_of, self._dead):
+            table.pop(namespace, None)
+        for doc in docs:
+            self._add(namespace, doc)
 
     def list_docs(self, namespace: str) -> List[Dict[str, Any]]:
-        return self._docs.get(namespace, [])
+        return list(self._docs.get(namespace, {}).values())
 
     def stats(self, namespace: str) -> Dict[str, Any]:
         docs = self._docs.get(namespace, [])
-        return {"namespace": namespace, "doc_count": len(docs), "backend": "in-memory"}
+        return {
+            "namespace": namespace,
+            "doc_count": len(docs),
+            "backend": "in-memory",
+            "persisted": bool(self._persist_dir),
+        }
+
+    # -- persistence ---------------------------------------------------- #
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(PERSIST_INTERVAL_S)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[RAG] persist failed: {e}")
+
+    def flush(self):
+        """Write every namespace changed since the last flush."""
+        if not self._persist_dir or not self._dirty:
+            return
+        with self._lock:  # snapshot under the lock, write outside it
+            dirty, self._dirty = self._dirty, set()
+            snapshots = [self._snapshot(ns) for ns in dirty]
+        with self._write_lock:
+            for snap in snapshots:
+                self._write(snap)
+
+    def _snapshot(self, namespace: str) -> Dict[str, Any]:
+        return {"namespace": namespace, "docs": list(self._docs.get(namespace, {}).values())}
+
+    def _write(self, snap: Dict[str, Any]):
+        _write_atomic(_ns_file(self._persist_dir, snap["namespace"]) + ".json", _dumps(snap))
+
+    def _load(self):
+        for name in sorted(os.listdir(self._persist_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self._persist_dir, name)
+            try:
+                with open(path, "rb") as f:
+                    snap = _loads(f.read())
+                self._restore(snap, path[:-len(".json")])
+            except Exception as e:
+                print(f"[RAG] could not load {name}: {e}")
+
+    def _restore(self, snap: Dict[str, Any], stem: str):
+        for doc in snap.get("docs", []):
+            self._add(snap["namespace"], doc)
+
+
+class _EmbeddingMixin:
+    """
+    OpenAI embeddings with batching and an LRU+TTL cache. Lookups try the
+    exact text, then its whitespace/case-normalized form, then a 64-bit
+    SimHash within a small Hamming distance, so trivially edited chunks
+    reuse the vector instead of costing another API call.
+    """
+
+    def _init_embedding_cache(self, cache_size: int = 4096, cache_ttl: float = 3600):
+        # (model, sha1(text)) -> (inserted_at, vector, norm_key, simhash); LRU with a TTL
+        self._emb_cache: "OrderedDict[Tuple[str, bytes], Tuple[float, List[float], tuple, int]]" = OrderedDict()
+        self._emb_by_norm: Dict[tuple, Tuple[str, bytes]] = {}
+        # SimHash split into 4 x 16-bit bands: within distance 3, one band matches exactly
+        self._emb_bands: Dict[tuple, set] = {}
+        self._emb_stats: Counter = Counter()
+        self._emb_cache_size = cache_size
+        self._emb_cache_ttl = cache_ttl
+        self._emb_lock = threading.Lock()
+
+    def embedding_cache_stats(self) -> Dict[str, int]:
+        with self._emb_lock:
+            return {"size": len(self._emb_cache), **{
+                k: self._emb_stats[k] for k in ("hits_exact", "hits_norm", "hits_fuzzy", "misses")
+            }}
+
+    def _embed(self, text: str) -> List[float]:
+        """Get embedding vector via OpenAI API."""
+        return self._embed_many([text])[0]
+
+    def _embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed many texts. Cached vectors are reused; the misses go out with
+        one OpenAI request per batch (not per text).
+        """
+        fingerprints = [_fingerprint(t) for t in texts]
+        vectors: List[Optional[List[float]]] = [self._cache_get(fp) for fp in fingerprints]
+        misses = [i for i, v in enumerate(vectors) if v is None]
+        if not misses:
+            return vectors
 
+        try:
+            client = _openai_client(os.getenv("OPENAI_API_KEY"))
+        except Exception:
+            client = None
+        batches = list(_embedding_batches([texts[i] for i in misses]))
+        if len(batches) > 1 and INGEST_WORKERS > 1:
+            # Requests are I/O-bound: run a few at once, staggered to avoid 429 bursts
+            with ThreadPoolExecutor(max_workers=min(INGEST_WORKERS, len(batches))) as pool:
+                results = list(pool.map(lambda b: self._embed_batch(client, b, stagger=True), batches))
+        else:
+            results = [self._embed_batch(client, batch) for batch in batches]
+        fetched = [vector for result in results for vector in result]
+        for i, vector in zip(misses, fetched):
+            vectors[i] = vector
+            if any(vector):  # never cache the zero-vector fallback
+                self._cache_put(fingerprints[i], vector)
+        return vectors
+
+    def _embed_batch(self, client, batch: List[str], stagger: bool = False) -> List[List[float]]:
+        """One embeddings request, retried with jittered backoff when rate limited."""
+        if stagger:
+            time.sleep(random.uniform(0, 0.1))
+        for attempt in range(EMBED_RETRIES):
+            try:
+                resp = client.embeddings.create(input=batch, model=EMBED_MODEL)
+                # Normalized once here; every cached/stored vector is unit length
+                return _normalize([d.embedding for d in sorted(resp.data, key=lambda d: d.index)])
+            except Exception as e:
+                if type(e).__name__ != "RateLimitError" or attempt == EMBED_RETRIES - 1:
+                    break
+                time.sleep(0.5 * 2 ** attempt + random.uniform(0, 0.25))
+        # Fallback: zero vectors (won't be meaningful but won't crash)
+        return [[0.0] * EMBED_DIM for _ in batch]
+
+    def _cache_get(self, fp: "_Fingerprint") -> Optional[List[float]]:
+        exact, norm_key, simhash = fp
+        with self._emb_lock:
+            kind, key = "hits_exact", exact
+            if key not in self._emb_cache:
+                kind, key = "hits_norm", self._emb_by_norm.get(norm_key)
+            if key is None:
+                kind, key = "hits_fuzzy", self._fuzzy_match(simhash)
+            if key is None:
+                self._emb_stats["misses"] += 1
+                return None
+            hit = self._emb_cache[key]
+            if time.monotonic() - hit[0] > self._emb_cache_ttl:
+                self._evict(key)
+                self._emb_stats["misses"] += 1
+                return None
+            self._emb_cache.move_to_end(key)
+            self._emb_stats[kind] += 1
+            return hit[1]
+
+    def _fuzzy_match(self, simhash: int) -> Optional[Tuple[str, bytes]]:
+        for band in _bands(simhash):
+            for key in self._emb_bands.get(band, ()):
+                if bin(simhash ^ self._emb_cache[key][3]).count("1") <= SIMHASH_MAX_DISTANCE:
+                    return key
+        return None
+
+    def _cache_put(self, fp: "_Fingerprint", vector: List[float]):
+        exact, norm_key, simhash = fp
+        with self._emb_lock:
+            if exact in self._emb_cache:
+                self._evict(exact)
+            self._emb_cache[exact] = (time.monotonic(), vector, norm_key, simhash)
+            self._emb_by_norm[norm_key] = exact
+            for band in _bands(simhash):
+                self._emb_bands.setdefault(band, set()).add(exact)
+            if len(self._emb_cache) > self._emb_cache_size:
+                self._evict(next(iter(self._emb_cache)))
+
+    def _evict(self, key: Tuple[str, bytes]):
+        _, _, norm_key, simhash = self._emb_cache.pop(key)
+        if self._emb_by_norm.get(norm_key) == key:
+            del self._emb_by_norm[norm_key]
+        for band in _bands(simhash):
+            keys = self._emb_bands.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._emb_bands[band]
+
+
+class DenseVectorStore(_EmbeddingMixin, InMemoryVectorStore):
+    """
+    In-memory vector store with real embeddings: one contiguous float32
+    matrix per namespace (unit-length rows), cosine = a single mat-vec.
+    Used instead of keyword scoring when numpy and an OpenAI key are present.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 4096,
+        cache_ttl: float = 3600,
+        persist_dir: Optional[str] = RAG_STORE_DIR,
+    ):
+        self._init_embedding_cache(cache_size, cache_ttl)
+        self._mat: Dict[str, Any] = {}                  # namespace -> (capacity, dim) float32
+        self._rows: Dict[str, List[str]] = {}           # namespace -> row -> doc_id
+        self._row_of: Dict[str, Dict[str, int]] = {}    # namespace -> doc_id -> row
+        InMemoryVectorStore.__init__(self, persist_dir)  # may restore from disk
+
+    def upsert(self, namespace: str, doc_id: str, text: str, metadata: Dict = None):
+        self.upsert_batch(namespace, [(doc_id, text, metadata or {})])
+
+    def upsert_batch(self, namespace: str, items: List[Item]):
+        if not items:
+            return
+        vecs = np.asarray(self._embed_many([text for _, text, _ in items]), dtype=np.float32)
+        with self._lock:
+            for doc_id, text, metadata in items:
+                InMemoryVectorStore.upsert(self, namespace, doc_id, text, metadata)
+            self._put_vectors(namespace, [doc_id for doc_id, _, _ in items], vecs)
+
+    def _put_vectors(self, namespace: str, doc_ids: List[str], vecs):
+        # vecs come from _embed_many, already unit length (or zero on failure)
+        rows = self._rows.setdefault(namespace, [])
+        row_of = self._row_of.setdefault(namespace, {})
+        mat = self._mat.get(namespace)
+        needed = len(rows) + len(doc_ids)
+        if mat is None or mat.shape[0] < needed:
+            # Grow by doubling so appends stay amortized O(1)
+            capacity = max(needed, 2 * (mat.shape[0] if mat is not None else 64))
+            grown = np.zeros((capacity, vecs.shape[1]), dtype=np.float32)
+            if mat is not None:
+                grown[:len(rows)] = mat[:len(rows)]
+            mat = self._mat[namespace] = grown
+        for doc_id, vec in zip(doc_ids, vecs):
+            row = row_of.get(doc_id)
+            if row is None:
+                row = row_of[doc_id] = len(rows)
+                rows.append(doc_id)
+            mat[row] = vec
+
+    def query(self, namespace: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        if not self._rows.get(namespace):
+            return []
+        # Embed outside the lock (network call); score against a consistent snapshot
+        q = np.asarray(self._embed(query), dtype=np.float32)  # unit length
+        if not q.any():  # embedding unavailable: fall back to keyword scoring
+            return InMemoryVectorStore.query(self, namespace, query, top_k)
+        with self._lock:
+            rows = self._rows.get(namespace)
+            if not rows:
+                return []
+            scores = self._mat[namespace][:len(rows)] @ q
+            k = min(top_k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            docs = self._docs[namespace]
+            return [{**docs[rows[i]], "score": float(scores[i])} for i in top]
+
+    def _drop(self, namespace: str, doc_id: str):
+        InMemoryVectorStore._drop(self, namespace, doc_id)
+        row_of = self._row_of.get(namespace, {})
+        row = row_of.pop(doc_id, None)
+        if row is None:
+            return
+        # Swap-remove: move the last row into the hole
+        rows, mat = self._rows[namespace], self._mat[namespace]
+        last = len(rows) - 1
+        if row != last:
+            mat[row] = mat[last]
+            rows[row] = rows[last]
+            row_of[rows[row]] = row
+        rows.pop()
 
-class PineconeVectorStore:
+    def stats(self, namespace: str) -> Dict[str, Any]:
+        return {
+            **InMemoryVectorStore.stats(self, namespace),
+            "backend": "in-memory-dense",
+            "embedding_cache": self.embedding_cache_stats(),
+        }
+
+    # -- persistence: rows in a .npy next to the docs sidecar ------------ #
+
+    def _snapshot(self, namespace: str) -> Dict[str, Any]:
+        snap = InMemoryVectorStore._snapshot(self, namespace)
+        rows = self._rows.get(namespace, [])
+        snap["rows"] = list(rows)
+        mat = self._mat.get(namespace)
+        snap["_matrix"] = mat[:len(rows)].copy() if mat is not None else None
+        return snap
+
+    def _write(self, snap: Dict[str, Any]):
+        matrix = snap.pop("_matrix", None)
+        if matrix is not None:
+            # Matrix first: a sidecar never references rows that aren't on disk
+            path = _ns_file(self._persist_dir, snap["namespace"]) + ".npy"
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, matrix)
+            os.replace(path + ".tmp", path)
+        InMemoryVectorStore._write(self, snap)
+
+    def _restore(self, snap: Dict[str, Any], stem: str):
+        InMemoryVectorStore._restore(self, snap, stem)
+        namespace, rows = snap["namespace"], snap.get("rows") or []
+        mat = None
+        if rows and os.path.exists(stem + ".npy"):
+            # Copy-on-write mmap: pages load on first touch, writes stay in memory
+            mat = np.load(stem + ".npy", mmap_mode="c")
+        if mat is not None and mat.shape[0] == len(rows):
+            self._mat[namespace] = mat
+            self._rows[namespace] = list(rows)
+            self._row_of[namespace] = {doc_id: i for i, doc_id in enumerate(rows)}
+        elif snap.get("docs"):
+            # Missing/mismatched matrix: re-embed this namespace once
+            docs = snap["docs"]
+            vecs = np.asarray(self._embed_many([d["text"] for d in docs]), dtype=np.float32)
+            self._put_vectors(namespace, [d["id"] for d in docs], vecs)
+            self._dirty.add(namespace)
+
+
+class PineconeVectorStore(_EmbeddingMixin):
     """Pinecone-backed vector store with OpenAI/Anthropic embeddings."""
 
-    def __init__(self, api_key: str, index_name: str = "agent-factory"):
+    def __init__(
+        self,
+        api_key: str,
+        index_name: str = "agent-factory",
+        cache_size: int = 4096,
+        cache_ttl: float = 3600,
+        text_db: str = PINECONE_TEXT_DB,
+    ):
+        self._init_embedding_cache(cache_size, cache_ttl)
+        # Chunk text lives here, keyed by (namespace, id); Pinecone only gets vectors
+        self._text_store = _open_text_store(text_db)
+        self._text_lock = threading.Lock()
         try:
-            from pinecone import Pinecone, ServerlessSpec
-            self.pc = Pinecone(api_key=api_key)
+            self.pc = _pinecone_client(api_key)
 
             # Create index if not exists
             existing = [idx.name for idx in self.pc.list_indexes()]
             if index_name not in existing:
+                from pinecone import ServerlessSpec
                 self.pc.create_index(
                     name=index_name,
-                    dimension=1536,
+                    dimension=EMBED_DIM,
                     metric="cosine",
                     spec=ServerlessSpec(cloud="aws", region="us-east-1"),
                 )
-            self.index = self.pc.Index(index_name)
+            self.index = self.pc.Index(index_name, pool_threads=PINECONE_POOL_THREADS)
             self._available = True
         except Exception as e:
             print(f"[RAG] Pinecone init failed: {e}. Using in-memory store.")
             self._available = False
 
-    def _embed(self, text: str) -> List[float]:
-        """Get embedding vector via OpenAI API."""
-        try:
-            import openai
-            client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            resp = client.embeddings.create(input=text, model="text-embedding-3-small")
-            return resp.data[0].embedding
-        except Exception:
-            # Fallback: zero vector (won't be meaningful but won't crash)
-            return [0.0] * 1536
-
     def upsert(self, namespace: str, doc_id: str, text: str, metadata: Dict = None):
-        if not self._available:
+        self.upsert_batch(namespace, [(doc_id, text, metadata or {})])
+
+    def upsert_batch(self, namespace: str, items: List[Item]):
+        """Embed and upsert many chunks: one embeddings call per batch, 100 vectors per upsert, in parallel."""
+        if not self._available or not items:
             return
-        vector = self._embed(text)
-        self.index.upsert(
-            vectors=[{"id": doc_id, "values": vector, "metadata": {**(metadata or {}), "text": text[:512]}}],
-            namespace=namespace,
-        )
+        vectors = self._embed_many([text for _, text, _ in items])
+        self._put_texts(namespace, [(doc_id, text) for doc_id, text, _ in items])
+        records = [
+            {"id": doc_id, "values": vector, "metadata": metadata or {}}
+            for (doc_id, _, metadata), vector in zip(items, vectors)
+        ]
+        # Fire all upserts on the index's thread pool, then join; batches that
+        # fail (e.g. 429) are retried one at a time with backoff.
+        pending = [
+            (batch, self.index.upsert(vectors=batch, namespace=namespace, async_req=True))
+            for batch in chunks(records, UPSERT_BATCH)
+        ]
+        failed = []
+        for batch, result in pending:
+            try:
+                result.get()
+            except Exception:
+                failed.append(batch)
+        for batch in failed:
+            self._upsert_with_backoff(namespace, batch)
+
+    def _upsert_with_backoff(self, namespace: str, batch: List[Dict[str, Any]]):
+        for attempt in range(UPSERT_RETRIES):
+            try:
+                self.index.upsert(vectors=batch, namespace=namespace)
+                return
+            except Exception:
+                if attempt == UPSERT_RETRIES - 1:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
 
     def query(self, namespace: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         if not self._available:
             return []
         vector = self._embed(query)
         result = self.index.query(vector=vector, top_k=top_k, namespace=namespace, include_metadata=True)
+        texts = self._get_texts(namespace, [m.id for m in result.matches])
         return [
-            {"id": m.id, "text": m.metadata.get("text", ""), "score": m.score, "metadata": m.metadata}
+            {
+                "id": m.id,
+                # Vectors upserted before the text store still carry a 512-char copy
+                "text": texts.get(m.id) or m.metadata.get("text", ""),
+                "score": m.score,
+                "metadata": m.metadata,
+            }
             for m in result.matches
         ]
 
@@ -117,8 +716,36 @@ class PineconeVectorStore:
         if not self._available:
             return False
         self.index.delete(ids=[doc_id], namespace=namespace)
+        with self._text_lock:
+            self._text_store.execute("DELETE FROM docs WHERE namespace = ? AND id = ?", (namespace, doc_id))
         return True
 
+    def _put_texts(self, namespace: str, rows: List[Tuple[str, str]]):
+        with self._text_lock:
+            conn = self._text_store
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO docs (namespace, id, text) VALUES (?, ?, ?)",
+                    [(namespace, doc_id, text) for doc_id, text in rows],
+                )
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _get_texts(self, namespace: str, ids: List[str]) -> Dict[str, str]:
+        """Full text for `ids`, in one round-trip."""
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" * len(ids))
+        with self._text_lock:
+            rows = self._text_store.execute(
+                f"SELECT id, text FROM docs WHERE namespace = ? AND id IN ({placeholders})",
+                (namespace, *ids),
+            ).fetchall()
+        return dict(rows)
+
     def list_docs(self, namespace: str) -> List[Dict[str, Any]]:
         # Pinecone doesn't have a list endpoint in all tiers; return empty
         return []
@@ -131,9 +758,15 @@ class PineconeVectorStore:
                 "namespace": namespace,
                 "doc_count": ns_stats.get("vector_count", 0),
                 "backend": "pinecone",
+                "embedding_cache": self.embedding_cache_stats(),
             }
         except Exception:
-            return {"namespace": namespace, "doc_count": 0, "backend": "pinecone"}
+            return {
+                "namespace": namespace,
+                "doc_count": 0,
+                "backend": "pinecone",
+                "embedding_cache": self.embedding_cache_stats(),
+            }
 
 
 class RAGManager:
@@ -149,6 +782,8 @@ class RAGManager:
         pinecone_key = os.getenv("PINECONE_API_KEY")
         if pinecone_key:
             self._store = PineconeVectorStore(pinecone_key)
+        elif np is not None and os.getenv("OPENAI_API_KEY"):
+            self._store = DenseVectorStore()
         else:
             self._store = InMemoryVectorStore()
 
@@ -158,12 +793,20 @@ class RAGManager:
 
     def ingest_text(self, namespace: str, text: str, source: str = "manual") -> List[str]:
         """Chunk and ingest plain text. Returns list of chunk IDs."""
-        chunks = self._chunk(text)
-        ids = []
-        for i, chunk in enumerate(chunks):
-            doc_id = hashlib.md5(f"{namespace}:{source}:{i}:{chunk}".encode()).hexdigest()
-            self._store.upsert(namespace, doc_id, chunk, {"source": source, "chunk_index": i})
-            ids.append(doc_id)
+        items = self._chunk_items(namespace, text, source)
+        self._store.upsert_batch(namespace, items)
+        return [doc_id for doc_id, _, _ in items]
+
+    def ingest_stream(self, namespace: str, pieces: Iterable[str], source: str = "upload") -> List[str]:
+        """
+        Chunk and ingest one document whose text arrives in pieces, upserting
+        every INGEST_CHUNK_BATCH chunks so the whole text is never held at once.
+        Chunks and ids match ingest_text() on the joined text.
+        """
+        ids: List[str] = []
+        for batch in chunks(self._items(namespace, self._chunk_stream(pieces), source), INGEST_CHUNK_BATCH):
+            self._store.upsert_batch(namespace, batch)
+            ids.extend(doc_id for doc_id, _, _ in batch)
         return ids
 
     def ingest_documents(self, namespace: str, documents: List[Dict[str, Any]]) -> List[str]:
@@ -171,11 +814,12 @@ class RAGManager:
         Ingest a list of {text, source, metadata} documents.
         Returns all chunk IDs.
         """
-        all_ids = []
+        items: List[Item] = []
         for doc in documents:
-            ids = self.ingest_text(namespace, doc.get("text", ""), doc.get("source", "upload"))
-            all_ids.extend(ids)
-        return all_ids
+            items.extend(self._chunk_items(namespace, doc.get("text", ""), doc.get("source", "upload")))
+        # All documents' chunks go out together: embeddings and upserts are batched
+        self._store.upsert_batch(namespace, items)
+        return [doc_id for doc_id, _, _ in items]
 
     # ------------------------------------------------------------------ #
     #  Retrieval                                                           #
@@ -213,12 +857,47 @@ class RAGManager:
     #  Internal                                                            #
     # ------------------------------------------------------------------ #
 
-    def _chunk(self, text: str) -> List[str]:
-        """Split text into overlapping chunks."""
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + self.CHUNK_SIZE
-            chunks.append(text[start:end])
-            start += self.CHUNK_SIZE - self.CHUNK_OVERLAP
-        return [c for c in chunks if c.strip()]
+    def _chunk_items(self, namespace: str, text: str, source: str) -> List[Item]:
+        return list(self._items(namespace, self._chunk(text), source))
+
+    def _items(self, namespace: str, chunk_iter: Iterable[str], source: str) -> Iterator[Item]:
+        if LEGACY_MD5_IDS:
+            for i, chunk in enumerate(chunk_iter):
+                doc_id = hashlib.md5(f"{namespace}:{source}:{i}:{chunk}".encode()).hexdigest()
+                yield doc_id, chunk, {"source": source, "chunk_index": i}
+            return
+        # "namespace:source:" is hashed once per document; each chunk resumes
+        # from a copy of that state and feeds its index and bytes directly.
+        prefix = hashlib.blake2b(f"{namespace}:{source}:".encode(), digest_size=16)
+        for i, chunk in enumerate(chunk_iter):
+            h = prefix.copy()
+            h.update(b"%d:" % i)
+            h.update(chunk.encode())
+            yield h.hexdigest(), chunk, {"source": source, "chunk_index": i}
+
+    def _chunk_stream(self, pieces: Iterable[str]) -> Iterator[str]:
+        """_chunk() over text arriving in pieces; only a chunk's worth is buffered."""
+        size, step = self.CHUNK_SIZE, self.CHUNK_SIZE - self.CHUNK_OVERLAP
+        buf = ""
+        for piece in pieces:
+            buf += piece
+            pos = 0
+            while len(buf) - pos >= size:  # a full chunk can't change any more
+                if _NON_SPACE.search(buf, pos, pos + size):
+                    yield buf[pos:pos + size]
+                pos += step
+            buf = buf[pos:]
+        pos = 0
+        while pos < len(buf):
+            if _NON_SPACE.search(buf, pos, pos + size):
+                yield buf[pos:pos + size]
+            pos += step
+
+    def _chunk(self, text: str) -> Iterator[str]:
+        """Lazily yield overlapping chunks, skipping whitespace-only ones."""
+        n = len(text)
+        for start in range(0, n, self.CHUNK_SIZE - self.CHUNK_OVERLAP):
+            end = min(start + self.CHUNK_SIZE, n)
+            # Whitespace check runs on the original string: no slice + strip() copy
+            if _NON_SPACE.search(text, start, end):
+                yield text[start:end]
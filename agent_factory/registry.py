@@ -5,12 +5,42 @@ Uses an in-memory store with JSON persistence.
 import os
 import json
 import uuid
+import atexit
 import secrets
-from typing import Dict, Any, List, Optional
+import threading
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Callable, Iterator
 from datetime import datetime
 
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str)
+except ImportError:  # pragma: no cover - depends on installed extras
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=str, separators=(",", ":")).encode("utf-8")
+
 
 REGISTRY_FILE = os.path.join(os.path.dirname(__file__), "..", "data", "agent_registry.json")
+PERSIST_DELAY_S = 0.2  # burst of mutations within this window -> one write
+
+# Fields never included in an agent's public view
+_PRIVATE_FIELDS = frozenset(("api_key",))
+
+# Scalar defaults for new agent records (see create_agent for per-agent ones)
+_DEFAULTS = MappingProxyType({
+    "description": "",
+    "llm_provider": "anthropic",
+    "llm_model": "claude-sonnet-4-20250514",
+    "soul": None,
+    "rag_enabled": False,
+    "system_prompt": "",
+    "analytics_enabled": True,
+    "twilio_enabled": False,
+    "livekit_enabled": False,
+})
 
 
 def _ensure_data_dir():
@@ -29,9 +59,12 @@ def _load_registry() -> Dict[str, Any]:
 
 
 def _save_registry(data: Dict[str, Any]):
+    """Write atomically: a crash mid-write leaves the previous file intact."""
     _ensure_data_dir()
-    with open(REGISTRY_FILE, "w") as f:
-        json.dump(data, f, indent=2, default=str)
+    tmp = REGISTRY_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_dumps(data))
+    os.replace(tmp, REGISTRY_FILE)
 
 
 class AgentRegistry:
@@ -42,9 +75,58 @@ class AgentRegistry:
 
     def __init__(self):
         self._agents: Dict[str, Any] = _load_registry()
+        # api_key -> agent_id, so key auth is a dict lookup rather than a scan
+        self._by_key: Dict[str, str] = {
+            a["api_key"]: aid for aid, a in self._agents.items() if a.get("api_key")
+        }
+        # twilio_number -> agent_id, so inbound SMS / calls route without a scan
+        self._by_number: Dict[str, str] = {
+            a["twilio_number"]: aid for aid, a in self._agents.items() if a.get("twilio_number")
+        }
+        # agent_id -> record without private fields, rebuilt only on writes
+        self._public: Dict[str, Dict[str, Any]] = {}
+        for agent_id in self._agents:
+            self._refresh_public(agent_id)
+
+        # Debounced persistence: mutations mark the registry dirty and arm a
+        # short timer; batch() holds writes until the outermost block exits.
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self._batch_depth = 0
+        atexit.register(self.flush)
 
     def _persist(self):
-        _save_registry(self._agents)
+        with self._lock:
+            self._dirty = True
+            if self._batch_depth == 0 and self._timer is None:
+                self._timer = threading.Timer(PERSIST_DELAY_S, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write pending changes now (also runs at interpreter exit)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            _save_registry(self._agents)
+
+    @contextmanager
+    def batch(self) -> Iterator["AgentRegistry"]:
+        """Coalesce every mutation inside the block into a single write."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self._persist()
 
     # ------------------------------------------------------------------ #
     #  CRUD                                                                #
@@ -52,34 +134,32 @@ class AgentRegistry:
 
     def create_agent(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """Register a new agent and return its full record with ID and key."""
-        agent_id = str(uuid.uuid4())
-        api_key = secrets.token_urlsafe(32)
+        agent_id = uuid.uuid4().hex
+        now = datetime.utcnow().isoformat()
 
+        # One merge instead of a setdefault per field; config wins over all of it.
+        # List defaults are built per record so agents never share them.
         record = {
             "id": agent_id,
-            "api_key": api_key,
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat(),
+            "api_key": secrets.token_urlsafe(32),
+            "created_at": now,
+            "updated_at": now,
             "status": "active",
+            "name": f"Agent-{agent_id[:8]}",
+            **_DEFAULTS,
+            "channels": ["chat"],
+            "tools": [],
+            "plugins": [],
+            "rag_namespace": agent_id,
             **config,
         }
-        # Ensure required defaults
-        record.setdefault("name", f"Agent-{agent_id[:8]}")
-        record.setdefault("description", "")
-        record.setdefault("llm_provider", "anthropic")
-        record.setdefault("llm_model", "claude-sonnet-4-20250514")
-        record.setdefault("channels", ["chat"])
-        record.setdefault("tools", [])
-        record.setdefault("soul", None)
-        record.setdefault("rag_enabled", False)
-        record.setdefault("rag_namespace", agent_id)
-        record.setdefault("system_prompt", "")
-        record.setdefault("plugins", [])
-        record.setdefault("analytics_enabled", True)
-        record.setdefault("twilio_enabled", False)
-        record.setdefault("livekit_enabled", False)
 
         self._agents[agent_id] = record
+        if record.get("api_key"):
+            self._by_key[record["api_key"]] = agent_id
+        if record.get("twilio_number"):
+            self._by_number[record["twilio_number"]] = agent_id
+        self._refresh_public(agent_id)
         self._persist()
         return record
 
@@ -87,44 +167,91 @@ class AgentRegistry:
         return self._agents.get(agent_id)
 
     def get_agent_by_key(self, api_key: str) -> Optional[Dict[str, Any]]:
-        for agent in self._agents.values():
-            if agent.get("api_key") == api_key:
-                return agent
+        agent = self._agents.get(self._by_key.get(api_key, ""))
+        if agent and secrets.compare_digest(agent.get("api_key", ""), api_key):
+            return agent
         return None
 
+    def route_inbound(self, to_number: str) -> Optional[str]:
+        """Agent ID for a Twilio number: the agent bound to it, else the first agent."""
+        return self._by_number.get(to_number) or next(iter(self._agents), None)
+
+    def get_public_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """The agent without its api_key. Shared, not copied: treat as read-only."""
+        return self._public.get(agent_id)
+
     def list_agents(self) -> List[Dict[str, Any]]:
-        """Return all agents (sans api_key for security)."""
-        safe = []
-        for a in self._agents.values():
-            copy = dict(a)
-            copy.pop("api_key", None)
-            safe.append(copy)
-        return safe
+        """Return all agents (sans api_key for security). The dicts are read-only views."""
+        return list(self._public.values())
+
+    def _refresh_public(self, agent_id: str):
+        agent = self._agents.get(agent_id)
+        if agent is None:
+            self._public.pop(agent_id, None)
+        else:
+            self._public[agent_id] = {k: v for k, v in agent.items() if k not in _PRIVATE_FIELDS}
 
     def update_agent(self, agent_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         if agent_id not in self._agents:
             return None
+        self._apply_updates(self._agents[agent_id], updates)
+        return self._agents[agent_id]
+
+    def mutate(
+        self,
+        agent_id: str,
+        fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look an agent up once, let fn(agent) compute updates from it, and
+        apply + persist them in the same step. fn may return None / {} for
+        no change. Returns the agent record, or None if not found.
+        """
+        agent = self._agents.get(agent_id)
+        if agent is None:
+            return None
+        updates = fn(agent)
+        if updates:
+            self._apply_updates(agent, updates)
+        return agent
+
+    def _apply_updates(self, agent: Dict[str, Any], updates: Dict[str, Any]):
         updates.pop("id", None)
         updates.pop("api_key", None)
         updates.pop("created_at", None)
-        self._agents[agent_id].update(updates)
-        self._agents[agent_id]["updated_at"] = datetime.utcnow().isoformat()
+        if "twilio_number" in updates:
+            self._unbind_number(agent)
+            if updates["twilio_number"]:
+                self._by_number[updates["twilio_number"]] = agent["id"]
+        agent.update(updates)
+        agent["updated_at"] = datetime.utcnow().isoformat()
+        self._refresh_public(agent["id"])
         self._persist()
-        return self._agents[agent_id]
 
     def delete_agent(self, agent_id: str) -> bool:
         if agent_id not in self._agents:
             return False
-        del self._agents[agent_id]
+        agent = self._agents.pop(agent_id)
+        self._by_key.pop(agent.get("api_key"), None)
+        self._unbind_number(agent)
+        self._refresh_public(agent_id)
         self._persist()
         return True
 
+    def _unbind_number(self, agent: Dict[str, Any]):
+        number = agent.get("twilio_number")
+        if number and self._by_number.get(number) == agent["id"]:
+            del self._by_number[number]
+
     def rotate_key(self, agent_id: str) -> Optional[str]:
         if agent_id not in self._agents:
             return None
         new_key = secrets.token_urlsafe(32)
+        self._by_key.pop(self._agents[agent_id].get("api_key"), None)
+        self._by_key[new_key] = agent_id
         self._agents[agent_id]["api_key"] = new_key
         self._agents[agent_id]["updated_at"] = datetime.utcnow().isoformat()
+        self._refresh_public(agent_id)
         self._persist()
         return new_key
 
@@ -137,6 +264,7 @@ class AgentRegistry:
             return False
         self._agents[agent_id]["soul"] = soul_content
         self._agents[agent_id]["updated_at"] = datetime.utcnow().isoformat()
+        self._refresh_public(agent_id)
         self._persist()
         return True
 
@@ -147,5 +275,6 @@ class AgentRegistry:
         merged = list(set(existing + tools))
         self._agents[agent_id]["tools"] = merged
         self._agents[agent_id]["updated_at"] = datetime.utcnow().isoformat()
+        self._refresh_public(agent_id)
         self._persist()
         return True
@@ -4,7 +4,32 @@ Parses and applies .soul documents to agent configurations.
 Soul documents define agent personality, voice, values, and behavior.
 """
 import re
-from typing import Dict, Any, Optional
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+
+
+HEADER_LINES = 15  # name:/role:/archetype: are only read from the top of the doc
+_HEADER_KEYS = frozenset(("name", "role", "archetype"))
+# "## Header" lines (literal "\n##" prefix keeps the scan fast); a section
+# body runs to the next "\n##", so subsections end it too
+_HEADER_RE = re.compile(r"\n##[ \t]*([^\n]*)(?=\n)")
+# Candidate bullet lines: "- item" / "* item" / "• item", or a quoted line
+_BULLET_RE = re.compile(r'^[ \t]*([-*•"])(.*)', re.M)
+# soul field, section header, header is a prefix (e.g. "## Voice & Tone")
+_BULLET_SECTIONS = (
+    ("personality", "personality", False),
+    ("voice", "voice", True),
+    ("values", "core values", False),
+    ("catchphrases", "catchphrases", True),
+)
+
+PROMPT_CACHE_SIZE = 512
+# (sha1(soul raw), sha1(base prompt)) -> composed system prompt, LRU order
+_PROMPT_CACHE: "OrderedDict[Tuple[bytes, bytes], str]" = OrderedDict()
+_PROMPT_LOCK = threading.Lock()
 
 
 def parse_soul(content: str) -> Dict[str, Any]:
@@ -26,70 +51,95 @@ def parse_soul(content: str) -> Dict[str, Any]:
     }
 
     # Extract name / role / archetype from top YAML-like lines
-    for line in content.splitlines()[:15]:
-        line = line.strip()
-        if line.startswith("name:"):
-            soul["name"] = line.split(":", 1)[1].strip()
-        elif line.startswith("role:"):
-            soul["role"] = line.split(":", 1)[1].strip()
-        elif line.startswith("archetype:"):
-            soul["archetype"] = line.split(":", 1)[1].strip()
-
-    # Extract System Prompt section
-    sp_match = re.search(
-        r"## System Prompt.*?\n([\s\S]+?)(?=\n##|\Z)", content, re.IGNORECASE
-    )
-    if sp_match:
-        soul["system_prompt"] = sp_match.group(1).strip()
-
-    # Extract Personality section bullets
-    pers_match = re.search(
-        r"## Personality\n([\s\S]+?)(?=\n##|\Z)", content, re.IGNORECASE
-    )
-    if pers_match:
-        soul["personality"] = _extract_bullets(pers_match.group(1))
-
-    # Extract Voice section bullets
-    voice_match = re.search(
-        r"## Voice.*?\n([\s\S]+?)(?=\n##|\Z)", content, re.IGNORECASE
-    )
-    if voice_match:
-        soul["voice"] = _extract_bullets(voice_match.group(1))
-
-    # Extract Core Values section bullets
-    values_match = re.search(
-        r"## Core Values\n([\s\S]+?)(?=\n##|\Z)", content, re.IGNORECASE
-    )
-    if values_match:
-        soul["values"] = _extract_bullets(values_match.group(1))
-
-    # Extract Catchphrases section
-    catch_match = re.search(
-        r"## Catchphrases.*?\n([\s\S]+?)(?=\n##|\Z)", content, re.IGNORECASE
-    )
-    if catch_match:
-        soul["catchphrases"] = _extract_bullets(catch_match.group(1))
+    # (maxsplit: the rest of the document stays one string)
+    for line in content.split("\n", HEADER_LINES)[:HEADER_LINES]:
+        key, sep, value = line.strip().partition(":")
+        if sep and key in _HEADER_KEYS:
+            soul[key] = value.strip()
+
+    # One scan over "## " headers; first occurrence of each section wins
+    text = "\n" + content if content.startswith("##") else content
+    sections: Dict[str, str] = {}
+    for m in _HEADER_RE.finditer(text):
+        start = m.end() + 1
+        end = text.find("\n##", start + 1)  # body is at least one char
+        sections.setdefault(m.group(1).strip().lower(), text[start:end if end != -1 else None])
+
+    def section(name: str, prefix: bool = False) -> Optional[str]:
+        if not prefix:
+            return sections.get(name)
+        return next((body for header, body in sections.items() if header.startswith(name)), None)
+
+    body = section("system prompt", prefix=True)
+    if body and body.strip():
+        soul["system_prompt"] = body.strip()
+    for field, name, prefix in _BULLET_SECTIONS:
+        body = section(name, prefix)
+        if body:
+            soul[field] = _extract_bullets(body)
 
     return soul
 
 
+@lru_cache(maxsize=512)
+def parse_soul_cached(content: str) -> Dict[str, Any]:
+    """
+    Memoized parse_soul for repeated uploads / updates of the same document.
+    The returned dict is shared between callers — treat it as read-only.
+    """
+    return parse_soul(content)
+
+
 def _extract_bullets(text: str):
     """Extract bullet-point lines from a markdown section."""
     items = []
-    for line in text.splitlines():
-        line = line.strip()
-        if line.startswith(("-", "*", "•")):
+    for mark, rest in _BULLET_RE.findall(text):
+        line = (mark + rest).strip()
+        if mark != '"':
             items.append(line.lstrip("-*• ").strip())
-        elif line.startswith('"') and line.endswith('"'):
+        elif line.endswith('"'):
             items.append(line.strip('"'))
     return items
 
 
+def _sha1(text: str) -> bytes:
+    return hashlib.sha1(text.encode()).digest()
+
+
 def build_system_prompt_from_soul(soul: Dict[str, Any], base_prompt: str = "") -> str:
     """
     Compose a final system prompt from a parsed soul document,
-    optionally prepending a base prompt.
+    optionally prepending a base prompt. Memoized on the soul's raw
+    content, so the soul dict must not be modified after parsing.
     """
+    raw = soul.get("raw")
+    if not raw:
+        return _build_system_prompt(soul, base_prompt)
+    key = (_sha1(raw), _sha1(base_prompt))
+    with _PROMPT_LOCK:
+        prompt = _PROMPT_CACHE.get(key)
+        if prompt is not None:
+            _PROMPT_CACHE.move_to_end(key)
+            return prompt
+    prompt = _build_system_prompt(soul, base_prompt)
+    with _PROMPT_LOCK:
+        _PROMPT_CACHE[key] = prompt
+        if len(_PROMPT_CACHE) > PROMPT_CACHE_SIZE:
+            _PROMPT_CACHE.popitem(last=False)
+    return prompt
+
+
+def invalidate(soul_raw: Optional[str]):
+    """Drop cached system prompts built from this soul document."""
+    if not soul_raw:
+        return
+    digest = _sha1(soul_raw)
+    with _PROMPT_LOCK:
+        for key in [k for k in _PROMPT_CACHE if k[0] == digest]:
+            del _PROMPT_CACHE[key]
+
+
+def _build_system_prompt(soul: Dict[str, Any], base_prompt: str) -> str:
     parts = []
 
     if base_prompt:
@@ -119,7 +169,7 @@ def build_system_prompt_from_soul(soul: Dict[str, Any], base_prompt: str = "") -
 
 def validate_soul(content: str) -> Dict[str, Any]:
     """Validate a soul document and return parse results + any warnings."""
-    parsed = parse_soul(content)
+    parsed = parse_soul_cached(content)
     warnings = []
 
     if not parsed.get("name"):
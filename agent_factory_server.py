@@ -3,17 +3,35 @@ Agent Factory Platform — FastAPI Server
 Full REST API for agent management, chat, RAG, Twilio, xAI, analytics, plugins.
 """
 import os
+import re
+import codecs
+import asyncio
 import time
 import json
-from typing import Dict, Any, Optional, List
-from datetime import datetime
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Tuple, Iterator, AsyncIterator, BinaryIO
 
+import anyio
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Header, Depends
-from fastapi.responses import HTMLResponse, JSONResponse, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+
+    _dumps = orjson.dumps
+except ImportError:  # pragma: no cover - depends on installed extras
+    DefaultResponse = JSONResponse
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
 
 load_dotenv()
 
@@ -27,15 +45,64 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    default_response_class=DefaultResponse,
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+class FastCORS:
+    """
+    Allow-everything CORS (any origin, method and header, with credentials)
+    as a bare ASGI middleware. Requests without an Origin header pass straight
+    through; preflights are answered here without reaching the app.
+    """
+
+    _METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        origin = request_headers = None
+        preflight = False
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                preflight = True
+            elif name == b"access-control-request-headers":
+                request_headers = value
+        if origin is None:  # same-origin UI, curl, Twilio: nothing to add
+            return await self.app(scope, receive, send)
+
+        # Credentials rule out "*", so the caller's origin is echoed back
+        cors = [
+            (b"access-control-allow-origin", origin),
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+        if preflight and scope["method"] == "OPTIONS":
+            headers = cors + [
+                (b"access-control-allow-methods", self._METHODS),
+                (b"access-control-max-age", b"600"),
+                (b"content-length", b"0"),
+            ]
+            if request_headers:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + cors
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+app.add_middleware(FastCORS)
 
 # ------------------------------------------------------------------ #
 #  Platform services (lazy-init to avoid import errors at startup)    #
@@ -45,45 +112,205 @@ _factory = None
 _analytics = None
 _webhooks = None
 _livekit = None
+# Guards first construction only; once set, getters return without locking
+_init_lock = threading.Lock()
 
 
 def get_factory():
     global _factory
     if _factory is None:
-        from agent_factory.factory import AgentFactory
-        _factory = AgentFactory()
+        with _init_lock:
+            if _factory is None:
+                from agent_factory.factory import AgentFactory
+                _factory = AgentFactory()
     return _factory
 
 
 def get_analytics():
     global _analytics
     if _analytics is None:
-        from agent_factory.analytics.tracker import AnalyticsTracker
-        _analytics = AnalyticsTracker()
+        with _init_lock:
+            if _analytics is None:
+                from agent_factory.analytics.tracker import AnalyticsTracker
+                _analytics = AnalyticsTracker()
     return _analytics
 
 
 def get_webhooks():
     global _webhooks
     if _webhooks is None:
-        from agent_factory.plugins.webhook import WebhookManager
-        _webhooks = WebhookManager()
+        with _init_lock:
+            if _webhooks is None:
+                from agent_factory.plugins.webhook import WebhookManager
+                _webhooks = WebhookManager()
     return _webhooks
 
 
 def get_livekit():
     global _livekit
     if _livekit is None:
-        from agent_factory.integrations.livekit_int import LiveKitManager
-        _livekit = LiveKitManager()
+        with _init_lock:
+            if _livekit is None:
+                from agent_factory.integrations.livekit_int import LiveKitManager
+                _livekit = LiveKitManager()
     return _livekit
 
 
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "200"))  # concurrent blocking calls
+LONG_PROMPT_CHARS = int(os.getenv("LONG_PROMPT_CHARS", "4000"))  # chat prompts at/above this are "long"
+LONG_PROMPT_SLOTS = int(os.getenv("LONG_PROMPT_SLOTS", "8"))     # threads long prompts may hold at once
+RAG_CONTEXT_CHARS = 2500  # ~top-5 chunks injected for RAG-enabled agents
+_long_prompt_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+class PrioritySemaphore:
+    """
+    A semaphore whose waiters are admitted by priority (0 first), FIFO
+    within a priority. Each priority also has its own cap, so a flood of
+    low-priority work can never hold every slot. Event-loop only.
+    """
+
+    def __init__(self, slots: int, caps: Dict[int, int]):
+        self._free = slots
+        self._caps = caps
+        self._levels = sorted(caps)
+        self._active = {level: 0 for level in caps}
+        self._waiters = {level: deque() for level in caps}
+
+    async def acquire(self, priority: int):
+        if self._admissible(priority) and not any(self._waiters[l] for l in self._levels if l <= priority):
+            self._take(priority)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(priority)  # granted just as we were cancelled
+            else:
+                self._waiters[priority].remove(future)
+            raise
+
+    def release(self, priority: int):
+        self._active[priority] -= 1
+        self._free += 1
+        for level in self._levels:
+            queue = self._waiters[level]
+            while queue and self._admissible(level):
+                self._take(level)
+                queue.popleft().set_result(None)
+
+    def _admissible(self, priority: int) -> bool:
+        return self._free > 0 and self._active[priority] < self._caps[priority]
+
+    def _take(self, priority: int):
+        self._active[priority] += 1
+        self._free -= 1
+
+    @asynccontextmanager
+    async def priority(self, priority: int) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+
+# Twilio gives a webhook ~10s, so calls and texts go ahead of chat, and
+# bulk ingests (big PDFs) may only ever hold a quarter of the slots
+PRIORITY_VOICE, PRIORITY_SMS, PRIORITY_CHAT, PRIORITY_INGEST = range(4)
+_CHANNEL_PRIORITY = {"voice": PRIORITY_VOICE, "phone": PRIORITY_VOICE, "sms": PRIORITY_SMS}
+_scheduler = PrioritySemaphore(THREADPOOL_SIZE, {
+    PRIORITY_VOICE: THREADPOOL_SIZE,
+    PRIORITY_SMS: THREADPOOL_SIZE,
+    PRIORITY_CHAT: max(1, THREADPOOL_SIZE * 3 // 4),
+    PRIORITY_INGEST: max(1, THREADPOOL_SIZE // 4),
+})
+
+
+def _channel_priority(channel: str) -> int:
+    return _CHANNEL_PRIORITY.get(channel, PRIORITY_CHAT)
+
+
+async def _prioritized(priority: int, fn, *args, **kwargs):
+    """run_in_threadpool, admitted to the pool in priority order."""
+    async with _scheduler.priority(priority):
+        return await run_in_threadpool(fn, *args, **kwargs)
+
+
+@app.on_event("startup")
+async def _size_threadpool():
+    # Blocking SDK calls (LLMs, Twilio, webhooks) run on anyio's pool; the
+    # default 40 threads would queue requests behind slow LLM calls
+    global _long_prompt_limiter
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    _long_prompt_limiter = anyio.CapacityLimiter(LONG_PROMPT_SLOTS)
+
+
+CLOCK_REFRESH_S = 0.2
+_now_iso = ""  # second-resolution UTC timestamp, refreshed by _tick_clock
+
+
+def _utc_now_iso() -> str:
+    return _now_iso or time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+async def _tick_clock():
+    global _now_iso
+    while True:
+        _now_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        await asyncio.sleep(CLOCK_REFRESH_S)
+
+
+@app.on_event("startup")
+async def _start_clock():
+    # Like a server's cached Date header: handlers read a string, not the clock
+    app.state.clock_task = asyncio.create_task(_tick_clock())
+
+
+@app.on_event("startup")
+def _preload_services():
+    # Build the services before the first request; one that fails to
+    # initialize here is retried lazily by its getter as before
+    for getter in (get_factory, get_analytics, get_webhooks, get_livekit):
+        try:
+            getter()
+        except Exception as e:
+            print(f"[server] {getter.__name__} preload failed: {e}")
+
+
+# ------------------------------------------------------------------ #
+#  Upload helpers (run on worker threads)                              #
+# ------------------------------------------------------------------ #
+
+UPLOAD_READ_SIZE = 64 * 1024
+
+
+def _iter_text(f: BinaryIO) -> Iterator[str]:
+    """Decode an uploaded file as UTF-8 in 64KB pieces."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = f.read(UPLOAD_READ_SIZE)
+        if not chunk:
+            break
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
 # ------------------------------------------------------------------ #
 #  Pydantic models                                                     #
 # ------------------------------------------------------------------ #
 
-class AgentCreateRequest(BaseModel):
+class RequestModel(BaseModel):
+    """
+    Base for request bodies: immutable once parsed, unknown fields dropped
+    without a validator pass, and strings capped at 64K characters.
+    """
+    model_config = ConfigDict(frozen=True, extra="ignore", str_max_length=65536)
+
+
+class AgentCreateRequest(RequestModel):
     name: str
     description: str = ""
     llm_provider: str = "anthropic"
@@ -95,12 +322,13 @@ class AgentCreateRequest(BaseModel):
     rag_enabled: bool = False
     twilio_enabled: bool = False
     livekit_enabled: bool = False
+    twilio_number: Optional[str] = None  # inbound SMS / calls to this number reach the agent
     plugins: List[str] = []
     analytics_enabled: bool = True
     max_tokens: int = 2048
 
 
-class AgentUpdateRequest(BaseModel):
+class AgentUpdateRequest(RequestModel):
     name: Optional[str] = None
     description: Optional[str] = None
     llm_provider: Optional[str] = None
@@ -112,69 +340,70 @@ class AgentUpdateRequest(BaseModel):
     rag_enabled: Optional[bool] = None
     twilio_enabled: Optional[bool] = None
     livekit_enabled: Optional[bool] = None
+    twilio_number: Optional[str] = None
     max_tokens: Optional[int] = None
 
 
-class ChatRequest(BaseModel):
+class ChatRequest(RequestModel):
     message: str
     session_id: Optional[str] = "default"
     channel: str = "chat"
 
 
-class LLMSwitchRequest(BaseModel):
+class LLMSwitchRequest(RequestModel):
     provider: str
     model: str
 
 
-class RAGIngestRequest(BaseModel):
+class RAGIngestRequest(RequestModel):
     documents: List[Dict[str, Any]]  # [{text, source, metadata}]
 
 
-class SMSRequest(BaseModel):
+class SMSRequest(RequestModel):
     to: str
     body: str
     from_number: Optional[str] = None
 
 
-class CallRequest(BaseModel):
+class CallRequest(RequestModel):
     to: str
     twiml_url: str
     record: bool = True
 
 
-class ImageGenRequest(BaseModel):
+class ImageGenRequest(RequestModel):
     prompt: str
     n: int = 1
     size: str = "1024x1024"
     model: str = "grok-2-image-1212"
 
 
-class GrokSearchRequest(BaseModel):
+class GrokSearchRequest(RequestModel):
     query: str
     model: str = "grok-2"
 
 
-class TTSRequest(BaseModel):
+class TTSRequest(RequestModel):
     text: str
     voice: str = "eve"
     response_format: str = "mp3"
     speed: float = 1.0
 
 
-class WebhookRegisterRequest(BaseModel):
+class WebhookRegisterRequest(RequestModel):
     url: str
     events: List[str]
     name: str = ""
     secret: Optional[str] = None
 
 
-class EmbedWidgetRequest(BaseModel):
+class EmbedWidgetRequest(RequestModel):
     theme: str = "dark"
     position: str = "bottom-right"
     title: str = "Chat with AI"
 
 
-class LiveKitSessionRequest(BaseModel):
+class LiveKitSessionRequest(RequestModel):
     session_id: Optional[str] = None
     channel: str = "voice"
 
@@ -183,37 +412,80 @@ class LiveKitSessionRequest(BaseModel):
 #  UI                                                                  #
 # ------------------------------------------------------------------ #
 
+WEB_DIR = os.path.join(os.path.dirname(__file__), "web")
+_WIDGET_VAR_RE = re.compile(r"\{\{(AGENT_ID|THEME)\}\}")
+
+
+@lru_cache(maxsize=1)
+def _platform_file() -> Optional[Tuple[str, os.stat_result]]:
+    """Path and stat of the platform UI, looked up once."""
+    for name in ("platform.html", "index.html"):
+        html_path = os.path.join(WEB_DIR, name)
+        try:
+            return html_path, os.stat(html_path)
+        except OSError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=1)
+def _widget_template() -> Optional[List[str]]:
+    """widget.html split around its placeholders: [text, name, text, name, ..., text]."""
+    html_path = os.path.join(WEB_DIR, "widget.html")
+    if not os.path.exists(html_path):
+        return None
+    with open(html_path, "r") as f:
+        return _WIDGET_VAR_RE.split(f.read())
+
+
+@app.on_event("startup")
+def _load_templates():
+    # Resolve the UI files / static info once here so the first request doesn't pay for it
+    _platform_file()
+    _widget_template()
+    _platform_info()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def serve_platform_ui():
     """Serve the Agent Factory Platform UI."""
-    html_path = os.path.join(os.path.dirname(__file__), "web", "platform.html")
-    if not os.path.exists(html_path):
-        html_path = os.path.join(os.path.dirname(__file__), "web", "index.html")
-    if os.path.exists(html_path):
-        with open(html_path, "r") as f:
-            return f.read()
+    ui = _platform_file()
+    if ui is not None:
+        # Prestat'd FileResponse: sendfile plus ETag / Last-Modified headers
+        html_path, stat_result = ui
+        return FileResponse(html_path, stat_result=stat_result, media_type="text/html")
     return HTMLResponse("<h1>Agent Factory</h1><p>UI not found. Check web/platform.html</p>", status_code=200)
 
 
 @app.get("/widget/{agent_id}", response_class=HTMLResponse)
 async def serve_widget(agent_id: str, theme: str = "dark"):
     """Serve the embeddable chat widget UI."""
-    html_path = os.path.join(os.path.dirname(__file__), "web", "widget.html")
-    if os.path.exists(html_path):
-        with open(html_path, "r") as f:
-            content = f.read()
-            content = content.replace("{{AGENT_ID}}", agent_id).replace("{{THEME}}", theme)
-            return content
+    parts = _widget_template()
+    if parts is not None:
+        values = {"AGENT_ID": agent_id, "THEME": theme}
+        return "".join(values[part] if i % 2 else part for i, part in enumerate(parts))
     return HTMLResponse(f"<p>Widget for agent {agent_id}</p>")
 
 
+# Everything else under web/ is served by Starlette directly (conditional GETs -> 304)
+if os.path.isdir(WEB_DIR):
+    app.mount("/static", StaticFiles(directory=WEB_DIR, html=True), name="static")
+if os.path.isdir(os.path.join(WEB_DIR, "assets")):
+    app.mount("/assets", StaticFiles(directory=os.path.join(WEB_DIR, "assets")), name="assets")
+
+
 # ------------------------------------------------------------------ #
 #  Health                                                              #
 # ------------------------------------------------------------------ #
 
+# Probes hit this every few seconds: the body is pre-encoded up to the timestamp
+_HEALTH_HEAD = _dumps({"status": "healthy", "platform": "Agent Factory"})[:-1] + b',"timestamp":"'
+
+
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "platform": "Agent Factory", "timestamp": datetime.utcnow().isoformat()}
+    body = b"".join((_HEALTH_HEAD, _utc_now_iso().encode(), b'"}'))
+    return Response(content=body, media_type="application/json")
 
 
 # ------------------------------------------------------------------ #
@@ -224,7 +496,7 @@ async def health():
 async def create_agent(req: AgentCreateRequest):
     """Create a new agent with full configuration."""
     factory = get_factory()
-    agent = factory.create_agent(req.dict())
+    agent = await run_in_threadpool(factory.create_agent, req.model_dump())
     return agent
 
 
@@ -238,24 +510,20 @@ async def list_agents():
 @app.get("/api/agents/{agent_id}")
 async def get_agent(agent_id: str):
     factory = get_factory()
-    agent = factory.get_agent(agent_id)
+    agent = factory.get_public_agent(agent_id)
     if not agent:
         raise HTTPException(404, "Agent not found")
-    safe = dict(agent)
-    safe.pop("api_key", None)
-    return safe
+    return agent
 
 
 @app.patch("/api/agents/{agent_id}")
 async def update_agent(agent_id: str, req: AgentUpdateRequest):
     factory = get_factory()
-    updates = {k: v for k, v in req.dict().items() if v is not None}
-    result = factory.update_agent(agent_id, updates)
+    updates = req.model_dump(exclude_none=True)
+    result = await run_in_threadpool(factory.update_agent, agent_id, updates)
     if not result:
         raise HTTPException(404, "Agent not found")
-    safe = dict(result)
-    safe.pop("api_key", None)
-    return safe
+    return factory.get_public_agent(agent_id)
 
 
 @app.delete("/api/agents/{agent_id}")
@@ -279,19 +547,89 @@ async def rotate_api_key(agent_id: str):
 #  Chat                                                                #
 # ------------------------------------------------------------------ #
 
+_background_tasks: set = set()  # strong refs so running tasks aren't collected
+
+
+def _fire_webhooks(agent_id: str, event_type: str, payload: Dict[str, Any]):
+    """Deliver an event's webhooks in the background; the response doesn't wait."""
+    task = asyncio.ensure_future(run_in_threadpool(get_webhooks().fire, agent_id, event_type, payload))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+# (agent_id, session_id, channel, message) -> result of the chat call in flight
+_inflight_chats: Dict[tuple, "asyncio.Future"] = {}
+
+
+async def _coalesced_chat(agent_id: str, req: ChatRequest) -> Tuple[Dict[str, Any], bool, float]:
+    """
+    Run factory.chat, sharing one LLM call between identical requests that
+    arrive while it is in flight (client retries, double submits).
+    Returns (result, leader, stall_ms); only the leader records
+    analytics/webhooks.
+    """
+    key = (agent_id, req.session_id or "default", req.channel, req.message)
+    pending = _inflight_chats.get(key)
+    if pending is not None:
+        try:
+            result, _ = await asyncio.shield(pending)
+            return result, False, 0.0
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise  # this request was cancelled, not the shared call
+            return await _coalesced_chat(agent_id, req)
+
+    future = _inflight_chats[key] = asyncio.get_running_loop().create_future()
+    try:
+        result, stall_ms = await _scheduled_chat(agent_id, req)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # retrieved: no "never retrieved" warning without followers
+        raise
+    else:
+        future.set_result((result, stall_ms))
+    finally:
+        del _inflight_chats[key]
+    return result, True, stall_ms
+
+
+async def _scheduled_chat(agent_id: str, req: ChatRequest) -> Tuple[Dict[str, Any], float]:
+    """
+    Run factory.chat on a worker thread, admitted by channel priority. Long
+    prompts also get their own small limiter so a few big RAG turns can't
+    take every thread that short SMS / voice replies need.
+    Returns (result, ms spent waiting for a thread).
+    """
+    factory = get_factory()
+    agent = factory.get_agent(agent_id) or {}
+    prompt_chars = len(req.message) + (RAG_CONTEXT_CHARS if agent.get("rag_enabled") else 0)
+    limiter = _long_prompt_limiter if prompt_chars >= LONG_PROMPT_CHARS else None
+    queued = time.perf_counter()
+
+    def _chat():
+        stall_ms = (time.perf_counter() - queued) * 1000
+        return factory.chat(agent_id, req.message, req.session_id, req.channel), stall_ms
+
+    async with _scheduler.priority(_channel_priority(req.channel)):
+        return await anyio.to_thread.run_sync(_chat, limiter=limiter)
+
+
 @app.post("/api/agents/{agent_id}/chat")
 async def agent_chat(agent_id: str, req: ChatRequest):
     """Send a message to an agent (any channel)."""
-    factory = get_factory()
     analytics = get_analytics()
-    webhooks = get_webhooks()
 
     start = time.time()
-    result = factory.chat(agent_id, req.message, req.session_id, req.channel)
+    result, leader, stall_ms = await _coalesced_chat(agent_id, req)
     latency = (time.time() - start) * 1000
 
     if "error" in result:
         raise HTTPException(500, result["error"])
+    if not leader:
+        return result  # the request that made the LLM call reports it
 
     # Analytics
     analytics.record_chat(
@@ -301,10 +639,11 @@ async def agent_chat(agent_id: str, req: ChatRequest):
         latency_ms=latency,
         provider=result.get("llm_provider", ""),
         model=result.get("llm_model", ""),
+        generation_stall_ms=stall_ms,
     )
 
     # Fire webhooks for "message" event
-    webhooks.fire(agent_id, "message", {
+    _fire_webhooks(agent_id, "message", {
         "user_message": req.message,
         "agent_response": result.get("response", ""),
         "channel": req.channel,
@@ -314,6 +653,79 @@ async def agent_chat(agent_id: str, req: ChatRequest):
     return result
 
 
+async def _coalesced_stream(tokens: Iterator[str], priority: int = PRIORITY_CHAT) -> AsyncIterator[str]:
+    """
+    Drive a blocking token iterator on a worker thread and yield text to the
+    client. Everything queued since the last send goes out as one piece, so
+    a slow client gets fewer, larger frames instead of one per token.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def _pump():
+        try:
+            for token in tokens:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, token)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    worker = asyncio.ensure_future(_prioritized(priority, _pump))
+    try:
+        finished = False
+        while not finished:
+            batch = [await queue.get()]
+            while not queue.empty():  # backpressure: take whatever piled up
+                batch.append(queue.get_nowait())
+            if batch[-1] is done:
+                batch.pop()
+                finished = True
+            if batch:
+                yield "".join(batch)
+        await worker  # surface errors from the token iterator
+    finally:
+        stop.set()  # client went away: let the worker thread wind down
+
+
+@app.post("/api/agents/{agent_id}/chat/stream")
+async def agent_chat_stream(agent_id: str, req: ChatRequest):
+    """Send a message to an agent and stream the reply as server-sent events."""
+    factory = get_factory()
+    if not factory.get_agent(agent_id):
+        raise HTTPException(404, "Agent not found")
+
+    async def _events():
+        start = time.time()
+        parts = []
+        async for text in _coalesced_stream(
+            factory.chat_stream(agent_id, req.message, req.session_id), _channel_priority(req.channel)
+        ):
+            parts.append(text)
+            yield f"data: {json.dumps({'delta': text})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+        agent = factory.get_agent(agent_id) or {}
+        get_analytics().record_chat(
+            agent_id=agent_id,
+            session_id=req.session_id or "default",
+            channel=req.channel,
+            latency_ms=(time.time() - start) * 1000,
+            provider=agent.get("llm_provider", ""),
+            model=agent.get("llm_model", ""),
+        )
+        _fire_webhooks(agent_id, "message", {
+            "user_message": req.message,
+            "agent_response": "".join(parts),
+            "channel": req.channel,
+            "session_id": req.session_id,
+        })
+
+    return StreamingResponse(_events(), media_type="text/event-stream")
+
+
 @app.post("/api/agents/{agent_id}/reset")
 async def reset_chat(agent_id: str, session_id: str = "default"):
     factory = get_factory()
@@ -335,11 +747,26 @@ async def switch_llm(agent_id: str, req: LLMSwitchRequest):
     return result
 
 
+PROVIDERS_TTL_S = 60
+
+
+@lru_cache(maxsize=1)
+def _providers_cached(bucket: int) -> Dict[str, Any]:
+    # One build per TTL window: a new bucket misses, evicting the old one.
+    # Re-read the API keys too, so a newly set key shows up within the window.
+    factory = get_factory()
+    factory.router.refresh()
+    return factory.list_providers()
+
+
+def _providers() -> Dict[str, Any]:
+    return _providers_cached(int(time.time()) // PROVIDERS_TTL_S)
+
+
 @app.get("/api/llm/providers")
 async def list_providers():
     """List all supported LLM providers and their models."""
-    factory = get_factory()
-    return factory.list_providers()
+    return _providers()
 
 
 # ------------------------------------------------------------------ #
@@ -350,7 +777,7 @@ async def list_providers():
 async def ingest_documents(agent_id: str, req: RAGIngestRequest):
     """Ingest documents into the agent's vector store."""
     factory = get_factory()
-    result = factory.ingest_documents(agent_id, req.documents)
+    result = await _prioritized(PRIORITY_INGEST, factory.ingest_documents, agent_id, req.documents)
     if "error" in result:
         raise HTTPException(400, result["error"])
     return result
@@ -360,9 +787,11 @@ async def ingest_documents(agent_id: str, req: RAGIngestRequest):
 async def upload_rag_file(agent_id: str, file: UploadFile = File(...)):
     """Upload a text/markdown file for RAG ingestion."""
     factory = get_factory()
-    content = await file.read()
-    text = content.decode("utf-8", errors="replace")
-    result = factory.ingest_documents(agent_id, [{"text": text, "source": file.filename}])
+    # Decoded and chunked piece by piece on a worker thread; the upload is
+    # never held in memory as one bytes + one str
+    result = await _prioritized(
+        PRIORITY_INGEST, factory.ingest_text_stream, agent_id, _iter_text(file.file), file.filename
+    )
     if "error" in result:
         raise HTTPException(400, result["error"])
     return {**result, "filename": file.filename}
@@ -389,7 +818,7 @@ async def rag_stats(agent_id: str):
 async def upload_soul(agent_id: str, soul_content: str = Form(...)):
     """Upload a .soul document to define agent personality."""
     factory = get_factory()
-    result = factory.upload_soul(agent_id, soul_content)
+    result = await run_in_threadpool(factory.upload_soul, agent_id, soul_content)
     if "error" in result:
         raise HTTPException(400, result["error"])
     return result
@@ -398,10 +827,9 @@ async def upload_soul(agent_id: str, soul_content: str = Form(...)):
 @app.post("/api/agents/{agent_id}/soul/file")
 async def upload_soul_file(agent_id: str, file: UploadFile = File(...)):
     """Upload a .soul file."""
-    content = await file.read()
-    soul_text = content.decode("utf-8", errors="replace")
+    soul_text = await run_in_threadpool(lambda: "".join(_iter_text(file.file)))
     factory = get_factory()
-    result = factory.upload_soul(agent_id, soul_text)
+    result = await run_in_threadpool(factory.upload_soul, agent_id, soul_text)
     if "error" in result:
         raise HTTPException(400, result["error"])
     return {**result, "filename": file.filename}
@@ -423,7 +851,7 @@ async def grok_chat(req: ChatRequest):
     """Direct Grok chat (not agent-specific)."""
     from agent_factory.integrations.xai import GrokChat
     grok = GrokChat()
-    result = grok.complete(messages=[{"role": "user", "content": req.message}])
+    result = await run_in_threadpool(grok.complete, messages=[{"role": "user", "content": req.message}])
     if "error" in result:
         raise HTTPException(500, result["error"])
     return result
@@ -434,7 +862,7 @@ async def grok_search(req: GrokSearchRequest):
     """Real-time search via Grok."""
     from agent_factory.integrations.xai import GrokSearch
     searcher = GrokSearch(model=req.model)
-    return searcher.search(req.query)
+    return await run_in_threadpool(searcher.search, req.query)
 
 
 @app.post("/api/grok/image")
@@ -442,7 +870,7 @@ async def grok_image_gen(req: ImageGenRequest):
     """Generate images via Grok Imagine."""
     from agent_factory.integrations.xai import GrokImageGen
     gen = GrokImageGen(model=req.model)
-    result = gen.generate(req.prompt, n=req.n, size=req.size)
+    result = await run_in_threadpool(gen.generate, req.prompt, n=req.n, size=req.size)
     if "error" in result:
         raise HTTPException(500, result["error"])
     return result
@@ -459,12 +887,13 @@ async def grok_vision(
     vision = GrokVision()
 
     if image:
-        import base64
-        content = await image.read()
-        b64 = base64.b64encode(content).decode()
-        result = vision.analyze(text, image_base64=b64, media_type=image.content_type or "image/jpeg")
+        # Raw bytes: analyze() encodes once, straight into the data URL
+        image_bytes = await run_in_threadpool(image.file.read)
+        result = await run_in_threadpool(
+            vision.analyze, text, image_bytes=image_bytes, media_type=image.content_type or "image/jpeg"
+        )
     elif image_url:
-        result = vision.analyze(text, image_url=image_url)
+        result = await run_in_threadpool(vision.analyze, text, image_url=image_url)
     else:
         raise HTTPException(400, "Provide image file or image_url")
 
@@ -481,7 +910,9 @@ async def grok_tts(req: TTSRequest):
     """
     from agent_factory.integrations.xai import GrokAudio
     tts = GrokAudio()
-    result = tts.synthesize(req.text, voice=req.voice, response_format=req.response_format, speed=req.speed)
+    result = await run_in_threadpool(
+        tts.synthesize, req.text, voice=req.voice, response_format=req.response_format, speed=req.speed
+    )
     if "error" in result:
         raise HTTPException(500, result["error"])
     fmt_to_mime = {"mp3": "audio/mpeg", "wav": "audio/wav", "opus": "audio/opus", "pcm": "audio/pcm"}
@@ -516,7 +947,7 @@ async def send_sms(agent_id: str, req: SMSRequest):
     """Send an SMS via Twilio."""
     from agent_factory.integrations.twilio_int import TwilioSMS
     sms = TwilioSMS()
-    result = sms.send(req.to, req.body, req.from_number)
+    result = await run_in_threadpool(sms.send, req.to, req.body, req.from_number)
     if "error" in result:
         raise HTTPException(500, result["error"])
     analytics = get_analytics()
@@ -527,7 +958,7 @@ async def send_sms(agent_id: str, req: SMSRequest):
 @app.get("/api/twilio/messages")
 async def list_twilio_messages():
     from agent_factory.integrations.twilio_int import TwilioSMS
-    return {"messages": TwilioSMS().list_messages()}
+    return {"messages": await run_in_threadpool(TwilioSMS().list_messages)}
 
 
 @app.post("/api/agents/{agent_id}/calls/make")
@@ -535,7 +966,7 @@ async def make_call(agent_id: str, req: CallRequest):
     """Initiate an outbound voice call."""
     from agent_factory.integrations.twilio_int import TwilioVoice
     voice = TwilioVoice()
-    result = voice.make_call(req.to, req.twiml_url, record=req.record)
+    result = await run_in_threadpool(voice.make_call, req.to, req.twiml_url, record=req.record)
     if "error" in result:
         raise HTTPException(500, result["error"])
     return result
@@ -544,7 +975,34 @@ async def make_call(agent_id: str, req: CallRequest):
 @app.get("/api/twilio/calls")
 async def list_calls():
     from agent_factory.integrations.twilio_int import TwilioVoice
-    return {"calls": TwilioVoice().list_calls()}
+    return {"calls": await run_in_threadpool(TwilioVoice().list_calls)}
+
+
+# TwiML shells, pre-encoded; handlers only join in the escaped variable parts
+_XML_DECL = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+_SMS_HEAD = _XML_DECL + b"<Response><Message>"
+_SMS_TAIL = b"</Message></Response>"
+_SAY_HEAD = _XML_DECL + b"<Response>\n    <Say>"
+_GATHER_HEAD = b'</Say>\n    <Gather input="speech" timeout="5" action="'
+_GATHER_TAIL = b'" method="POST"/>\n</Response>'
+_VOICE_GREETING = b"Welcome to Agent Factory. How can I help you today?"
+_VOICE_RESPONSE_PATH = "/api/twilio/webhook/voice-response"
+
+
+_XML_ESC = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+
+
+def _xml(text: str) -> bytes:
+    return text.translate(_XML_ESC).encode()
+
+
+def _voice_twiml(say: bytes, action: bytes) -> bytes:
+    return b"".join((_SAY_HEAD, say, _GATHER_HEAD, action, _GATHER_TAIL))
+
+
+@lru_cache(maxsize=16)
+def _inbound_voice_twiml(host: str) -> bytes:
+    return _voice_twiml(_VOICE_GREETING, _xml(host + _VOICE_RESPONSE_PATH))
 
 
 @app.post("/api/twilio/webhook/inbound-sms")
@@ -558,18 +1016,18 @@ async def twilio_inbound_sms(request: Request):
     body = form.get("Body", "")
     to_number = form.get("To", "")
 
-    # Find agent configured for this Twilio number (simplified: use first active agent)
+    # Agent bound to this Twilio number, else the first agent
     factory = get_factory()
-    agents = factory.list_agents()
-    agent_id = agents[0]["id"] if agents else None
+    agent_id = factory.inbound_agent_id(to_number)
 
     reply_text = "Agent Factory received your message."
     if agent_id and body:
-        result = factory.chat(agent_id, body, session_id=from_number, channel="sms")
+        result = await _prioritized(
+            PRIORITY_SMS, factory.chat, agent_id, body, session_id=from_number, channel="sms"
+        )
         reply_text = result.get("response", reply_text)
 
-    twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response><Message>{reply_text[:1600]}</Message></Response>"""
+    twiml = b"".join((_SMS_HEAD, _xml(reply_text[:1600]), _SMS_TAIL))
     return Response(content=twiml, media_type="application/xml")
 
 
@@ -580,13 +1038,7 @@ async def twilio_inbound_voice(request: Request):
     Returns TwiML to gather speech and route to agent.
     """
     host = str(request.base_url).rstrip("/")
-    twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>Welcome to Agent Factory. How can I help you today?</Say>
-    <Gather input="speech" timeout="5" action="{host}/api/twilio/webhook/voice-response" method="POST">
-    </Gather>
-</Response>"""
-    return Response(content=twiml, media_type="application/xml")
+    return Response(content=_inbound_voice_twiml(host), media_type="application/xml")
 
 
 @app.post("/api/twilio/webhook/voice-response")
@@ -597,22 +1049,17 @@ async def twilio_voice_response(request: Request):
     from_number = form.get("From", "")
 
     factory = get_factory()
-    agents = factory.list_agents()
-    agent_id = agents[0]["id"] if agents else None
+    agent_id = factory.inbound_agent_id(form.get("To", ""))
 
     reply_text = "I heard you. Please hold."
     if agent_id and speech_result:
-        result = factory.chat(agent_id, speech_result, session_id=from_number, channel="voice")
+        result = await _prioritized(
+            PRIORITY_VOICE, factory.chat, agent_id, speech_result, session_id=from_number, channel="voice"
+        )
         reply_text = result.get("response", reply_text)
 
     # Truncate for TTS
-    tts_text = reply_text[:500]
-    twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say>{tts_text}</Say>
-    <Gather input="speech" timeout="5" action="/api/twilio/webhook/voice-response" method="POST">
-    </Gather>
-</Response>"""
+    twiml = _voice_twiml(_xml(reply_text[:500]), _VOICE_RESPONSE_PATH.encode())
     return Response(content=twiml, media_type="application/xml")
 
 
@@ -626,15 +1073,21 @@ async def create_livekit_session(agent_id: str, req: LiveKitSessionRequest):
     import secrets
     livekit = get_livekit()
     session_id = req.session_id or secrets.token_urlsafe(8)
-    result = livekit.create_agent_session(agent_id, session_id, req.channel)
+    result = await run_in_threadpool(livekit.create_agent_session, agent_id, session_id, req.channel)
     if "error" in result:
         raise HTTPException(500, result["error"])
     return result
 
 
+@lru_cache(maxsize=1)
+def _livekit_status_body() -> bytes:
+    # Config and SDK availability are fixed for the life of the process
+    return _dumps(get_livekit().status())
+
+
 @app.get("/api/livekit/status")
 async def livekit_status():
-    return get_livekit().status()
+    return Response(content=_livekit_status_body(), media_type="application/json")
 
 
 # ------------------------------------------------------------------ #
@@ -702,13 +1155,12 @@ async def get_embed_snippet(agent_id: str, req: EmbedWidgetRequest, request: Req
 #  Platform info                                                       #
 # ------------------------------------------------------------------ #
 
-@app.get("/api/platform/info")
-async def platform_info():
-    factory = get_factory()
+@lru_cache(maxsize=1)
+def _platform_info() -> Dict[str, Any]:
+    """The static part of /api/platform/info; env flags don't change while running."""
     return {
         "platform": "Agent Factory",
         "version": "1.0.0",
-        "providers": factory.list_providers(),
         "features": {
             "rag": True,
             "soul_documents": True,
@@ -720,7 +1172,19 @@ async def platform_info():
             "elk_analytics": bool(os.getenv("ELASTICSEARCH_URL")),
         },
         "channels": ["chat", "voice", "video", "sms", "phone"],
-        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+
+@app.get("/api/platform/info")
+async def platform_info():
+    info = _platform_info()
+    return {
+        "platform": info["platform"],
+        "version": info["version"],
+        "providers": _providers(),
+        "features": info["features"],
+        "channels": info["channels"],
+        "timestamp": _utc_now_iso(),
     }
 
 
@@ -730,7 +1194,20 @@ async def platform_info():
 
 if __name__ == "__main__":
     import uvicorn
+    from importlib.util import find_spec
     port = int(os.getenv("PORT", 8000))
+    # Agents, sessions and in-memory RAG stores live in this process, so
+    # extra workers are opt-in for deployments that accept per-worker state
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
     print(f"\n🏭 Agent Factory Platform starting on http://0.0.0.0:{port}")
     print(f"📚 API Docs: http://0.0.0.0:{port}/api/docs")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "agent_factory_server:app" if workers > 1 else app,  # workers need an import string
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        loop="uvloop" if find_spec("uvloop") else "asyncio",
+        http="httptools" if find_spec("httptools") else "h11",
+        log_level="warning",
+        backlog=2048,
+    )
@@ -3,10 +3,37 @@ Base agent class for all AI agents in the system.
 """
 import json
 import os
-from typing import Dict, Any, List, Optional
-from anthropic import Anthropic
+import asyncio
+from typing import Dict, Any, List, Optional, Iterator
+from anthropic import Anthropic, AsyncAnthropic
 import openai
 from agents.tools import AgentTools
+from agents import response_cache
+
+KIMI_BASE_URL = "https://api.moonshot.cn/v1"  # Kimi API endpoint
+# Anthropic prompt-cache breakpoint: the prefix up to here is reused server-side
+_EPHEMERAL = {"type": "ephemeral"}
+_JSON_DECODER = json.JSONDecoder()
+
+MAX_HISTORY_MESSAGES = 20    # messages resent to the model per call
+MAX_HISTORY_TOKENS = 8000    # rough budget for them (~4 characters per token)
+
+
+def iter_json_objects(text: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield each top-level JSON object embedded in text, left to right. One
+    scan over the "{" positions: a parsed object is skipped as a whole.
+    """
+    pos = text.find("{")
+    while pos != -1:
+        try:
+            obj, end = _JSON_DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            pos = text.find("{", pos + 1)
+            continue
+        if isinstance(obj, dict):
+            yield obj
+        pos = text.find("{", end)
 
 
 class BaseAgent:
@@ -42,26 +69,39 @@ class BaseAgent:
         self.tools_enabled = tools_enabled
         self.max_tokens = max_tokens
         self.conversation_history: List[Dict[str, str]] = []
+        self.max_history_messages = MAX_HISTORY_MESSAGES
+        self.max_history_tokens = MAX_HISTORY_TOKENS
         self.tools = AgentTools()
+        self._async_client = None  # created on first chat_async()
+        self._system_cache = (None, "")  # (system_prompt, prompt + tool descriptions)
 
         # Initialize API clients
         if model_provider == "anthropic":
-            api_key = os.getenv("ANTHROPIC_API_KEY")
-            if not api_key:
+            self._api_key = os.getenv("ANTHROPIC_API_KEY")
+            if not self._api_key:
                 raise ValueError("ANTHROPIC_API_KEY not found in environment")
-            self.client = Anthropic(api_key=api_key)
+            self.client = Anthropic(api_key=self._api_key)
         elif model_provider == "kimi":
             # Kimi K2 uses OpenAI-compatible API
-            api_key = os.getenv("KIMI_API_KEY")
-            if not api_key:
+            self._api_key = os.getenv("KIMI_API_KEY")
+            if not self._api_key:
                 raise ValueError("KIMI_API_KEY not found in environment")
             self.client = openai.OpenAI(
-                api_key=api_key,
-                base_url="https://api.moonshot.cn/v1"  # Kimi API endpoint
+                api_key=self._api_key,
+                base_url=KIMI_BASE_URL
             )
         else:
             raise ValueError(f"Unsupported model provider: {model_provider}")
 
+    def _get_async_client(self):
+        """Async counterpart of self.client, for use from an event loop."""
+        if self._async_client is None:
+            if self.model_provider == "anthropic":
+                self._async_client = AsyncAnthropic(api_key=self._api_key)
+            else:
+                self._async_client = openai.AsyncOpenAI(api_key=self._api_key, base_url=KIMI_BASE_URL)
+        return self._async_client
+
     def _execute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a tool and return the result."""
         if not self.tools_enabled:
@@ -83,28 +123,11 @@ class BaseAgent:
             return None
 
         # Look for JSON tool requests in the response
-        try:
-            # Try to find JSON blocks in the response
-            lines = response_text.strip().split('\n')
-            for i, line in enumerate(lines):
-                if line.strip().startswith('{') and '"tool"' in line:
-                    # Try to parse as JSON
-                    try:
-                        tool_request = json.loads(line)
-                        if "tool" in tool_request and "parameters" in tool_request:
-                            return tool_request
-                    except json.JSONDecodeError:
-                        # Try multi-line JSON
-                        json_str = '\n'.join(lines[i:])
-                        try:
-                            tool_request = json.loads(json_str)
-                            if "tool" in tool_request and "parameters" in tool_request:
-                                return tool_request
-                        except json.JSONDecodeError:
-                            continue
-        except Exception:
-            pass
-
+        if '"tool"' not in response_text:
+            return None
+        for tool_request in iter_json_objects(response_text):
+            if "tool" in tool_request and "parameters" in tool_request:
+                return tool_request
         return None
 
     def chat(self, message: str, max_tool_iterations: int = 3) -> str:
@@ -123,6 +146,7 @@ class BaseAgent:
             "role": "user",
             "content": message
         })
+        self._trim_history()
 
         # Tool use loop
         for iteration in range(max_tool_iterations):
@@ -134,29 +158,13 @@ class BaseAgent:
             else:
                 response = "Error: Unsupported model provider"
 
-            # Add assistant response to history
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": response
-            })
-
-            # Check if agent wants to use a tool
-            tool_request = self._check_for_tool_use(response)
-
+            tool_request = self._record_response(response)
             if tool_request:
-                # Execute the tool
                 tool_result = self._execute_tool(
                     tool_request["tool"],
                     tool_request["parameters"]
                 )
-
-                # Add tool result to conversation
-                tool_message = f"Tool Result:\n{json.dumps(tool_result, indent=2)}"
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": tool_message
-                })
-
+                self._record_tool_result(tool_result)
                 # Continue the loop to get final response
             else:
                 # No tool use, return the response
@@ -165,57 +173,183 @@ class BaseAgent:
         # If we've exhausted iterations, return the last response
         return response
 
-    def _chat_anthropic(self) -> str:
-        """Get response from Anthropic's Claude."""
-        try:
-            # Build messages (exclude system message)
-            messages = self.conversation_history.copy()
+    async def chat_async(self, message: str, max_tool_iterations: int = 3) -> str:
+        """
+        chat() for use from an event loop: the model calls go through the
+        async client, so several agents can wait on their APIs at once.
+        """
+        self.conversation_history.append({
+            "role": "user",
+            "content": message
+        })
+        self._trim_history()
+
+        for iteration in range(max_tool_iterations):
+            if self.model_provider == "anthropic":
+                response = await self._chat_anthropic_async()
+            elif self.model_provider == "kimi":
+                response = await self._chat_kimi_async()
+            else:
+                response = "Error: Unsupported model provider"
+
+            tool_request = self._record_response(response)
+            if tool_request:
+                # Tools are blocking (HTTP, files): keep them off the loop
+                tool_result = await asyncio.to_thread(
+                    self._execute_tool,
+                    tool_request["tool"],
+                    tool_request["parameters"]
+                )
+                self._record_tool_result(tool_result)
+            else:
+                return response
 
-            # Add tool descriptions to system prompt if tools enabled
-            system_prompt = self.system_prompt
+        return response
+
+    def _record_response(self, response: str) -> Optional[Dict[str, Any]]:
+        """Add the model's response to history; return its tool request, if any."""
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": response
+        })
+        return self._check_for_tool_use(response)
+
+    def _record_tool_result(self, tool_result: Dict[str, Any]):
+        tool_message = f"Tool Result:\n{json.dumps(tool_result, indent=2)}"
+        self.conversation_history.append({
+            "role": "user",
+            "content": tool_message
+        })
+        self._trim_history()
+
+    def _trim_history(self):
+        """
+        Drop the oldest user/assistant pairs until the history fits both
+        limits, so each call resends a bounded window rather than the whole
+        session. Whole pairs keep roles alternating from a user turn; the
+        newest exchange is always kept.
+        """
+        history = self.conversation_history
+        tokens = sum(len(m["content"]) for m in history) // 4
+        drop = 0
+        while len(history) - drop > 2 and (
+            len(history) - drop > self.max_history_messages or tokens > self.max_history_tokens
+        ):
+            tokens -= (len(history[drop]["content"]) + len(history[drop + 1]["content"])) // 4
+            drop += 2
+        if drop:
+            del history[:drop]
+
+    def _system_prompt_with_tools(self) -> str:
+        """
+        The system prompt, with tool descriptions if tools are enabled.
+        Built once per system_prompt so every call sends the same bytes.
+        """
+        source, prompt = self._system_cache
+        if source != self.system_prompt:
+            prompt = self.system_prompt
             if self.tools_enabled:
-                system_prompt += "\n\n" + self.tools.get_tool_descriptions()
+                prompt += "\n\n" + self.tools.get_tool_descriptions()
+            self._system_cache = (self.system_prompt, prompt)
+        return prompt
 
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=self.max_tokens,
-                system=system_prompt,
-                messages=messages
-            )
+    def _anthropic_request(self) -> Dict[str, Any]:
+        """
+        Keyword arguments for messages.create (sync and async clients alike).
+        Cache breakpoints sit after the static system prompt and after the
+        newest message, so each turn re-reads the conversation so far from
+        Anthropic's prompt cache instead of paying for it in full.
+        """
+        messages = self.conversation_history.copy()
+        if messages:
+            last = messages[-1]
+            messages[-1] = {
+                "role": last["role"],
+                "content": [{"type": "text", "text": last["content"], "cache_control": _EPHEMERAL}],
+            }
+        return {
+            "model": self.model_name,
+            "max_tokens": self.max_tokens,
+            "system": [{"type": "text", "text": self._system_prompt_with_tools(), "cache_control": _EPHEMERAL}],
+            "messages": messages,
+        }
 
-            # Extract text from response
-            if hasattr(response, "content") and response.content:
-                first = response.content[0]
-                return getattr(first, "text", str(first))
+    def _kimi_request(self) -> Dict[str, Any]:
+        """Keyword arguments for chat.completions.create (sync and async clients alike)."""
+        messages = [{"role": "system", "content": self._system_prompt_with_tools()}]
+        messages.extend(self.conversation_history)
+        return {
+            "model": self.model_name if self.model_name.startswith("moonshot") else "moonshot-v1-8k",
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "temperature": 0.7,
+        }
+
+    @staticmethod
+    def _anthropic_text(response) -> str:
+        # Extract text from response
+        if hasattr(response, "content") and response.content:
+            first = response.content[0]
+            return getattr(first, "text", str(first))
+        return str(response)
 
-            return str(response)
+    def _chat_anthropic(self) -> str:
+        """Get response from Anthropic's Claude."""
+        request = self._anthropic_request()
+        key = response_cache.cache_key("anthropic", request)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            response = self.client.messages.create(**request)
+            text = self._anthropic_text(response)
+        except Exception as e:
+            return f"Error communicating with Claude: {str(e)}"
+        response_cache.put(key, text)
+        return text
+
+    async def _chat_anthropic_async(self) -> str:
+        request = self._anthropic_request()
+        key = response_cache.cache_key("anthropic", request)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            response = await self._get_async_client().messages.create(**request)
+            text = self._anthropic_text(response)
         except Exception as e:
             return f"Error communicating with Claude: {str(e)}"
+        response_cache.put(key, text)
+        return text
 
     def _chat_kimi(self) -> str:
         """Get response from Kimi K2."""
+        request = self._kimi_request()
+        key = response_cache.cache_key("kimi", request)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
         try:
-            # Build messages with system message
-            messages = [
-                {"role": "system", "content": self.system_prompt}
-            ]
-
-            # Add tool descriptions if tools enabled
-            if self.tools_enabled:
-                messages[0]["content"] += "\n\n" + self.tools.get_tool_descriptions()
-
-            messages.extend(self.conversation_history)
-
-            response = self.client.chat.completions.create(
-                model=self.model_name if self.model_name.startswith("moonshot") else "moonshot-v1-8k",
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=0.7
-            )
-
-            return response.choices[0].message.content
+            response = self.client.chat.completions.create(**request)
+            text = response.choices[0].message.content
+        except Exception as e:
+            return f"Error communicating with Kimi: {str(e)}"
+        response_cache.put(key, text)
+        return text
+
+    async def _chat_kimi_async(self) -> str:
+        request = self._kimi_request()
+        key = response_cache.cache_key("kimi", request)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            response = await self._get_async_client().chat.completions.create(**request)
+            text = response.choices[0].message.content
         except Exception as e:
             return f"Error communicating with Kimi: {str(e)}"
+        response_cache.put(key, text)
+        return text
 
     def reset_conversation(self):
         """Clear conversation history."""
@@ -21,6 +21,7 @@ import json
 import os
 import sys
 from datetime import date
+from pathlib import Path
 
 
 def create_robots_txt(domain: str) -> str:
@@ -31,24 +32,30 @@ Sitemap: https://{domain}/sitemap.xml
 """
 
 
-def create_sitemap_xml(domain: str, pages: list) -> str:
-    today = date.today().isoformat()
-    urls = ""
+SITEMAP_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+"""
+SITEMAP_FOOTER = "</urlset>\n"
+
+
+def iter_url_blocks(domain: str, pages: list, today: str):
+    """Yield one <url> entry per page; priorities may be strings or numbers."""
     for page in pages:
         url = page["url"].rstrip("/") or "/"
         priority = page.get("priority", "0.5")
         changefreq = "weekly" if float(priority) >= 0.7 else "monthly"
-        urls += f"""  <url>
+        yield f"""  <url>
     <loc>https://{domain}{url}</loc>
     <lastmod>{today}</lastmod>
     <changefreq>{changefreq}</changefreq>
     <priority>{priority}</priority>
   </url>
 """
-    return f"""<?xml version="1.0" encoding="UTF-8"?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
-{urls}</urlset>
-"""
+
+
+def create_sitemap_xml(domain: str, pages: list) -> str:
+    today = date.today().isoformat()
+    return SITEMAP_HEADER + "".join(iter_url_blocks(domain, pages, today)) + SITEMAP_FOOTER
 
 
 def main():
@@ -65,13 +72,15 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
 
     robots_path = os.path.join(output_dir, "robots.txt")
-    with open(robots_path, "w", encoding="utf-8") as f:
-        f.write(create_robots_txt(domain))
+    Path(robots_path).write_bytes(create_robots_txt(domain).encode("utf-8"))
     print(f"Created: {robots_path}")
 
     sitemap_path = os.path.join(output_dir, "sitemap.xml")
+    # Written entry by entry: no whole-sitemap string is ever built
     with open(sitemap_path, "w", encoding="utf-8") as f:
-        f.write(create_sitemap_xml(domain, pages))
+        f.write(SITEMAP_HEADER)
+        f.writelines(iter_url_blocks(domain, pages, date.today().isoformat()))
+        f.write(SITEMAP_FOOTER)
     print(f"Created: {sitemap_path}")
 
     print(f"\nDone — robots.txt and sitemap.xml for {domain}")
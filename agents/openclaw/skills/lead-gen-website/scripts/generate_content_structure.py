@@ -31,6 +31,7 @@ specs.json format:
 
 import json
 import sys
+from pathlib import Path
 
 
 def generate_page_section(page: dict) -> str:
@@ -84,8 +85,8 @@ def main():
     for page in specs.get("pages", []):
         lines.append(generate_page_section(page))
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+    # Joined and encoded once, written in a single unbuffered call
+    Path(output_path).write_bytes("\n".join(lines).encode("utf-8"))
 
     print(f"Created: {output_path} ({len(specs.get('pages', []))} pages)")
 
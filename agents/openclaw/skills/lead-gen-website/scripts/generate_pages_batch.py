@@ -16,22 +16,51 @@ import json
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
 
 
 def render_template(template: str, data: dict) -> str:
     """Replace all {{KEY}} placeholders in template with values from data."""
-    result = template
-    for key, value in data.items():
-        if isinstance(value, (list, dict)):
-            value = json.dumps(value, ensure_ascii=False, indent=2)
-        result = result.replace(f"{{{{{key}}}}}", str(value))
+    values = {
+        key: json.dumps(value, ensure_ascii=False, indent=2) if isinstance(value, (list, dict)) else str(value)
+        for key, value in data.items()
+    }
+    missing = []
+
+    def substitute(match: re.Match) -> str:
+        value = values.get(match.group(1))
+        if value is None:
+            missing.append(match.group(1))
+            return match.group(0)
+        return value
+
+    # One scan of the template, however many keys there are
+    result = PLACEHOLDER_RE.sub(substitute, template)
     # Warn about unreplaced placeholders
-    remaining = re.findall(r"\{\{(\w+)\}\}", result)
-    if remaining:
-        print(f"  Warning: unreplaced placeholders: {remaining}")
+    if missing:
+        print(f"  Warning: unreplaced placeholders: {missing}")
     return result
 
 
+_template = ""  # set in each worker process by _init_worker
+
+
+def _init_worker(template: str):
+    global _template
+    _template = template
+
+
+def _render_and_write(job: tuple) -> str:
+    page_data, output_dir = job
+    out_path = os.path.join(output_dir, page_data["filename"])
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(render_template(_template, page_data))
+    return out_path
+
+
 def main():
     if len(sys.argv) != 4:
         print(__doc__)
@@ -47,17 +76,20 @@ def main():
 
     os.makedirs(output_dir, exist_ok=True)
 
+    jobs = []
     for i, page_data in enumerate(pages):
-        filename = page_data.get("filename")
-        if not filename:
+        if not page_data.get("filename"):
             print(f"  Skipping entry {i}: no 'filename' key")
             continue
-
-        rendered = render_template(template, page_data)
-        out_path = os.path.join(output_dir, filename)
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(rendered)
-        print(f"  Created: {out_path}")
+        jobs.append((page_data, output_dir))
+
+    if jobs:
+        # Pages are independent: render + write them across processes. The
+        # template goes to each worker once, not with every page.
+        workers = min(os.cpu_count() or 1, len(jobs))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template,)) as ex:
+            for out_path in ex.map(_render_and_write, jobs):
+                print(f"  Created: {out_path}")
 
     print(f"\nDone — {len(pages)} pages generated in {output_dir}")
 
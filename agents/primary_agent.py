@@ -1,50 +1,28 @@
 """
 Primary orchestrator agent that routes requests to specialized agents.
 """
-from typing import Dict, Any, Optional
-from agents.base_agent import BaseAgent
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, Optional, List
+from agents.base_agent import BaseAgent, iter_json_objects
 from agents.specialized_agents import SpecializedAgentFactory
+from agents.semantic_router_cache import new_router_cache
 
+MAX_CONCURRENT_DELEGATIONS = 4  # specialists consulted at once for one request
 
-class PrimaryAgent:
+
+@lru_cache(maxsize=1)
+def _orchestrator_prompt() -> str:
     """
-    Primary orchestrator agent that:
-    1. Understands user requests
-    2. Decides which specialized agent(s) to use
-    3. Coordinates between multiple agents if needed
-    4. Synthesizes final responses
+    The primary agent's system prompt. The specialist list is fixed, so it
+    is rendered once and every request sends an identical, cacheable prefix.
     """
+    agent_types = SpecializedAgentFactory.get_all_agent_types()
+    agent_list = "\n".join([f"- {key}: {desc}" for key, desc in agent_types.items()])
 
-    def __init__(self, model_provider: str = "anthropic", model_name: str = "claude-sonnet-4-20250514"):
-        """
-        Initialize the primary agent.
-
-        Args:
-            model_provider: "anthropic" or "kimi"
-            model_name: Specific model to use
-        """
-        self.model_provider = model_provider
-        self.model_name = model_name
-
-        # Create the primary reasoning agent
-        self.agent = BaseAgent(
-            name="Primary Orchestrator",
-            role="Primary Agent & Task Router",
-            system_prompt=self._get_system_prompt(),
-            model_provider=model_provider,
-            model_name=model_name,
-            tools_enabled=True
-        )
-
-        # Cache for specialized agents (create on demand)
-        self.specialized_agents: Dict[str, BaseAgent] = {}
-
-    def _get_system_prompt(self) -> str:
-        """Get the system prompt for the primary agent."""
-        agent_types = SpecializedAgentFactory.get_all_agent_types()
-        agent_list = "\n".join([f"- {key}: {desc}" for key, desc in agent_types.items()])
-
-        return f"""You are the Primary Orchestrator Agent, a highly intelligent AI assistant that coordinates a team of specialized agents.
+    return f"""You are the Primary Orchestrator Agent, a highly intelligent AI assistant that coordinates a team of specialized agents.
 
 Your responsibilities:
 1. Understand user requests and determine the best approach
@@ -79,36 +57,64 @@ Your response:
     "task": "Research and provide best SEO practices for e-commerce websites, including on-page optimization, technical SEO, and content strategy"
 }}
 
+To consult several specialists, output one such JSON object per specialist;
+they work on their tasks in parallel.
+
 For direct responses, just respond normally without JSON formatting.
 
 Be helpful, intelligent, and efficient in routing tasks to get the best results for users."""
 
+
+class PrimaryAgent:
+    """
+    Primary orchestrator agent that:
+    1. Understands user requests
+    2. Decides which specialized agent(s) to use
+    3. Coordinates between multiple agents if needed
+    4. Synthesizes final responses
+    """
+
+    def __init__(self, model_provider: str = "anthropic", model_name: str = "claude-sonnet-4-20250514"):
+        """
+        Initialize the primary agent.
+
+        Args:
+            model_provider: "anthropic" or "kimi"
+            model_name: Specific model to use
+        """
+        self.model_provider = model_provider
+        self.model_name = model_name
+
+        # Create the primary reasoning agent
+        self.agent = BaseAgent(
+            name="Primary Orchestrator",
+            role="Primary Agent & Task Router",
+            system_prompt=self._get_system_prompt(),
+            model_provider=model_provider,
+            model_name=model_name,
+            tools_enabled=True
+        )
+
+        # Cache for specialized agents (create on demand)
+        self.specialized_agents: Dict[str, BaseAgent] = {}
+
+        # Routings of similar earlier messages in this session (None if off)
+        self.router_cache = new_router_cache()
+
+    def _get_system_prompt(self) -> str:
+        """Get the system prompt for the primary agent."""
+        return _orchestrator_prompt()
+
     def _parse_delegation(self, response: str) -> Optional[Dict[str, str]]:
         """Parse if the primary agent wants to delegate to a specialist."""
-        import json
+        delegations = self._parse_delegations(response)
+        return delegations[0] if delegations else None
 
-        try:
-            # Look for JSON in the response
-            lines = response.strip().split('\n')
-            for i, line in enumerate(lines):
-                if line.strip().startswith('{') and '"action"' in line and '"delegate"' in line:
-                    try:
-                        delegation = json.loads(line)
-                        if delegation.get("action") == "delegate":
-                            return delegation
-                    except json.JSONDecodeError:
-                        # Try multi-line JSON
-                        json_str = '\n'.join(lines[i:])
-                        try:
-                            delegation = json.loads(json_str)
-                            if delegation.get("action") == "delegate":
-                                return delegation
-                        except json.JSONDecodeError:
-                            continue
-        except Exception:
-            pass
-
-        return None
+    def _parse_delegations(self, response: str) -> List[Dict[str, str]]:
+        """Every delegation in the primary agent's response, in order."""
+        if '"delegate"' not in response:
+            return []
+        return [obj for obj in iter_json_objects(response) if obj.get("action") == "delegate"]
 
     def _get_or_create_specialist(self, agent_type: str) -> BaseAgent:
         """Get or create a specialized agent."""
@@ -130,32 +136,115 @@ Be helpful, intelligent, and efficient in routing tasks to get the best results
         Returns:
             Dict containing response and metadata
         """
-        # Get initial response from primary agent
-        primary_response = self.agent.chat(message)
-
-        # Check if primary agent wants to delegate
-        delegation = self._parse_delegation(primary_response)
-
-        if delegation:
-            agent_type = delegation.get("agent")
-            task = delegation.get("task")
-
-            if not agent_type or not task:
-                return {
-                    "response": "I wanted to delegate this task, but encountered an error in the delegation format.",
-                    "agent_used": "primary",
-                    "error": "Invalid delegation format"
-                }
+        vec = self.router_cache.embed(message) if self.router_cache else None
+        delegations = self._cached_routing(message, vec)
+        if delegations is None:
+            # Get initial response from primary agent
+            primary_response = self.agent.chat(message)
+
+            # Check if primary agent wants to delegate
+            delegations = self._parse_delegations(primary_response)
+            if not delegations:
+                return self._direct_result(primary_response)
+            self._remember_routing(vec, delegations)
+        if not all(d.get("agent") and d.get("task") for d in delegations):
+            return self._invalid_delegation_result()
+
+        agent_types = [d["agent"] for d in delegations]
+        try:
+            groups = self._group_tasks(delegations)
+            with ThreadPoolExecutor(max_workers=min(len(groups), MAX_CONCURRENT_DELEGATIONS)) as pool:
+                responses = dict(zip(groups, pool.map(
+                    lambda item: [self._get_or_create_specialist(item[0]).chat(t) for t in item[1]],
+                    groups.items()
+                )))
+            specialist_responses = self._flatten(delegations, responses)
+
+            # Have primary agent synthesize the specialists' responses
+            final_response = self.agent.chat(self._synthesis_prompt(specialist_responses))
+            return self._delegated_result(final_response, specialist_responses)
+        except Exception as e:
+            return self._delegation_error_result(agent_types, e)
+
+    async def chat_async(self, message: str) -> Dict[str, Any]:
+        """
+        chat() for use from an event loop. When the primary agent delegates
+        to several specialists, they are consulted concurrently, so the
+        request waits for the slowest of them rather than their sum.
+        """
+        vec = await asyncio.to_thread(self.router_cache.embed, message) if self.router_cache else None
+        delegations = self._cached_routing(message, vec)
+        if delegations is None:
+            primary_response = await self.agent.chat_async(message)
+
+            delegations = self._parse_delegations(primary_response)
+            if not delegations:
+                return self._direct_result(primary_response)
+            self._remember_routing(vec, delegations)
+        if not all(d.get("agent") and d.get("task") for d in delegations):
+            return self._invalid_delegation_result()
+
+        agent_types = [d["agent"] for d in delegations]
+        try:
+            groups = self._group_tasks(delegations)
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_DELEGATIONS)
 
-            try:
-                # Get the specialist
+            async def _consult(agent_type: str, tasks: List[str]) -> List[str]:
                 specialist = self._get_or_create_specialist(agent_type)
+                async with semaphore:
+                    # One specialist's tasks share its history, so they run in order
+                    return [await specialist.chat_async(task) for task in tasks]
 
-                # Have the specialist handle the task
-                specialist_response = specialist.chat(task)
+            results = await asyncio.gather(*(_consult(t, tasks) for t, tasks in groups.items()))
+            specialist_responses = self._flatten(delegations, dict(zip(groups, results)))
 
-                # Have primary agent synthesize the specialist's response
-                synthesis_prompt = f"""The {agent_type} specialist provided this response to the user's request:
+            final_response = await self.agent.chat_async(self._synthesis_prompt(specialist_responses))
+            return self._delegated_result(final_response, specialist_responses)
+        except Exception as e:
+            return self._delegation_error_result(agent_types, e)
+
+    def _cached_routing(self, message: str, vec) -> Optional[List[Dict[str, str]]]:
+        """
+        Delegations for a message similar to one routed earlier: the same
+        specialists, each given this message as its task. Recorded in the
+        primary agent's history as if it had just produced them.
+        """
+        if vec is None:
+            return None
+        agent_types = self.router_cache.lookup(vec)
+        if not agent_types:
+            return None
+        delegations = [{"action": "delegate", "agent": t, "task": message} for t in agent_types]
+        self.agent.conversation_history.append({"role": "user", "content": message})
+        self.agent.conversation_history.append({
+            "role": "assistant",
+            "content": "\n".join(json.dumps(d) for d in delegations)
+        })
+        return delegations
+
+    def _remember_routing(self, vec, delegations: List[Dict[str, str]]):
+        if vec is not None and all(d.get("agent") and d.get("task") for d in delegations):
+            self.router_cache.add(vec, tuple(dict.fromkeys(d["agent"] for d in delegations)))
+
+    @staticmethod
+    def _group_tasks(delegations: List[Dict[str, str]]) -> Dict[str, List[str]]:
+        """agent_type -> its tasks, in delegation order."""
+        groups: Dict[str, List[str]] = {}
+        for d in delegations:
+            groups.setdefault(d["agent"], []).append(d["task"])
+        return groups
+
+    @staticmethod
+    def _flatten(delegations: List[Dict[str, str]], responses: Dict[str, List[str]]) -> List[tuple]:
+        """(agent_type, response) per delegation, back in delegation order."""
+        remaining = {agent_type: iter(r) for agent_type, r in responses.items()}
+        return [(d["agent"], next(remaining[d["agent"]])) for d in delegations]
+
+    @staticmethod
+    def _synthesis_prompt(specialist_responses: List[tuple]) -> str:
+        if len(specialist_responses) == 1:
+            agent_type, specialist_response = specialist_responses[0]
+            return f"""The {agent_type} specialist provided this response to the user's request:
 
 ---
 {specialist_response}
@@ -163,29 +252,51 @@ Be helpful, intelligent, and efficient in routing tasks to get the best results
 
 Please synthesize this into a helpful response for the user. Add any additional context or suggestions if appropriate."""
 
-                final_response = self.agent.chat(synthesis_prompt)
-
-                return {
-                    "response": final_response,
-                    "agent_used": agent_type,
-                    "specialist_response": specialist_response,
-                    "delegated": True
-                }
-
-            except Exception as e:
-                return {
-                    "response": f"I attempted to delegate to the {agent_type} specialist, but encountered an error: {str(e)}",
-                    "agent_used": "primary",
-                    "error": str(e),
-                    "delegated": False
-                }
-        else:
-            # Primary agent handled it directly
-            return {
-                "response": primary_response,
-                "agent_used": "primary",
-                "delegated": False
-            }
+        sections = "\n\n".join(
+            f"The {agent_type} specialist responded:\n---\n{response}\n---"
+            for agent_type, response in specialist_responses
+        )
+        return f"""Several specialists worked on the user's request.
+
+{sections}
+
+Please synthesize these into a single helpful response for the user. Add any additional context or suggestions if appropriate."""
+
+    @staticmethod
+    def _direct_result(primary_response: str) -> Dict[str, Any]:
+        # Primary agent handled it directly
+        return {
+            "response": primary_response,
+            "agent_used": "primary",
+            "delegated": False
+        }
+
+    @staticmethod
+    def _invalid_delegation_result() -> Dict[str, Any]:
+        return {
+            "response": "I wanted to delegate this task, but encountered an error in the delegation format.",
+            "agent_used": "primary",
+            "error": "Invalid delegation format"
+        }
+
+    @staticmethod
+    def _delegated_result(final_response: str, specialist_responses: List[tuple]) -> Dict[str, Any]:
+        return {
+            "response": final_response,
+            "agent_used": ", ".join(dict.fromkeys(t for t, _ in specialist_responses)),
+            "specialist_response": "\n\n".join(r for _, r in specialist_responses),
+            "delegated": True
+        }
+
+    @staticmethod
+    def _delegation_error_result(agent_types: List[str], e: Exception) -> Dict[str, Any]:
+        agent_type = ", ".join(dict.fromkeys(agent_types))
+        return {
+            "response": f"I attempted to delegate to the {agent_type} specialist, but encountered an error: {str(e)}",
+            "agent_used": "primary",
+            "error": str(e),
+            "delegated": False
+        }
 
     def reset(self):
         """Reset all conversation history."""
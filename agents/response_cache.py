@@ -0,0 +1,86 @@
+"""
+Exact-match cache for model responses.
+Keyed by a hash of the full request (provider, model, max_tokens, system
+prompt, messages); an identical request is answered without an API call.
+Off unless MIMI_RESPONSE_CACHE=1; MIMI_RESPONSE_CACHE_DB adds a SQLite tier
+that survives restarts.
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+ENABLED = os.getenv("MIMI_RESPONSE_CACHE") == "1"
+CACHE_DB = os.getenv("MIMI_RESPONSE_CACHE_DB")  # optional on-disk second tier
+MAX_ENTRIES = 1024  # in-memory LRU size
+
+_memory: "OrderedDict[str, str]" = OrderedDict()
+_lock = threading.Lock()
+_db: Optional[sqlite3.Connection] = None
+
+
+def _get_db() -> Optional[sqlite3.Connection]:
+    global _db
+    if _db is None and CACHE_DB:
+        os.makedirs(os.path.dirname(os.path.abspath(CACHE_DB)), exist_ok=True)
+        _db = sqlite3.connect(CACHE_DB, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return _db
+
+
+def cache_key(provider: str, request: Dict[str, Any]) -> Optional[str]:
+    """Key for a request's kwargs, or None when caching is off."""
+    if not ENABLED:
+        return None
+    payload = json.dumps([provider, request], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def get(key: Optional[str]) -> Optional[str]:
+    if key is None:
+        return None
+    with _lock:
+        value = _memory.get(key)
+        if value is not None:
+            _memory.move_to_end(key)
+            return value
+        db = _get_db()
+        if db is None:
+            return None
+        row = db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        _remember(key, row[0])
+        return row[0]
+
+
+def put(key: Optional[str], value: str):
+    if key is None or not value:
+        return
+    with _lock:
+        _remember(key, value)
+        db = _get_db()
+        if db is not None:
+            with db:
+                db.execute("INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)", (key, value))
+
+
+def _remember(key: str, value: str):
+    _memory[key] = value
+    _memory.move_to_end(key)
+    if len(_memory) > MAX_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def clear():
+    """Drop every cached response (both tiers)."""
+    with _lock:
+        _memory.clear()
+        db = _get_db()
+        if db is not None:
+            with db:
+                db.execute("DELETE FROM responses")
@@ -0,0 +1,86 @@
+"""
+Semantic cache for PrimaryAgent routing decisions.
+A message whose embedding is close enough to one routed before reuses the
+specialist types chosen for it instead of asking the router model again.
+Each PrimaryAgent (one per session) has its own cache, so routings never
+cross sessions. Opt-in: MIMI_ROUTER_CACHE=1, with numpy and an OpenAI key.
+"""
+import os
+import threading
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: without it there is no router cache
+    np = None
+
+EMBED_MODEL = "text-embedding-3-small"
+SIMILARITY_THRESHOLD = 0.92  # cosine similarity needed to reuse a routing
+MAX_ENTRIES = 64             # per session; oldest routings are overwritten past this
+
+
+@lru_cache(maxsize=4)
+def _openai_client(api_key: str):
+    import openai
+    return openai.OpenAI(api_key=api_key)
+
+
+class SemanticRouterCache:
+    """Ring buffer of (unit embedding, agent types), searched with one matrix product."""
+
+    def __init__(self, api_key: str, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = MAX_ENTRIES):
+        self._client = _openai_client(api_key)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._matrix = None  # (max_entries, dim) float32, allocated on first add
+        self._routes: List[Optional[Tuple[str, ...]]] = [None] * max_entries
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def embed(self, message: str):
+        """Unit-length embedding of a message, or None if the API call fails."""
+        try:
+            data = self._client.embeddings.create(model=EMBED_MODEL, input=[message[:8000]]).data
+        except Exception:
+            return None
+        vec = np.asarray(data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def lookup(self, vec) -> Optional[Tuple[str, ...]]:
+        """Agent types routed to for the most similar message above the threshold."""
+        if vec is None:
+            return None
+        with self._lock:
+            if not self._count:
+                return None
+            scores = self._matrix[:self._count] @ vec
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return self._routes[best]
+
+    def add(self, vec, agent_types: Tuple[str, ...]):
+        if vec is None or not agent_types:
+            return
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+            slot = self._next
+            self._matrix[slot] = vec
+            self._routes[slot] = tuple(agent_types)
+            self._next = (slot + 1) % self.max_entries
+            self._count = min(self._count + 1, self.max_entries)
+
+
+def new_router_cache() -> Optional[SemanticRouterCache]:
+    """A cache for one PrimaryAgent, or None unless enabled and available."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if np is None or not api_key or os.getenv("MIMI_ROUTER_CACHE") != "1":
+        return None
+    try:
+        return SemanticRouterCache(api_key)
+    except ImportError:
+        return None
@@ -4,6 +4,7 @@ Provides REST API endpoints and serves the web UI.
 """
 import os
 import json
+import asyncio
 from typing import Dict, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
@@ -69,6 +70,8 @@ if os.path.exists(assets_path):
 
 # Global state
 sessions: Dict[str, PrimaryAgent] = {}
+# One turn at a time per session: concurrent chat_async calls would interleave history
+session_locks: Dict[str, asyncio.Lock] = {}
 current_model_provider = "anthropic"
 current_model_name = "claude-sonnet-4-20250514"
 
@@ -83,6 +86,13 @@ def get_or_create_session(session_id: str) -> PrimaryAgent:
     return sessions[session_id]
 
 
+def get_session_lock(session_id: str) -> asyncio.Lock:
+    """Lock serializing turns within one session."""
+    if session_id not in session_locks:
+        session_locks[session_id] = asyncio.Lock()
+    return session_locks[session_id]
+
+
 @app.get("/", response_class=HTMLResponse)
 async def serve_ui():
     """Serve the web UI."""
@@ -364,7 +374,8 @@ async def chat(request: ChatRequest):
         primary_agent = get_or_create_session(request.session_id)
 
         # Process message
-        result = primary_agent.chat(request.message)
+        async with get_session_lock(request.session_id):
+            result = await primary_agent.chat_async(request.message)
 
         return ChatResponse(
             response=result["response"],
@@ -381,7 +392,8 @@ async def chat(request: ChatRequest):
 async def reset_session(session_id: str = "default"):
     """Reset a session's conversation history."""
     if session_id in sessions:
-        sessions[session_id].reset()
+        async with get_session_lock(session_id):
+            sessions[session_id].reset()
         return {"status": "success", "message": f"Session {session_id} reset"}
     else:
         return {"status": "success", "message": "Session not found (nothing to reset)"}